@@ -1,46 +1,134 @@
 # Importing necessary libraries
-import time, os
-from datetime import datetime, timedelta
+import time, os, sys, base64, re, csv, io, json, math, threading, weakref
+import click
+from datetime import datetime, timedelta, timezone
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import or_, and_, case, func, select, text, insert, update, delete, bindparam, table, column
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import relationship
 from flask_cors import CORS
-from flask import Flask, jsonify, request, abort, render_template
+from flask import Blueprint, Flask, Response, current_app, g, jsonify, request, abort, render_template, send_from_directory, stream_with_context
 from functools import wraps
 import jwt
-from flask_bcrypt import Bcrypt
-from flask_jwt_extended import JWTManager, create_access_token, get_jwt_identity, jwt_required
-from icecream import ic # Debugging tool
-from werkzeug.utils import secure_filename
-
-# Initialize Flask app
-app = Flask(__name__)
-app.secret_key = 'secret-secret-key' # Secret key for encoding session cookies and JWTs
+from flask_jwt_extended import JWTManager, create_access_token, decode_token, get_jwt, get_jwt_identity, jwt_required
+from werkzeug.middleware.proxy_fix import ProxyFix
+from cache import ResponseCache
+from migrations import upgrade as upgrade_schema
+from hashing import HashingPool, HashingPoolSaturated
+from images import store_image, make_thumbnail, is_content_addressed
+from database import engine_options, configure_engine
+from metrics import RequestMetrics
+from serializers import Field, Serializer, FastJSONProvider, format_datetime
+import circulation
+from suggest import SuggestIndex
+from compression import ENCODINGS, COMPRESSIBLE_TYPES, compress
+from reminders import OverdueSweeper, sweep as sweep_overdue
+from config import load_config
+from ratelimit import create_store as create_rate_limit_store
+
 admin_password = "admin" # Password for admin user authentication
 
-# Configuration for file uploads
-UPLOAD_FOLDER = 'uploads'
+# Configuration for file uploads, the folder itself is the UPLOAD_FOLDER setting in config.py
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-
-# Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] ='sqlite:///library.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['JWT_SECRET_KEY'] = 'secret-secret-key'
-
-# Initialize database, bcrypt for password hashing, JWT Manager, and CORS support
-db = SQLAlchemy(app)
-bcrypt = Bcrypt(app)
-jwt = JWTManager(app)
-CORS(app, supports_credentials=True)
+THUMBNAIL_SIZE = (200, 300) # Maximum width and height of the cover thumbnails shown in the catalog grid
+IMAGE_MAX_AGE = 365 * 24 * 3600 # Seconds browsers may cache a content-addressed image, its content never changes
+
+# Number of copies a new book gets when the admin doesn't specify it
+DEFAULT_COPIES = 2
+
+# Loan duration in days for each loan type
+LOAN_DURATIONS = {1: 10, 2: 5, 3: 2}
+
+# Configuration for bulk catalog imports
+IMPORT_BATCH_SIZE = 1000 # Rows inserted per transaction when the client doesn't ask for a batch size
+MAX_IMPORT_BATCH_SIZE = 10000 # Upper bound on the batch size a client can request
+MAX_IMPORT_ERRORS = 1000 # Row errors listed in the import report, later ones are only counted
+IMPORT_FIELD_SIZE_LIMIT = 4096 # Characters allowed in one CSV field, far above any valid value (descriptions are at most 500)
+
+# Maximum number of books or loans in one batch checkout or return request
+MAX_BATCH_ITEMS = 500
+
+# Number of titles and authors suggested by /books/suggest, by default and at most
+DEFAULT_SUGGEST_LIMIT = 10
+MAX_SUGGEST_LIMIT = 50
+
+# Number of books, authors and cities listed by /admin/stats when the client doesn't ask for a number
+DEFAULT_STATS_TOP = 10
+
+# Loan history rows deleted per transaction when pruning, so pruning never holds a long write lock
+HISTORY_PRUNE_BATCH_SIZE = 10000
+
+# Configuration for paginated listings
+DEFAULT_PAGE_SIZE = 50 # Number of rows returned when the client doesn't ask for a limit
+MAX_PAGE_SIZE = 200 # Upper bound on the number of rows a client can request per page
+EXPORT_BATCH_SIZE = 1000 # Number of rows fetched from the database at a time when streaming an export
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'} # Supported export formats and their content types
+
+# Configuration for password hashing, the pool itself is configured by the BCRYPT_LOG_ROUNDS and HASHING_* settings in config.py
+HASHING_RETRY_AFTER = 1 # Seconds a client is asked to wait when the hashing pool is saturated
+
+# Configuration for authorization
+ROLE_CACHE_TTL = 60 # Seconds an account's role is trusted before it is checked against the database again
+
+# Rate limits per route as (key, requests, period): each key gets a burst of `requests`, then `requests` per `period` seconds.
+# Keys are 'ip' (client address), 'user' (JWT identity, the address for anonymous clients) and 'email' (the login email).
+# A request must pass every limit of its route. Override with RATE_LIMITS in the config passed to create_app.
+RATE_LIMITS = {
+    # Logins are bcrypt-bound. The second limit slows guessing one account's password, and is kept per address as well
+    # so nobody can lock a user out by sending logins for their email.
+    '/login': [('ip', 10, 60), ('ip_email', 5, 60)],
+    '/signup': [('ip', 5, 60)],
+    '/books': [('user', 50, 5)],
+    '/books/search': [('user', 20, 5)],
+    '/books/suggest': [('user', 40, 2)], # One request per keystroke.
+}
+RATE_LIMIT_MESSAGE = 'Too many requests, please try again later.'
+MAX_TOKEN_IDENTITIES = 10000 # Verified access tokens remembered for rate limiting, the cache is emptied when it fills up
+
+# Database and JWT Manager, bound to the app by create_app
+# The settings come from config.py, so importing this module reads nothing from the environment and opens no connections.
+db = SQLAlchemy()
+jwt = JWTManager()
+
+# Routes and CLI commands, registered on the app by create_app
+bp = Blueprint('library', __name__, cli_group=None)
+
+# State kept in memory for one app, made by create_app and stored in app.extensions['library']
+# Each app has its own, so two apps in one process (e.g. on different databases) never see each other's cached data.
+class LibraryState:
+    def __init__(self, config):
+        slow_query_ms = config['SLOW_QUERY_MS']
+        self.request_metrics = RequestMetrics(slow_query_ms / 1000 if slow_query_ms is not None else None)
+        self.hashing_pool = HashingPool(config['BCRYPT_LOG_ROUNDS'], config['HASHING_WORKERS'], config['HASHING_MAX_PENDING'])
+        self.overdue_sweeper = OverdueSweeper(config['OVERDUE_SWEEP_INTERVAL'], config['OVERDUE_SWEEP_BATCH_SIZE'])
+        # Token buckets behind the rate limits, in process memory unless RATE_LIMIT_STORAGE_URL names a shared store
+        self.rate_limit_store = create_rate_limit_store(config['RATE_LIMIT_STORAGE_URL'])
+        # Cache for serialized catalog responses, entries are keyed on the catalog version so a bump makes them unreachable
+        self.response_cache = ResponseCache(config['RESPONSE_CACHE_SIZE'], config['RESPONSE_CACHE_BYTES'])
+        # Prefix index of titles and authors for /books/suggest, built from the books table on first use
+        # and rebuilt when another process changed titles or authors (see catalog_versions)
+        self.suggest_index = SuggestIndex()
+        self.suggest_index_lock = threading.Lock()
+        self.suggest_version = None # The 'titles' catalog version the index holds, None until it is built
+        # Recently checked account roles by user ID, as (account or None for deleted users, expiry time)
+        self.role_cache = {}
+        # Identities of recently verified access tokens by token, as (identity, expiry time), so rate limiting decodes a token once
+        self.token_identities = {}
+
+# Function to get the state of the current app
+def library():
+    return current_app.extensions['library']
 
 # Define User model for database
 class Users(db.Model):
+    # Indexes for the /customers filters, the ID follows the city and account for the cursor. Must match migrations.py.
+    __table_args__ = (db.Index('ix_users_city_id', 'city', 'id'), db.Index('ix_users_account_id', 'account', 'id'))
     id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(50), nullable = False)
-    email = db.Column(db.String(100), nullable = False)
+    username = db.Column(db.String(50), nullable = False, index = True)
+    email = db.Column(db.String(100), nullable = False, unique = True, index = True)
     password = db.Column(db.String(100), nullable = False)
     city = db.Column(db.String(50), nullable = False)
-    age = db.Column(db.Integer, nullable = False)
+    age = db.Column(db.Integer, nullable = False, index = True)
     account = db.Column(db.String(10), nullable = False)
     loans = relationship('Loans', back_populates='user')
 
@@ -48,29 +136,476 @@ class Users(db.Model):
 class Books(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable = False)
-    author = db.Column(db.String(50), nullable = False)
+    author = db.Column(db.String(50), nullable = False, index = True)
     year_published = db.Column(db.Integer, nullable = False)
     description = db.Column(db.String(500))
     image = db.Column(db.String(255))
+    thumbnail = db.Column(db.String(255))
     loan_type = db.Column(db.Integer, nullable = False)
-    status = db.Column(db.String(20), nullable = False)
-    copyStatus = db.Column(db.String(20), nullable = False)
+    total_copies = db.Column(db.Integer, nullable = False, default = 2)
+    available_copies = db.Column(db.Integer, nullable = False, default = 2)
     loan_info = relationship('Loans', back_populates='book')
 
 # Define Loan model for database
 class Loans(db.Model):
+    # Composite index for loans by user, and by user and book. Indexes must match the ones added in migrations.py.
+    # AUTOINCREMENT keeps SQLite from giving a new loan the ID of a returned one, which loan_history and reminders refer to.
+    __table_args__ = (db.Index('ix_loans_user_id_book_id', 'user_id', 'book_id'), {'sqlite_autoincrement': True})
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False)
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False, index=True)
     loan_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    return_date = db.Column(db.DateTime, nullable=True)
+    return_date = db.Column(db.DateTime, nullable=True, index=True)
     user = relationship('Users', back_populates='loans')
     book = relationship('Books', back_populates='loan_info')
 
+# Define LoanHistory model for returned loans, rows are only ever added on return and removed in bulk when old
+# There are no foreign keys, so the history outlives deleted users and books. Indexes must match migrations.py.
+class LoanHistory(db.Model):
+    __tablename__ = 'loan_history'
+    __table_args__ = (db.Index('ix_loan_history_user_id_returned_at', 'user_id', 'returned_at'),)
+    id = db.Column(db.Integer, primary_key=True)
+    loan_id = db.Column(db.Integer, nullable=False)  # ID the loan had while it was active.
+    user_id = db.Column(db.Integer, nullable=False)
+    book_id = db.Column(db.Integer, nullable=False)
+    loan_date = db.Column(db.DateTime, nullable=False)
+    due_date = db.Column(db.DateTime, nullable=True)  # The loan's return date, when the book was due back.
+    returned_at = db.Column(db.DateTime, nullable=False, index=True)  # When the book was actually returned, in UTC.
+
+# Define Reminders model for the outbox written by the overdue sweep, see reminders.py. Must match migrations.py.
+class Reminders(db.Model):
+    __table_args__ = (
+        db.Index('ux_reminders_loan_id_due_date', 'loan_id', 'due_date', unique=True),  # One reminder per loan and due date.
+        db.Index('ix_reminders_due_date', 'due_date'),
+        db.Index('ix_reminders_sent_at', 'sent_at'),  # Reminders still to send.
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    loan_id = db.Column(db.Integer, nullable=False)  # No foreign keys, the loan is deleted when the book is returned.
+    user_id = db.Column(db.Integer, nullable=False)
+    book_id = db.Column(db.Integer, nullable=False)
+    due_date = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    sent_at = db.Column(db.DateTime, nullable=True)  # Set by whatever delivers the reminder.
+
+# Define CatalogVersions model for the catalog change counters shared by every server process. Must match migrations.py.
+# 'books' is incremented by every change to books or their copies, 'titles' only by changes to titles and authors.
+class CatalogVersions(db.Model):
+    __tablename__ = 'catalog_versions'
+    name = db.Column(db.String(20), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, server_default='0')
+
+# Define CirculationStats model for the counters behind /admin/stats, see circulation.py. Must match migrations.py.
+class CirculationStats(db.Model):
+    __tablename__ = 'circulation_stats'
+    __table_args__ = (db.Index('ix_circulation_stats_scope_loans', 'scope', 'loans'),)
+    scope = db.Column(db.String(10), primary_key=True)  # 'total', 'book', 'author' or 'city'.
+    subject = db.Column(db.String(100), primary_key=True)  # Book ID, author name or city, '' for the totals.
+    books = db.Column(db.Integer, nullable=False, server_default='0')
+    copies = db.Column(db.Integer, nullable=False, server_default='0')
+    loans = db.Column(db.Integer, nullable=False, server_default='0')  # Loans ever made.
+    active_loans = db.Column(db.Integer, nullable=False, server_default='0')
+    returns = db.Column(db.Integer, nullable=False, server_default='0')
+
+# Define CirculationOverdue model for the overdue loan counter, one row advanced by the overdue sweep. Must match migrations.py.
+class CirculationOverdue(db.Model):
+    __tablename__ = 'circulation_overdue'
+    id = db.Column(db.Integer, primary_key=True)
+    loans = db.Column(db.Integer, nullable=False, server_default='0')  # Active loans that fell due before counted_through.
+    counted_through = db.Column(db.DateTime, nullable=False)
+
+# Function to check if the database has the FTS5 search index, other backends search with LIKE and skip indexing
+def uses_search_index():
+    return db.engine.dialect.name == 'sqlite'
+
+# Full-text search index over the book catalog, the FTS5 rowid is the book ID
+books_fts = table('books_fts', column('rowid'))
+
+def create_search_index():
+    if not uses_search_index():
+        return
+    db.session.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(name, author, description)"
+    ))
+    db.session.commit()
+
+# Function to add or refresh a book in the search index, runs inside the caller's transaction
+def index_book(book):
+    if not uses_search_index():
+        return
+    unindex_book(book.id)
+    db.session.execute(
+        text("INSERT INTO books_fts (rowid, name, author, description) VALUES (:id, :name, :author, :description)"),
+        {'id': book.id, 'name': book.name, 'author': book.author, 'description': book.description or ''}
+    )
+
+# Function to add many new books to the search index at once, runs inside the caller's transaction
+def index_new_books(books):
+    if not uses_search_index():
+        return
+    db.session.execute(
+        text("INSERT INTO books_fts (rowid, name, author, description) VALUES (:id, :name, :author, :description)"),
+        [{'id': book['id'], 'name': book['name'], 'author': book['author'], 'description': book['description'] or ''} for book in books]
+    )
+
+# Function to remove a book from the search index, runs inside the caller's transaction
+def unindex_book(book_id):
+    if not uses_search_index():
+        return
+    db.session.execute(text("DELETE FROM books_fts WHERE rowid = :id"), {'id': book_id})
+
+# Function to rebuild the whole search index from the books table
+def rebuild_search_index():
+    if not uses_search_index():
+        return
+    create_search_index()
+    db.session.execute(text("DELETE FROM books_fts"))
+    db.session.execute(text(
+        "INSERT INTO books_fts (rowid, name, author, description) "
+        "SELECT id, name, author, COALESCE(description, '') FROM books"
+    ))
+    db.session.commit()
+
+# Function to get the suggestion index, built from the books table on first use and rebuilt once titles changed in another process
+# Only one thread builds it. Before the first build the others wait, afterwards they keep using the old entries until it is done.
+def get_suggest_index():
+    state = library()
+    titles = catalog_versions()['titles']
+    if state.suggest_version != titles and state.suggest_index_lock.acquire(blocking=not state.suggest_index.built):
+        try:
+            if state.suggest_version != titles:
+                state.suggest_index.build(db.session.execute(select(Books.name, Books.author).execution_options(yield_per=EXPORT_BATCH_SIZE)))
+                state.suggest_version = titles
+        finally:
+            state.suggest_index_lock.release()
+    return state.suggest_index
+
+# Function to apply a committed change of titles and authors to the suggestion index, titles is the version returned by
+# bump_catalog_version. If other processes changed titles since the index was synced, it is rebuilt on next use instead.
+def update_suggestions(titles, removed=(), added=()):
+    state = library()
+    if not state.suggest_index_lock.acquire(blocking=False):
+        return  # Being rebuilt, the next use sees the new version and rebuilds again.
+    try:
+        if state.suggest_version != titles - 1:
+            state.suggest_version = None
+            return
+        for name, author in removed:
+            state.suggest_index.remove(name, author)
+        for name, author in added:
+            state.suggest_index.add(name, author)
+        state.suggest_version = titles
+    finally:
+        state.suggest_index_lock.release()
+
+# Function to turn free text into a safe FTS5 query, every word must match and the last one may be a prefix
+def build_search_query(q):
+    words = re.findall(r'\w+', q)
+    if not words:
+        return None
+    terms = ['"%s"' % word for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+# Function to build the search condition for databases without the search index, every word must appear in a text column
+def build_search_filter(q):
+    conditions = []
+    for word in re.findall(r'\w+', q):
+        pattern = '%' + word.replace('_', '\\_') + '%'  # \w matches "_", which is a LIKE wildcard.
+        conditions.append(or_(
+            Books.name.ilike(pattern, escape='\\'),
+            Books.author.ilike(pattern, escape='\\'),
+            Books.description.ilike(pattern, escape='\\')
+        ))
+    return and_(*conditions)
+
+# Command to apply pending schema migrations to the database: flask --app app db-upgrade
+@bp.cli.command('db-upgrade')
+def db_upgrade_command():
+    applied = upgrade_schema(db.engine)
+    print('Applied migrations: %s' % (', '.join(map(str, applied)) or 'none, database is up to date'))
+
+# Command to rebuild the search index for an existing database: flask --app app rebuild-search-index
+@bp.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    rebuild_search_index()
+    print('Search index rebuilt.')
+
+# Command to bulk-load synthetic users, books and loans for load testing: flask --app app generate-data --books 1000000
+@bp.cli.command('generate-data')
+@click.option('--books', default=1000000, help='Number of books to add.')
+@click.option('--users', default=200000, help='Number of users to add, emails are user<id>@example.com.')
+@click.option('--loans', default=500000, help='Number of open loans to add.')
+@click.option('--admins', default=1, help='Number of the added users that are admins.')
+@click.option('--password', default='password', help='Password shared by the added users.')
+@click.option('--seed', default=42, help='Random seed, the same seed generates the same data.')
+def generate_data_command(books, users, loans, admins, password, seed):
+    from datagen import generate as generate_data  # Only needed by this command, so the app doesn't import it at startup.
+    upgrade_schema(db.engine)
+    start = time.perf_counter()
+    counts = generate_data(db.engine, books, users, loans, library().hashing_pool.hash_password(password), LOAN_DURATIONS, admins, seed)
+    rebuild_search_index()
+    recompute_stats()
+    bump_catalog_version(titles=True)  # Running servers drop their cached pages and rebuild their suggestions.
+    db.session.commit()
+    print('Added %(users)d users, %(books)d books and %(loans)d loans' % counts + ' in %.1f seconds.' % (time.perf_counter() - start))
+
+# Command to rebuild the /admin/stats counters from the books, loans and loan history: flask --app app recompute-stats
+@bp.cli.command('recompute-stats')
+def recompute_stats_command():
+    recompute_stats()
+    print('Circulation statistics recomputed.')
+
+# Function to rebuild the /admin/stats counters in one transaction
+def recompute_stats():
+    circulation.recompute(db.session.connection())
+    circulation.recount_overdue(db.session.connection(), utc_now())
+    db.session.commit()
+
+# Function to apply counter changes for /admin/stats in the caller's transaction, see circulation.add for building them
+def update_stats(changes):
+    circulation.apply(db.session.connection(), changes)
+
+# Command to write reminders for overdue loans, for cron: flask --app app sweep-overdue
+# Safe to run as often as wanted, loans already reminded are skipped and each run carries on where the last one stopped.
+@bp.cli.command('sweep-overdue')
+@click.option('--batch-size', type=int, help='Overdue loans reminded per transaction, OVERDUE_SWEEP_BATCH_SIZE by default.')
+@click.option('--pause', default=0.0, help='Seconds to wait between batches.')
+@click.option('--full', is_flag=True, help='Rescan every overdue loan instead of carrying on from the newest reminder.')
+def sweep_overdue_command(batch_size, pause, full):
+    batch_size = batch_size or current_app.config['OVERDUE_SWEEP_BATCH_SIZE']
+    result = sweep_overdue(db.engine, utc_now(), batch_size, pause, full)
+    print('Scanned %(scanned)d overdue loans, wrote %(reminders)d reminders.' % result)
+
+# Command to delete loan history returned before a date, in short batches: flask --app app prune-loan-history --before 2023-01-01
+@bp.cli.command('prune-loan-history')
+@click.option('--before', required=True, type=datetime.fromisoformat, help='Delete loans returned before this UTC date (YYYY-MM-DD or ISO timestamp).')
+@click.option('--batch-size', default=HISTORY_PRUNE_BATCH_SIZE, help='Rows deleted per transaction.')
+def prune_loan_history_command(before, batch_size):
+    pruned = prune_loan_history(before, batch_size)
+    print('Deleted %d loan history rows returned before %s.' % (pruned, before.isoformat(' ')))
+
+# Function to delete the loan history returned before a time, one batch per transaction, returns the number of deleted rows
+# Each batch is found through the returned_at index, so pruning costs the same however large the history is.
+# The pruned loans are uncounted from the statistics in the batch's transaction, like recompute_stats no longer counts them.
+def prune_loan_history(before, batch_size=HISTORY_PRUNE_BATCH_SIZE):
+    pruned = 0
+    while True:
+        ids = db.session.execute(select(LoanHistory.id).where(LoanHistory.returned_at < before).limit(batch_size)).scalars().all()
+        changes = {}
+        for book_id, author, city, count in db.session.execute(
+            select(LoanHistory.book_id, Books.author, Users.city, func.count())
+            .outerjoin(Books, Books.id == LoanHistory.book_id).outerjoin(Users, Users.id == LoanHistory.user_id)
+            .where(LoanHistory.id.in_(ids)).group_by(LoanHistory.book_id, Books.author, Users.city)
+        ):
+            # Deleted books and users are no longer counted per book, author or city, see circulation.recompute.
+            for scope, subject in (('total', ''), ('book', book_id if author is not None else None), ('author', author), ('city', city)):
+                circulation.add(changes, scope, subject, loans=-count, returns=-count)
+        update_stats(changes)
+        circulation.remove_empty(db.session.connection(), [key for key in changes if key[0] != 'total'])  # Books and cities left with no loans.
+        db.session.execute(delete(LoanHistory).where(LoanHistory.id.in_(ids)).execution_options(synchronize_session=False))
+        db.session.commit()
+        pruned += len(ids)
+        if len(ids) < batch_size:
+            return pruned
+
+# Function to get the current time in UTC, the one clock used to write and check loan dates
+def utc_now():
+    return datetime.utcnow()
+
+# Function to build the SQL expression telling if a loan is late at the given UTC time
+def loan_is_late(now):
+    return and_(Loans.return_date != None, Loans.return_date < now)
+
+# Response fields of each resource and the SQL they are selected from, clients can pick some of them with ?fields=
+# Loan lateness is compared to the :now parameter, which the caller passes when executing the query.
+BOOK_FIELDS = Serializer(
+    Field('id', Books.id),
+    Field('name', Books.name),
+    Field('author', Books.author),
+    Field('year_published', Books.year_published),
+    Field('description', Books.description),
+    Field('status', case((Books.available_copies > 0, 'available'), else_='taken')),
+    Field('total_copies', Books.total_copies),
+    Field('available_copies', Books.available_copies),
+    Field('image', Books.image),
+    Field('thumbnail', Books.thumbnail),
+    Field('loan_type', Books.loan_type),
+)
+USER_LOAN_FIELDS = Serializer(
+    Field('loan_id', Loans.id),
+    Field('id', Books.id),
+    Field('name', Books.name),
+    Field('author', Books.author),
+    Field('year_published', Books.year_published),
+    Field('description', Books.description),
+    Field('image', Books.image),
+    Field('thumbnail', Books.thumbnail),
+    Field('loan_date', Loans.loan_date, format_datetime),
+    Field('return_date', Loans.return_date, format_datetime),
+    Field('late', loan_is_late(bindparam('now', type_=db.DateTime)), bool),
+)
+ADMIN_LOAN_FIELDS = Serializer(
+    Field('loan_id', Loans.id),
+    Field('user_id', Loans.user_id),
+    *(USER_LOAN_FIELDS.fields[name] for name in USER_LOAN_FIELDS.all_fields[1:]),
+)
+HISTORY_FIELDS = Serializer(
+    Field('id', LoanHistory.id),
+    Field('loan_id', LoanHistory.loan_id),
+    Field('user_id', LoanHistory.user_id),
+    Field('book_id', LoanHistory.book_id),
+    Field('loan_date', LoanHistory.loan_date, format_datetime),
+    Field('due_date', LoanHistory.due_date, format_datetime),
+    Field('returned_at', LoanHistory.returned_at, format_datetime),
+    Field('returned_late', and_(LoanHistory.due_date != None, LoanHistory.returned_at > LoanHistory.due_date), bool),
+)
+CUSTOMER_FIELDS = Serializer(
+    Field('id', Users.id),
+    Field('username', Users.username),
+    Field('email', Users.email),
+    Field('city', Users.city),
+    Field('age', Users.age),
+    Field('account', Users.account),
+)
+
 # Function to check if uploaded file is allowed
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Function to save an uploaded cover under its content hash and make its thumbnail, returns (image path, thumbnail path)
+# Identical covers are stored once, and paths are relative to the backend folder like 'uploads/ab/ab12...jpg'.
+def save_cover(image):
+    folder = os.path.join(current_app.root_path, current_app.config['UPLOAD_FOLDER'])
+    extension = image.filename.rsplit('.', 1)[1].lower()
+    relative_path, _ = store_image(image, folder, extension)
+    thumbnail = make_thumbnail(folder, relative_path, THUMBNAIL_SIZE)
+    return current_app.config['UPLOAD_FOLDER'] + '/' + relative_path, thumbnail and current_app.config['UPLOAD_FOLDER'] + '/' + thumbnail
+
+# Function to encode the sort key of the last seen row (usually its ID) into an opaque pagination cursor
+def encode_cursor(*values):
+    raw = '|'.join(str(value) for value in values)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+# Function to decode a pagination cursor back into its values converted with types, returns None if the cursor is invalid
+def decode_cursor(cursor, *types):
+    types = types or (int,)  # Most cursors hold a single row ID.
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4) # Restore the padding stripped by encode_cursor
+        parts = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        if len(parts) != len(types):
+            return None
+        values = tuple(convert(part) for convert, part in zip(types, parts))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return values[0] if len(values) == 1 else values
+
+# Function to read the requested page size from the query string, clamped to MAX_PAGE_SIZE
+def get_page_size():
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+# Function to stream every row of a select statement as NDJSON or CSV without loading the whole result in memory
+def stream_export(statement, row_to_dict, export_format, filename, params=None):
+    rows = db.session.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE), params or {})  # Fetch rows from the database cursor in batches.
+
+    def generate_ndjson():
+        for row in rows:
+            yield current_app.json.dumps_bytes(row_to_dict(row)) + b'\n'
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = None
+        for row in rows:
+            data = row_to_dict(row)
+            if writer is None:  # Write the header from the keys of the first row.
+                writer = csv.DictWriter(buffer, fieldnames=list(data))
+                writer.writeheader()
+            writer.writerow(data)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    generate = generate_ndjson if export_format == 'ndjson' else generate_csv
+    return Response(
+        stream_with_context(generate()),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={'Content-Disposition': f'attachment; filename={filename}.{export_format}'}
+    )
+
+# Function to read the requested export format, returns None for a normal JSON response
+def get_export_format():
+    export_format = request.args.get('format', 'json').lower()
+    if export_format == 'json':
+        return None
+    if export_format not in EXPORT_FORMATS:
+        abort(400, description="Unsupported format, use json, ndjson or csv.")
+    return export_format
+
+# Function to read the fields requested with ?fields=name,author for a serializer, every field by default
+def get_fields(serializer):
+    try:
+        return serializer.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        abort(400, description=str(e))
+
+# Function to get the catalog versions shared by every server process, read from the database once per request
+# Cached catalog responses are keyed on the 'books' version, so a change made by any process makes them unreachable.
+def catalog_versions():
+    if 'catalog_versions' not in g:
+        g.catalog_versions = dict(db.session.execute(select(CatalogVersions.name, CatalogVersions.version)).all())
+    return g.catalog_versions
+
+# Function to mark the catalog as changed in the caller's transaction, so no process serves cached catalog responses
+# from before the commit. titles=True also marks titles or authors as changed. Returns the new versions by name.
+def bump_catalog_version(titles=False):
+    names = ['books', 'titles'] if titles else ['books']
+    db.session.execute(update(CatalogVersions).where(CatalogVersions.name.in_(names)).values(version=CatalogVersions.version + 1))
+    return dict(db.session.execute(select(CatalogVersions.name, CatalogVersions.version).where(CatalogVersions.name.in_(names))).all())
+
+# Function to send a cached JSON body with its ETag, answering 304 if the client already has it
+# Compressed bodies are cached on the entry, so a popular page is compressed once per encoding rather than per request.
+def send_cached(entry):
+    encoding = negotiate_encoding(len(entry.body))
+    if encoding:
+        body = entry.encoded.get(encoding)
+        if body is None:
+            body = compress(entry.body, encoding, current_app.config['COMPRESSION_LEVELS'][encoding])
+            library().response_cache.add_encoding(entry, encoding, body)
+        response = current_app.response_class(body, mimetype='application/json')
+        response.headers['Content-Encoding'] = encoding
+        response.set_etag('%s-%s' % (entry.etag, encoding))  # Each encoding is a different representation.
+    else:
+        response = current_app.response_class(entry.body, mimetype='application/json')
+        response.set_etag(entry.etag)
+    if len(entry.body) >= current_app.config['COMPRESSION_MIN_SIZE']:
+        response.vary.add('Accept-Encoding')
+    return response.make_conditional(request)
+
+# Function to pick the encoding to compress a body of the given size with, None to send it as it is
+def negotiate_encoding(size):
+    if size < current_app.config['COMPRESSION_MIN_SIZE']:
+        return None
+    return request.accept_encodings.best_match(ENCODINGS)
+
+# Compress large text responses the client accepts compressed, cached catalog pages are already compressed by send_cached
+@bp.after_app_request
+def compress_response(response):
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response  # Files, streamed exports and already compressed bodies are sent as they are.
+    body = response.get_data()
+    if len(body) < current_app.config['COMPRESSION_MIN_SIZE']:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(len(body))
+    if encoding:
+        response.set_data(compress(body, encoding, current_app.config['COMPRESSION_LEVELS'][encoding]))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag('%s-%s' % (etag, encoding), weak)
+    return response
+
 # Function to generate JWT
 def generate_token(user_id):
     expiration = int(time.time()) + 3600  # Token expiration set to 1 hour
@@ -78,6 +613,37 @@ def generate_token(user_id):
     token = jwt.encode(payload, 'secret-secret-key', algorithm='HS256')
     return token
 
+# Function to get a user's account type, served from the role cache and re-checked in the database once it expires
+def get_account(user_id):
+    role_cache = library().role_cache
+    cached = role_cache.get(user_id)
+    if cached and cached[1] > time.time():
+        return cached[0]
+    user = db.session.get(Users, user_id)
+    account = user.account.lower() if user else None  # Deleted users have no account.
+    role_cache[user_id] = (account, time.time() + ROLE_CACHE_TTL)
+    return account
+
+# Function to cut off a deleted or demoted user right away instead of waiting for the role cache to expire
+def revoke_user(user_id):
+    library().role_cache.pop(user_id, None)
+
+# Function to check if the current JWT belongs to an admin, using the account claim and the role cache
+def current_user_is_admin():
+    account = get_jwt().get('account')
+    if account is not None and account != 'admin':  # Tokens issued to regular users never need a lookup.
+        return False
+    return get_account(get_jwt_identity()) == 'admin'
+
+# Decorator to restrict a route to admin users, must be placed under jwt_required
+def admin_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not current_user_is_admin():
+            return jsonify({'error': 'Permission denied. Only admin users can access this endpoint.'}), 403
+        return f(*args, **kwargs)
+    return decorated
+
 # Decorator to require token authentication
 def token_required(f):
     @wraps(f)
@@ -86,7 +652,7 @@ def token_required(f):
         if not token:
             return jsonify({'message': 'Token is missing'}), 401
         try:
-            data = jwt.decode(token, app.config['JWT_SECRET_KEY'], algorithms=['HS256'])
+            data = jwt.decode(token, current_app.config['JWT_SECRET_KEY'], algorithms=['HS256'])
             current_user_id = data['user_id']
         except jwt.ExpiredSignatureError:
             return jsonify({'message': 'Token has expired'}), 401
@@ -95,13 +661,82 @@ def token_required(f):
         return f(current_user_id, *args, **kwargs)
     return decorated
 
+# Function to get the identity of the request's access token, None for anonymous requests and invalid or expired tokens
+# Only tokens that passed verification are remembered, so a forged token can't pick its own identity.
+def token_identity():
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        return None
+    token = header[7:]
+    token_identities = library().token_identities
+    cached = token_identities.get(token)
+    if cached and cached[1] > time.time():
+        return cached[0]
+    try:
+        decoded = decode_token(token)
+    except Exception:  # Expired or invalid tokens are limited by address, the route itself rejects them.
+        return None
+    if len(token_identities) >= MAX_TOKEN_IDENTITIES:
+        token_identities.clear()
+    identity = decoded[current_app.config['JWT_IDENTITY_CLAIM']]
+    token_identities[token] = (identity, decoded.get('exp', math.inf))
+    return identity
+
+# Function to get what a rate limit key counts requests by for the current request, None to skip the limit
+def rate_limit_subject(key):
+    if key == 'user':
+        identity = token_identity()
+        return 'user:%s' % identity if identity is not None else 'ip:%s' % request.remote_addr
+    if key == 'ip_email':
+        email = (request.get_json(silent=True) or {}).get('email')
+        return '%s|%s' % (request.remote_addr, email.strip().lower()) if isinstance(email, str) and email.strip() else None
+    return request.remote_addr
+
+# Limit the routes listed in RATE_LIMITS, answering 429 with Retry-After once a client has used up its tokens
+@bp.before_app_request
+def rate_limit():
+    if request.url_rule is None or request.method == 'OPTIONS' or not current_app.config['RATE_LIMIT_ENABLED']:
+        return None  # Unmatched paths and CORS preflights are never limited.
+    route = request.url_rule.rule
+    retry_after = 0
+    for key, requests, period in current_app.config['RATE_LIMITS'].get(route, ()):
+        subject = rate_limit_subject(key)
+        if subject is not None:
+            retry_after = max(retry_after, library().rate_limit_store.take('%s|%s|%s' % (route, key, subject), requests, period))
+    if not retry_after:
+        return None
+    response = jsonify({'error': RATE_LIMIT_MESSAGE})
+    response.headers['Retry-After'] = str(math.ceil(retry_after))
+    return response, 429
+
+# Answer with 503 and Retry-After when the password hashing pool can't take more work
+@bp.app_errorhandler(HashingPoolSaturated)
+def hashing_pool_saturated(e):
+    response = jsonify({'error': 'Server is busy, please try again shortly.'})
+    response.headers['Retry-After'] = str(HASHING_RETRY_AFTER)
+    return response, 503
+
+# Route to serve uploaded cover images and thumbnails, with ETag and Range support
+# Content-addressed files never change, so browsers can keep them for a year without revalidating.
+@bp.route('/uploads/<path:filename>')
+def get_upload(filename):
+    content_addressed = is_content_addressed(filename)
+    response = send_from_directory(
+        current_app.config['UPLOAD_FOLDER'], filename,
+        max_age=IMAGE_MAX_AGE if content_addressed else None, conditional=True,
+        etag=filename.rsplit('/', 1)[-1].split('.')[0] if content_addressed else True  # The content hash is the ETag.
+    )
+    if content_addressed:
+        response.cache_control.immutable = True
+    return response
+
 # Route to display API documentation page
-@app.route('/')
+@bp.route('/')
 def protected_index():
     return render_template('api_documentation.html')
 
 
-@app.route('/signup', methods=['POST']) # Define a route for user signup with POST method.
+@bp.route('/signup', methods=['POST']) # Define a route for user signup with POST method.
 def signup():
     global admin_password # Reference the global variable for the admin password.
     data = request.get_json() # Parse the JSON data sent with the POST request.
@@ -124,24 +759,28 @@ def signup():
             return jsonify({"error": "Admin password is incorrect"}), 400
 
     # Hash the user's password before storing it in the database for security.
-    hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+    hashed_password = library().hashing_pool.hash_password(password)
 
     # Create a new user instance with the provided data.
-    new_user = Users(username=user_name, email=email, password=hashed_password, city=city, age=age, account=account)
+    # Accounts are stored in lower case, so the /customers account filter can match them through its index.
+    new_user = Users(username=user_name, email=email, password=hashed_password, city=city, age=age, account=account.lower())
 
     # Attempt to add the new user to the database.
     try:
         db.session.add(new_user)
         db.session.commit()
         return jsonify({'message': 'User created successfully'}), 201
-    except Exception as e:
-        print(str(e)) # Print the error if user creation fails.
+    except IntegrityError:
+        db.session.rollback() # The unique index on email rejected the user.
+        return jsonify({'error': 'Email is already registered'}), 409
+    except Exception:
+        current_app.logger.exception('Failed to create user')  # Log the error with its traceback.
         db.session.rollback() # Rollback the session to avoid partial changes.
         return jsonify({'error': 'Failed to create user'}), 500
 
 
 
-@app.route('/login', methods=['POST']) # Define a route for user login with POST method.
+@bp.route('/login', methods=['POST']) # Define a route for user login with POST method.
 def login():
     data = request.get_json() # Parse the JSON data sent with the POST request.
     email = data.get('email') # Extract the email from the JSON data.
@@ -150,16 +789,21 @@ def login():
     # Query the database for a user with the provided email.
     user = Users.query.filter_by(email=email).first()
     # Check if the user exists and the password matches.
-    if user and bcrypt.check_password_hash(user.password, password):
+    if user and library().hashing_pool.check_password(user.password, password):
+        # Upgrade the stored hash if it was created with a different work factor than the configured one.
+        if library().hashing_pool.needs_rehash(user.password):
+            user.password = library().hashing_pool.hash_password(password)
+            db.session.commit()
         expires = timedelta(hours=1) # Set token expiration time.
         # Generate a JWT access token for the authenticated user.
-        access_token = create_access_token(identity=user.id, expires_delta=expires)
+        # The account type is added as a claim so admin routes can authorize without loading the user.
+        access_token = create_access_token(identity=user.id, additional_claims={'account': user.account.lower()}, expires_delta=expires)
         return jsonify({'message': 'Login successful', 'access_token':access_token}), 200
     else:
         return jsonify({'error': 'Invalid credentials'}), 401
 
     
-@app.route('/get-user-info', methods=['GET']) # Define a route to get the authenticated user's information.
+@bp.route('/get-user-info', methods=['GET']) # Define a route to get the authenticated user's information.
 @jwt_required() # Require JWT authentication to access this endpoint.
 def get_user_info():
     current_user_id = get_jwt_identity() # Retrieve the user ID from the JWT token.
@@ -181,73 +825,160 @@ def get_user_info():
     return jsonify(user_info), 200
 
 
-@app.route('/books', methods=['GET'])  # Define a route to list all books using the GET method.
+@bp.route('/books', methods=['GET'])  # Define a route to list books one page at a time using the GET method.
 def get_books():
-    books = Books.query.all()  # Query the database to get all books.
-    book_list = []  # Initialize an empty list to hold book data.
-    for book in books:  # Loop through each book in the query result.
-        # Append each book's details as a dictionary to the book_list.
-        book_list.append({
-            'id': book.id,
-            'name': book.name,
-            'author': book.author,
-            'year_published': book.year_published,
-            'description': book.description,
-            'status': book.status,
-            'copyStatus': book.copyStatus,
-            'image': book.image,
-            'loan_type': book.loan_type
-        })
-    return jsonify({'books': book_list}), 200  # Return the list of books as JSON.
-
-
-
-@app.route('/books/<int:book_id>', methods=['GET'])  # Define a route to get a specific book by its ID.
+    # Read every parameter the page depends on first, the cache key is made of their parsed values only,
+    # so unknown parameters or other spellings of the same values can't fill the cache with copies of a page.
+    fields = get_fields(BOOK_FIELDS)
+    author = request.args.get('author') or None
+    year_from = request.args.get('year_from', type=int)
+    year_to = request.args.get('year_to', type=int)
+    loan_type = request.args.get('loan_type', type=int)
+    # A book is available while at least one copy is not on loan, status=available/taken is accepted as well for older clients.
+    available = request.args.get('available')
+    status = request.args.get('status')
+    if available is None and status:
+        available = 'true' if status == 'available' else 'false'
+    if available is not None:
+        available = available.lower() in ('true', '1', 'yes')
+    last_id = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        last_id = decode_cursor(cursor)
+        if last_id is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    limit = get_page_size()
+
+    # Serve the page from the cache if it was already built for this catalog version.
+    cache_key = ('books', catalog_versions()['books'], fields, author, year_from, year_to, loan_type, available, last_id, limit)
+    entry = library().response_cache.get(cache_key)
+    if entry:
+        return send_cached(entry)
+
+    # Select only the requested fields, plus the ID for the cursor. Filters below are applied in SQL.
+    query = select(*BOOK_FIELDS.columns(fields), Books.id.label('cursor_id'))
+    if author:
+        query = query.filter(Books.author == author)
+    if year_from is not None:
+        query = query.filter(Books.year_published >= year_from)
+    if year_to is not None:
+        query = query.filter(Books.year_published <= year_to)
+    if loan_type is not None:
+        query = query.filter(Books.loan_type == loan_type)
+    if available is not None:
+        query = query.filter(Books.available_copies > 0 if available else Books.available_copies <= 0)
+    # Continue after the last book of the previous page if a cursor was sent.
+    if last_id is not None:
+        query = query.filter(Books.id > last_id)
+
+    # Fetch one extra row to know if there is a next page without a separate count query.
+    rows = db.session.execute(query.order_by(Books.id).limit(limit + 1)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].cursor_id)
+
+    book_list = [BOOK_FIELDS.row_to_dict(row, fields) for row in rows]  # Build each book's dict from its row.
+    # Cache the serialized page and return it with its ETag.
+    entry = library().response_cache.set(cache_key, current_app.json.dumps_bytes({'books': book_list, 'next_cursor': next_cursor}))
+    return send_cached(entry)
+
+
+
+@bp.route('/books/suggest', methods=['GET'])  # Define a route to suggest titles and authors while the user types.
+def suggest_books():
+    prefix = request.args.get('prefix', '')
+    if not prefix.strip():
+        return jsonify({'error': 'Prefix is missing'}), 400
+    limit = max(1, min(request.args.get('limit', DEFAULT_SUGGEST_LIMIT, type=int), MAX_SUGGEST_LIMIT))
+    # Served from the in-memory prefix index. The one query is the request's catalog_versions read, a two-row primary key
+    # lookup that tells if another process changed titles since the index was synced.
+    return jsonify({'suggestions': get_suggest_index().suggest(prefix, limit)}), 200
+
+
+@bp.route('/books/search', methods=['GET'])  # Define a route to search books by name, author and description.
+def search_books():
+    match = build_search_query(request.args.get('q', ''))  # Build the full-text query from the search text.
+    if not match:
+        return jsonify({'error': 'Search query is missing'}), 400
+
+    # Search results are ranked, so the cursor holds the offset of the next page.
+    offset = 0
+    cursor = request.args.get('cursor')
+    if cursor:
+        offset = decode_cursor(cursor)
+        if offset is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+
+    limit = get_page_size()
+    fields = get_fields(BOOK_FIELDS)  # Only the requested fields are selected and encoded.
+    statement = select(*BOOK_FIELDS.columns(fields))
+    if uses_search_index():
+        # Look up matching books in the search index, best matches first (name weighs more than author and description).
+        statement = (statement.select_from(books_fts).join(Books, Books.id == books_fts.c.rowid)
+                     .where(text("books_fts MATCH :match"))
+                     .order_by(text("bm25(books_fts, 10.0, 5.0, 1.0)"), Books.id))
+    else:
+        # Without the search index, match the words against the text columns in ID order.
+        statement = statement.where(build_search_filter(request.args.get('q', ''))).order_by(Books.id)
+    rows = db.session.execute(statement.limit(limit + 1).offset(offset), {'match': match}).all()
+    next_cursor = None
+    if len(rows) > limit:  # One extra row means there is another page.
+        rows = rows[:limit]
+        next_cursor = encode_cursor(offset + limit)
+
+    book_list = [BOOK_FIELDS.row_to_dict(row, fields) for row in rows]  # Build each book's dict from its row.
+    return jsonify({'books': book_list, 'next_cursor': next_cursor}), 200  # Return the ranked page of books as JSON.
+
+
+
+@bp.route('/books/<int:book_id>', methods=['GET'])  # Define a route to get a specific book by its ID.
 @jwt_required()  # Require JWT authentication to access this route.
 def get_book(book_id):
     current_user = get_jwt_identity()  # Get the current user's ID from the JWT.
-    book = db.session.get(Books, book_id)  # Query the database to get the book by its ID.
-    
-    if not book:  # Check if the book was found.
+    fields = get_fields(BOOK_FIELDS)  # Book fields requested by the client, loan details are always added.
+
+    # Serve the book from the cache if it was already built for this user, fields and catalog version.
+    cache_key = ('book', catalog_versions()['books'], book_id, current_user, fields)
+    entry = library().response_cache.get(cache_key)
+    if entry:
+        return send_cached(entry)
+
+    # Query the database for the requested fields of the book.
+    book_row = db.session.execute(select(*BOOK_FIELDS.columns(fields)).where(Books.id == book_id)).first()
+
+    if not book_row:  # Check if the book was found.
         abort(404, description="Book not found.")  # Return a 404 error if the book is not found.
-    
+
     # Check if the book is currently loaned by querying the Loans table.
-    loan = db.session.query(Loans).filter_by(book_id=book.id, user_id=current_user).first()
-    user = db.session.get(Users, current_user)  # Get the user object for the current user.
-    if user.account.lower() == 'admin':  # Check if the current user is an admin.
-        # Admins get information on any loan for the book, not just their own.
-        loan = db.session.query(Loans).filter_by(book_id=book.id).first()
+    # Lateness is computed by the database against the same UTC clock used when loaning.
+    now = utc_now()
+    loan_query = select(Loans.id, Loans.return_date, loan_is_late(now).label('late')).where(Loans.book_id == book_id)
+    if not current_user_is_admin():  # Check if the current user is an admin.
+        # Admins get information on any loan for the book, regular users only on their own.
+        loan_query = loan_query.where(Loans.user_id == current_user)
+    loan_row = db.session.execute(loan_query.limit(1)).first()
 
     # Prepare the book data to return, including loan information if applicable.
-    book_data = {
-        'id': book.id,
-        'name': book.name,
-        'author': book.author,
-        'year_published': book.year_published,
-        'description': book.description,
-        'status': book.status,
-        'copyStatus': book.copyStatus,
-        'image': book.image,
-        'loan_type': book.loan_type
-    }
-    if loan:  # If there is a loan on the book, add loan details to the response.
-        book_data['loan_id'] = loan.id
-        book_data['return_date'] = loan.return_date.strftime('%Y-%m-%d %H:%M:%S')
-        # Check if the book is late for return.
-        current_datetime = datetime.now()
-        book_data['late'] = loan.return_date < current_datetime
-    return jsonify({'book': book_data}), 200  # Return the book data as JSON.
-
-
-@app.route('/books/add', methods=['POST'])  # Define a route to add a new book.
+    book_data = BOOK_FIELDS.row_to_dict(book_row, fields)
+    expires_at = None  # Time at which the cached response goes stale, if any.
+    if loan_row:  # If there is a loan on the book, add loan details to the response.
+        book_data['loan_id'] = loan_row.id
+        book_data['return_date'] = format_datetime(loan_row.return_date)
+        book_data['late'] = bool(loan_row.late)  # Check if the book is late for return.
+        if not book_data['late']:
+            # The late flag changes once the return date passes, return dates are stored in UTC.
+            expires_at = loan_row.return_date.replace(tzinfo=timezone.utc).timestamp()
+
+    # Cache the serialized book and return it with its ETag.
+    entry = library().response_cache.set(cache_key, current_app.json.dumps_bytes({'book': book_data}), expires_at)
+    return send_cached(entry)
+
+
+@bp.route('/books/add', methods=['POST'])  # Define a route to add a new book.
 @jwt_required()  # Require JWT authentication to ensure only logged-in users can access.
+@admin_required  # Restrict access to admin users.
 def add_book():
-    current_user = get_jwt_identity()  # Get the current user's ID from the JWT.
-    user = Users.query.get(current_user)  # Query the database for the current user.
-
-    if user.account.lower() != 'admin':  # Check if the user is not an admin.
-        abort(403, description="Permission Denied: Only admin users can add books.")  # Restrict access if not admin.
-
     data = request.form  # Get the form data submitted with the request.
     # Extract book details from the form data.
     name = data.get('name')
@@ -255,14 +986,15 @@ def add_book():
     year_published = data.get('year_published')
     description = data.get('description')
     loan_type = data.get('loan_type')
+    copies = data.get('copies', DEFAULT_COPIES, type=int)  # Number of copies the library holds.
+    if copies is None or copies < 1:
+        return jsonify({'error': 'A book needs at least one copy.'}), 400
     image = request.files.get('image')  # Get the image file uploaded with the form.
 
     if image and allowed_file(image.filename):  # Check if an image was uploaded and if it's an allowed file type.
-        filename = secure_filename(image.filename)  # Sanitize the filename.
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)  # Construct the file path.
-        image.save(filepath)  # Save the image file.
+        filepath, thumbnail = save_cover(image)  # Save the image file and its thumbnail.
     else:
-        filepath = None  # Set filepath to None if no image or not allowed.
+        filepath = thumbnail = None  # Set the paths to None if no image or not allowed.
 
     # Create a new book instance with the provided details.
     new_book = Books(
@@ -271,38 +1003,192 @@ def add_book():
         year_published=year_published,
         description=description,
         loan_type=loan_type,
-        status='available',
-        copyStatus='available',
+        total_copies=copies,
+        available_copies=copies,
         image=filepath,
+        thumbnail=thumbnail,
     )
 
     # Attempt to add the new book to the database.
     try:
         db.session.add(new_book)
+        db.session.flush()  # Flush to get the new book's ID for the search index.
+        index_book(new_book)  # Add the book to the search index in the same transaction.
+        changes = {}  # Count the book and its copies in the statistics in the same transaction.
+        circulation.add(changes, 'total', '', books=1, copies=copies)
+        circulation.add(changes, 'author', author, books=1)
+        update_stats(changes)
+        versions = bump_catalog_version(titles=True)  # Invalidate cached catalog responses.
         db.session.commit()
+        update_suggestions(versions['titles'], added=[(name, author)])  # Suggest the new title and author.
         return jsonify({'message': 'Book added successfully'}), 201  # Return success message.
-    except Exception as e:  # Catch any exceptions.
-        print(str(e))  # Print the exception.
+    except Exception:  # Catch any exceptions.
+        current_app.logger.exception('Failed to add book')  # Log the error with its traceback.
         db.session.rollback()  # Rollback the transaction.
         return jsonify({'error': 'Failed to add book'}), 500  # Return error message.
 
 
 
 
-@app.route('/books/edit/<int:book_id>', methods=['PUT'])  # Define a route to edit an existing book.
+@bp.route('/books/import', methods=['POST'])  # Define a route to add many books at once from a CSV or NDJSON body.
 @jwt_required()  # Require JWT authentication to ensure only logged-in users can access.
-def edit_book(book_id):
-    current_user = get_jwt_identity()  # Get the current user's ID from the JWT.
-    user = Users.query.get(current_user)  # Query the database for the current user.
+@admin_required  # Restrict access to admin users.
+def import_books():
+    # The format comes from the query string or the content type, the body is read as a stream.
+    import_format = request.args.get('format') or ('ndjson' if 'ndjson' in (request.mimetype or '') else 'csv')
+    if import_format not in ('csv', 'ndjson'):
+        return jsonify({'error': 'Unsupported format, use csv or ndjson.'}), 400
+    batch_size = max(1, min(request.args.get('batch_size', IMPORT_BATCH_SIZE, type=int), MAX_IMPORT_BATCH_SIZE))
+
+    started = time.perf_counter()
+    report = {'imported': 0, 'failed': 0, 'batches': 0, 'errors': []}
+    batch = []  # Valid rows waiting to be inserted, as (row number, values).
+    status = 200
+    try:
+        for row_number, data, error in read_import_rows(import_format):
+            values = None
+            if not error:
+                values, error = validate_book_row(data)
+            if error:
+                add_import_error(report, row_number, error)
+                continue
+            batch.append((row_number, values))
+            if len(batch) >= batch_size:
+                insert_book_batch(batch, report)
+                batch = []
+    except ImportReadError as e:
+        # The rest of the body can't be read. The rows before it are imported, so the client can send the rest again.
+        report['error'] = 'Import stopped at row %d: %s' % (e.row_number, e)
+        report['stopped_at_row'] = e.row_number
+        status = 400
+    if batch:
+        insert_book_batch(batch, report)
+
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    report['rows_per_sec'] = round(report['imported'] / report['seconds'], 1) if report['seconds'] else None
+    return jsonify(report), status
+
+
+# Raised when the rest of an import body can't be read, like bytes that aren't UTF-8 or a CSV field over the size limit
+class ImportReadError(Exception):
+    def __init__(self, row_number, message):
+        super().__init__(message)
+        self.row_number = row_number
+
+
+# Function to read the import body one row at a time, yields (row number, data, error)
+# Raises ImportReadError at the first row that can't be read, the rows yielded before it are complete.
+def read_import_rows(import_format):
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    row_number = 0
+    try:
+        if import_format == 'csv':
+            csv.field_size_limit(IMPORT_FIELD_SIZE_LIMIT)  # Longer fields raise csv.Error instead of being buffered whole.
+            for data in csv.DictReader(stream):
+                row_number += 1
+                yield row_number, data, None
+            return
+        for line in stream:
+            row_number += 1
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError:
+                yield row_number, None, 'Invalid JSON'
+                continue
+            if not isinstance(data, dict):
+                yield row_number, None, 'Each line must be a JSON object'
+                continue
+            yield row_number, data, None
+    except UnicodeDecodeError:
+        raise ImportReadError(row_number + 1, 'the body is not valid UTF-8')
+    except csv.Error as e:
+        raise ImportReadError(row_number + 1, 'invalid CSV, %s' % e)
+
+
+# Function to read a whole number from a CSV field or a JSON number, raises ValueError for anything else
+# JSON true and false are rejected rather than read as 1 and 0, and so are numbers with a fraction.
+def whole_number(value):
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError('not a whole number: %r' % (value,))
+    return int(value)
+
+
+# Function to check an imported row and convert it to column values, returns (values, error)
+def validate_book_row(data):
+    name = str(data.get('name') or '').strip()
+    author = str(data.get('author') or '').strip()
+    description = data.get('description') or None
+    if not name or len(name) > 50:
+        return None, 'name is required and must be at most 50 characters'
+    if not author or len(author) > 50:
+        return None, 'author is required and must be at most 50 characters'
+    if description is not None and len(str(description)) > 500:
+        return None, 'description must be at most 500 characters'
+    try:
+        year_published = whole_number(data.get('year_published'))
+        loan_type = whole_number(data.get('loan_type'))
+        copies = DEFAULT_COPIES if data.get('copies') in (None, '') else whole_number(data.get('copies'))  # 0 is rejected below.
+    except (TypeError, ValueError):
+        return None, 'year_published, loan_type and copies must be whole numbers'
+    if loan_type not in LOAN_DURATIONS:
+        return None, 'loan_type must be one of %s' % ', '.join(map(str, LOAN_DURATIONS))
+    if copies < 1:
+        return None, 'copies must be at least 1'
+    return {
+        'name': name,
+        'author': author,
+        'year_published': year_published,
+        'description': None if description is None else str(description),
+        'loan_type': loan_type,
+        'total_copies': copies,
+        'available_copies': copies,
+    }, None
+
+
+# Function to insert a batch of validated rows and their search index entries in one transaction
+def insert_book_batch(batch, report):
+    rows = [values for _, values in batch]
+    try:
+        ids = db.session.execute(insert(Books).returning(Books.id, sort_by_parameter_order=True), rows).scalars().all()
+        for values, book_id in zip(rows, ids):
+            values['id'] = book_id
+        index_new_books(rows)
+        changes = {}  # Count the books and their copies in the statistics in the same transaction.
+        for values in rows:
+            circulation.add(changes, 'total', '', books=1, copies=values['total_copies'])
+            circulation.add(changes, 'author', values['author'], books=1)
+        update_stats(changes)
+        versions = bump_catalog_version(titles=True)  # Invalidate cached catalog responses.
+        db.session.commit()
+        update_suggestions(versions['titles'], added=[(values['name'], values['author']) for values in rows])  # Suggest the new titles and authors.
+        report['imported'] += len(rows)
+    except Exception:
+        current_app.logger.exception('Failed to import book batch')  # Log the error with its traceback.
+        db.session.rollback()  # Rollback the whole batch.
+        for row_number, _ in batch:
+            add_import_error(report, row_number, 'Batch insert failed')
+    report['batches'] += 1
 
-    if user.account.lower() != 'admin':  # Check if the user is not an admin.
-        abort(403, description="Permission Denied: Only admin users can edit books.")  # Restrict access if not admin.
 
+# Function to record a failed row in the import report, only the first MAX_IMPORT_ERRORS are listed
+def add_import_error(report, row_number, error):
+    report['failed'] += 1
+    if len(report['errors']) < MAX_IMPORT_ERRORS:
+        report['errors'].append({'row': row_number, 'error': error})
+
+
+@bp.route('/books/edit/<int:book_id>', methods=['PUT'])  # Define a route to edit an existing book.
+@jwt_required()  # Require JWT authentication to ensure only logged-in users can access.
+@admin_required  # Restrict access to admin users.
+def edit_book(book_id):
     book = Books.query.get(book_id)  # Query the database for the book to edit.
     if not book:  # Check if the book was found.
         abort(404, description="Book not found.")  # Return a 404 error if the book is not found.
 
     data = request.form  # Get the form data submitted with the request.
+    old_name, old_author, old_copies = book.name, book.author, book.total_copies  # Kept to update the statistics and suggestions.
     # Update the book's details with the form data, using existing values as defaults.
     book.name = data.get('name', book.name)
     book.author = data.get('author', book.author)
@@ -310,258 +1196,677 @@ def edit_book(book_id):
     book.description = data.get('description', book.description)
     book.loan_type = data.get('loan_type', book.loan_type)
 
+    # Change the number of copies, copies currently on loan can't be removed.
+    copies = data.get('copies', type=int)
+    if copies is not None:
+        on_loan = book.total_copies - book.available_copies
+        if copies < max(on_loan, 1):
+            return jsonify({'error': 'The book needs at least one copy and can\'t have fewer copies than are on loan.'}), 400
+        book.available_copies = Books.available_copies + (copies - book.total_copies)  # Applied relative to the stored count.
+        book.total_copies = copies
+
     new_image = request.files.get('image')  # Get the new image file, if uploaded.
     if new_image and allowed_file(new_image.filename):  # Check if an image was uploaded and if it's allowed.
-        filename = secure_filename(new_image.filename)  # Sanitize the filename.
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)  # Construct the file path.
-        new_image.save(filepath)  # Save the new image file.
-        book.image = filepath  # Update the book's image path.
+        book.image, book.thumbnail = save_cover(new_image)  # Save the new image file and update the book's image paths.
+
+    # Move the book's counts to its new author and count added or removed copies in the statistics.
+    changes = {}
+    if book.author != old_author:
+        book_stats = db.session.get(CirculationStats, ('book', str(book_id)))
+        loans, active_loans, returns = (book_stats.loans, book_stats.active_loans, book_stats.returns) if book_stats else (0, 0, 0)
+        circulation.add(changes, 'author', old_author, books=-1, loans=-loans, active_loans=-active_loans, returns=-returns)
+        circulation.add(changes, 'author', book.author, books=1, loans=loans, active_loans=active_loans, returns=returns)
+    if book.total_copies != old_copies:
+        circulation.add(changes, 'total', '', copies=book.total_copies - old_copies)
 
     # Attempt to commit the updates to the database.
     try:
+        index_book(book)  # Refresh the book in the search index in the same transaction.
+        update_stats(changes)  # Update the statistics in the same transaction.
+        renamed = (book.name, book.author) != (old_name, old_author)
+        versions = bump_catalog_version(titles=renamed)  # Invalidate cached catalog responses.
         db.session.commit()
+        if renamed:  # Suggest the new title and author instead of the old ones.
+            update_suggestions(versions['titles'], removed=[(old_name, old_author)], added=[(book.name, book.author)])
         return jsonify({'message': 'Book edited successfully'}), 200  # Return success message.
-    except Exception as e:  # Catch any exceptions.
-        print(str(e))  # Print the exception.
+    except Exception:  # Catch any exceptions.
+        current_app.logger.exception('Failed to edit book %s', book_id)  # Log the error with its traceback.
         db.session.rollback()  # Rollback the transaction.
         return jsonify({'error': 'Failed to edit book'}), 500  # Return error message.
 
 
 
-@app.route('/books/delete/<int:book_id>', methods=['DELETE'])  # Define a route to delete a book.
+@bp.route('/books/delete/<int:book_id>', methods=['DELETE'])  # Define a route to delete a book.
 @jwt_required()  # Require JWT authentication to ensure only logged-in users can access.
+@admin_required  # Restrict access to admin users.
 def delete_book(book_id):
-    current_user = get_jwt_identity()  # Get the current user's ID from the JWT.
-    user = Users.query.get(current_user)  # Query the database for the current user.
-
-    if user.account.lower() != 'admin':  # Check if the user is not an admin.
-        abort(403, description="Permission Denied: Only admin users can delete books.")  # Restrict access if not admin.
-
     book = Books.query.get(book_id)  # Query the database for the book to delete.
     if not book:  # Check if the book was found.
         abort(404, description="Book not found.")  # Return a 404 error if the book is not found.
 
     # Attempt to delete the book from the database.
     try:
+        # Uncount the book and its loans from its author in the statistics in the same transaction, the totals keep the loans.
+        book_stats = db.session.get(CirculationStats, ('book', str(book_id)))
+        loans, active_loans, returns = (book_stats.loans, book_stats.active_loans, book_stats.returns) if book_stats else (0, 0, 0)
         db.session.delete(book)
+        unindex_book(book_id)  # Remove the book from the search index in the same transaction.
+        changes = {}
+        circulation.add(changes, 'total', '', books=-1, copies=-book.total_copies)
+        circulation.add(changes, 'author', book.author, books=-1, loans=-loans, active_loans=-active_loans, returns=-returns)
+        update_stats(changes)
+        db.session.execute(delete(CirculationStats).where(CirculationStats.scope == 'book', CirculationStats.subject == str(book_id)))
+        versions = bump_catalog_version(titles=True)  # Invalidate cached catalog responses.
         db.session.commit()
+        update_suggestions(versions['titles'], removed=[(book.name, book.author)])  # Stop suggesting the title and author if no other book has them.
         return jsonify({'message': 'Book deleted successfully'}), 200  # Return success message.
-    except Exception as e:  # Catch any exceptions.
-        print(str(e))  # Print the exception.
+    except Exception:  # Catch any exceptions.
+        current_app.logger.exception('Failed to delete book %s', book_id)  # Log the error with its traceback.
         db.session.rollback()  # Rollback the transaction.
         return jsonify({'error': 'Failed to delete book'}), 500  # Return error message.
 
 
 
-@app.route('/loan/<int:book_id>', methods=['POST'])  # Define a route for loaning a book with the book's ID as a parameter.
+@bp.route('/loan/<int:book_id>', methods=['POST'])  # Define a route for loaning a book with the book's ID as a parameter.
 @jwt_required()  # Require JWT authentication to access this route.
 def loan_book(book_id):
     current_user_id = get_jwt_identity()  # Get the ID of the current user from the JWT token.
 
-    # Check if the book is already loaned by the current user.
-    existing_loan = Loans.query.filter_by(user_id=current_user_id, book_id=book_id).first()
-    if existing_loan:
-        return jsonify({'error': 'You have already loaned this book.'}), 400  # Return error if the book is already loaned.
-
-    book = Books.query.filter_by(id=book_id).first()  # Retrieve the book by its ID.
-    if not book:
-        return jsonify({'error': 'The book does not exist.'}), 404  # Return error if the book doesn't exist.
-
-    # Check if the book is available to be loaned.
-    if book.status != 'available' and book.copyStatus != 'available':
-        return jsonify({'error': 'All copies of the book are currently on loan.'}), 400
+    result = checkout_books(current_user_id, [book_id])[0]  # Apply the checkout rules to the book.
+    if 'error' in result:
+        db.session.rollback()
+        return jsonify({'error': result['error']}), result['status']
+    try:
+        bump_catalog_version()  # Invalidate cached catalog responses.
+        db.session.commit()  # Commit the copy count and the loan record together.
+        return jsonify({'message': 'Book loaned successfully.'}), 200  # Return success message.
+    except Exception:
+        current_app.logger.exception('Failed to loan book %s', book_id)  # Log the error with its traceback.
+        db.session.rollback()  # Rollback the transaction in case of failure.
+        return jsonify({'error': 'Failed to loan the book.'}), 500  # Return error message.
 
-    # If the book is available, mark it as taken.
-    if book.status == 'available' or book.copyStatus == 'available':
-        if book.status == 'available':
-            book.status = 'taken'
-        else:
-            book.copyStatus = 'taken'
 
-        # Determine the return date based on the book's loan type.
-        loan_duration = {1: 10, 2: 5, 3: 2}  # Define loan durations for different types.
-        return_days = loan_duration.get(book.loan_type)  # Get the return days from the loan_duration dict.
-        if not return_days:
-            return jsonify({'error': 'Invalid loan type.'}), 400  # Return error if the loan type is invalid.
+@bp.route('/return/<int:loan_id>', methods=['POST'])  # Define a route for returning a loaned book using the loan's ID.
+@jwt_required()  # Require JWT authentication to ensure only authenticated users can access this route.
+def return_book(loan_id):
+    current_user_id = get_jwt_identity()  # Get the current user's ID from the JWT.
 
-        return_date = datetime.utcnow() + timedelta(days=return_days)  # Calculate the return date.
+    result = return_loans(current_user_id, [loan_id])[0]  # Apply the return rules to the loan.
+    if 'error' in result:
+        db.session.rollback()
+        return jsonify({'error': result['error']}), result['status']
+    try:
+        bump_catalog_version()  # Invalidate cached catalog responses.
+        db.session.commit()  # Commit the changes to the database.
+        return jsonify({'message': 'Book returned successfully.'}), 200  # Return success message.
+    except Exception:
+        current_app.logger.exception('Failed to return loan %s', loan_id)  # Log the error with its traceback.
+        db.session.rollback()  # Rollback the transaction in case of failure.
+        return jsonify({'error': 'Failed to return the book.'}), 500  # Return error message.
 
-        # Create a new loan record for the book.
-        new_loan = Loans(user_id=current_user_id, book_id=book_id, loan_date=datetime.utcnow(), return_date=return_date)
-        try:
-            db.session.add(new_loan)  # Add the new loan to the session.
-            db.session.commit()  # Commit the transaction to save the loan record.
-            return jsonify({'message': 'Book loaned successfully.'}), 200  # Return success message.
-        except Exception as e:
-            print(str(e))  # Print any exceptions to the console.
-            db.session.rollback()  # Rollback the transaction in case of failure.
-            return jsonify({'error': 'Failed to loan the book.'}), 500  # Return error message.
 
+@bp.route('/loans/batch', methods=['POST'])  # Define a route for loaning many books at once, e.g. from a circulation desk.
+@jwt_required()  # Require JWT authentication to access this route.
+def loan_books_batch():
+    data = get_batch_body()  # Parse the JSON body: {"book_ids": [...], "user_id": optional}.
+    book_ids = get_batch_ids(data, 'book_ids')
+    if book_ids is None:
+        return jsonify({'error': 'book_ids must be a list of at most %d book IDs' % MAX_BATCH_ITEMS}), 400
+    if data.get('user_id') is not None and not is_id(data['user_id']):
+        return jsonify({'error': 'user_id must be a user ID'}), 400
+
+    # Books are loaned to the current user, admins at the desk can loan them to another user.
+    user_id = get_jwt_identity()
+    if data.get('user_id') is not None and data['user_id'] != user_id:
+        if not current_user_is_admin():
+            return jsonify({'error': 'Permission denied. Only admin users can loan books to other users.'}), 403
+        if not db.session.get(Users, data['user_id']):
+            return jsonify({'error': 'User not found'}), 404
+        user_id = data['user_id']
+
+    results = checkout_books(user_id, book_ids)  # Apply the checkout rules to every book.
+    return commit_batch(results, 'book_id', 'Failed to loan the books.')
+
+
+@bp.route('/returns/batch', methods=['POST'])  # Define a route for returning many loans at once, e.g. a returns bin.
+@jwt_required()  # Require JWT authentication to ensure only authenticated users can access this route.
+def return_books_batch():
+    data = get_batch_body()  # Parse the JSON body: {"loan_ids": [...]}.
+    loan_ids = get_batch_ids(data, 'loan_ids')
+    if loan_ids is None:
+        return jsonify({'error': 'loan_ids must be a list of at most %d loan IDs' % MAX_BATCH_ITEMS}), 400
 
+    results = return_loans(get_jwt_identity(), loan_ids)  # Apply the return rules to every loan.
+    return commit_batch(results, 'loan_id', 'Failed to return the books.')
 
 
-@app.route('/return/<int:loan_id>', methods=['POST'])  # Define a route for returning a loaned book using the loan's ID.
-@jwt_required()  # Require JWT authentication to ensure only authenticated users can access this route.
-def return_book(loan_id):
-    current_user_id = get_jwt_identity()  # Get the current user's ID from the JWT.
+# Function to read the JSON object of a batch request, an empty one if the body is missing or isn't an object
+def get_batch_body():
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else {}
 
-    loan = Loans.query.get(loan_id)  # Retrieve the loan record by its ID.
-    if not loan:
-        return jsonify({'error': 'Loan record not found.'}), 404  # Return error if the loan record is not found.
 
-    # Check if the current user is authorized to return the book.
-    if loan.user_id != current_user_id and Users.query.get(current_user_id).account != 'admin':
-        return jsonify({'error': 'You are not authorized to return this book.'}), 403
+# Function to check if a JSON value is an ID, a whole number that isn't true or false (bool is a subclass of int)
+def is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
 
-    db.session.delete(loan)  # Delete the loan record to mark the book as returned.
 
-    book = Books.query.get(loan.book_id)  # Retrieve the book associated with the loan.
-    if not book:
-        return jsonify({'error': 'Associated book not found.'}), 404  # Return error if the book is not found.
+# Function to read a list of IDs from a batch request without duplicates, returns None if it isn't valid
+def get_batch_ids(data, key):
+    ids = data.get(key)
+    if not isinstance(ids, list) or not ids or not all(is_id(item) for item in ids):
+        return None
+    ids = list(dict.fromkeys(ids))  # Drop duplicates and keep the order.
+    return ids if len(ids) <= MAX_BATCH_ITEMS else None
 
-    # Update the book's status to available once returned.
-    if book.copyStatus == 'taken':
-        book.copyStatus = 'available'
-    elif book.status == 'taken':
-        book.status = 'available'
 
+# Function to commit every successful item of a batch at once and report the result of each item
+def commit_batch(results, id_key, failure_message):
+    succeeded = [result for result in results if 'error' not in result]
     try:
-        db.session.commit()  # Commit the changes to the database.
-        return jsonify({'message': 'Book returned successfully.'}), 200  # Return success message.
-    except Exception as e:
-        print(str(e))  # Print any exceptions to the console.
+        db.session.flush()  # Assign IDs to the new loans before the commit expires them.
+        for result in succeeded:
+            if 'loan' in result:
+                result['loan_id'] = result.pop('loan').id
+        if succeeded:
+            bump_catalog_version()  # Invalidate cached catalog responses.
+        db.session.commit()  # One commit for the whole batch.
+    except Exception:
+        current_app.logger.exception('Failed to commit batch')  # Log the error with its traceback.
         db.session.rollback()  # Rollback the transaction in case of failure.
-        return jsonify({'error': 'Failed to return the book.'}), 500  # Return error message.
-
-    
+        return jsonify({'error': failure_message}), 500
+
+    items = []
+    for result in results:
+        item = {id_key: result[id_key], 'success': 'error' not in result}
+        if 'error' in result:
+            item['error'] = result['error']
+        elif id_key != 'loan_id':
+            item['loan_id'] = result['loan_id']  # The new loan's ID.
+        items.append(item)
+    return jsonify({'results': items, 'succeeded': len(succeeded), 'failed': len(results) - len(succeeded)}), 200
+
+
+# Function to loan books to a user, checking every book against the loan rules, the caller commits
+# Books and the user's existing loans are loaded in one query each, every copy is taken with a conditional update.
+def checkout_books(user_id, book_ids):
+    books = {book.id: book for book in Books.query.filter(Books.id.in_(book_ids))}
+    loaned = set(db.session.execute(
+        select(Loans.book_id).where(Loans.user_id == user_id, Loans.book_id.in_(book_ids))
+    ).scalars())
+
+    loan_date = utc_now()
+    results = []
+    changes = {}  # Counter changes for the statistics, applied in the caller's transaction.
+    city = None
+    for book_id in book_ids:
+        book = books.get(book_id)
+        if book_id in loaned:  # Check if the book is already loaned by the user.
+            results.append({'book_id': book_id, 'error': 'You have already loaned this book.', 'status': 400})
+            continue
+        if not book:
+            results.append({'book_id': book_id, 'error': 'The book does not exist.', 'status': 404})
+            continue
+        # Determine the return date based on the book's loan type.
+        return_days = LOAN_DURATIONS.get(book.loan_type)
+        if not return_days:
+            results.append({'book_id': book_id, 'error': 'Invalid loan type.', 'status': 400})
+            continue
+
+        # Take a copy in a single conditional update, so two concurrent loans can't both get the last copy.
+        taken = db.session.execute(
+            update(Books)
+            .where(Books.id == book_id, Books.available_copies > 0)
+            .values(available_copies=Books.available_copies - 1)
+            .execution_options(synchronize_session=False)
+        )
+        if taken.rowcount == 0:
+            results.append({'book_id': book_id, 'error': 'All copies of the book are currently on loan.', 'status': 400})
+            continue
 
-@app.route('/user/loans', methods=['GET'])  # Define a route to fetch loans for the current user.
+        # Create a new loan record for the book.
+        new_loan = Loans(user_id=user_id, book_id=book_id, loan_date=loan_date, return_date=loan_date + timedelta(days=return_days))
+        db.session.add(new_loan)
+        loaned.add(book_id)
+        results.append({'book_id': book_id, 'loan': new_loan})
+
+        # Count the loan for the book, its author and the borrower's city.
+        if city is None:
+            city = db.session.execute(select(Users.city).where(Users.id == user_id)).scalar()
+        for scope, subject in (('total', ''), ('book', book_id), ('author', book.author), ('city', city)):
+            circulation.add(changes, scope, subject, loans=1, active_loans=1)
+    update_stats(changes)
+    return results
+
+
+# Function to return loans, checking that each one exists and belongs to the user unless they are an admin, the caller commits
+# Loans are loaded in one query and deleted in one statement, each book gets its returned copies back in one update.
+def return_loans(user_id, loan_ids):
+    loans = {row.id: row for row in db.session.execute(
+        select(Loans.id, Loans.user_id).where(Loans.id.in_(loan_ids))
+    )}
+
+    results = {}
+    allowed = []
+    for loan_id in loan_ids:
+        loan = loans.get(loan_id)
+        if not loan:
+            results[loan_id] = {'loan_id': loan_id, 'error': 'Loan record not found.', 'status': 404}
+        elif loan.user_id != user_id and not current_user_is_admin():  # Check if the user is authorized to return the book.
+            results[loan_id] = {'loan_id': loan_id, 'error': 'You are not authorized to return this book.', 'status': 403}
+        else:
+            allowed.append(loan_id)
+
+    # Delete the loan records to mark the books as returned, loans returned in the meantime are not deleted twice.
+    # The deleted loans are moved to the loan history in the same transaction, so the loans table only holds active loans.
+    returned_copies = {}
+    if allowed:
+        deleted = db.session.execute(
+            delete(Loans).where(Loans.id.in_(allowed))
+            .returning(Loans.id, Loans.user_id, Loans.book_id, Loans.loan_date, Loans.return_date)
+            .execution_options(synchronize_session=False)
+        ).all()
+        returned_at = utc_now()
+        history = []
+        for loan in deleted:
+            results[loan.id] = {'loan_id': loan.id}
+            returned_copies[loan.book_id] = returned_copies.get(loan.book_id, 0) + 1
+            history.append({'loan_id': loan.id, 'user_id': loan.user_id, 'book_id': loan.book_id,
+                            'loan_date': loan.loan_date, 'due_date': loan.return_date, 'returned_at': returned_at})
+        if history:
+            db.session.execute(insert(LoanHistory), history)
+
+        # Uncount the active loans of the books, their authors and the borrowers' cities.
+        authors = dict(db.session.execute(select(Books.id, Books.author).where(Books.id.in_(returned_copies))).all())
+        cities = dict(db.session.execute(select(Users.id, Users.city).where(Users.id.in_({loan.user_id for loan in deleted}))).all())
+        changes = {}
+        for loan in deleted:
+            for scope, subject in (('total', ''), ('book', loan.book_id), ('author', authors.get(loan.book_id)), ('city', cities.get(loan.user_id))):
+                circulation.add(changes, scope, subject, active_loans=-1, returns=1)
+        update_stats(changes)
+        circulation.uncount_overdue(db.session.connection(), [loan.return_date for loan in deleted], returned_at)
+
+    # Put the copies back, never above the number of copies the library holds.
+    for book_id, count in returned_copies.items():
+        db.session.execute(
+            update(Books)
+            .where(Books.id == book_id)
+            .values(available_copies=case(
+                (Books.available_copies + count > Books.total_copies, Books.total_copies),
+                else_=Books.available_copies + count
+            ))
+            .execution_options(synchronize_session=False)
+        )
+
+    return [results.get(loan_id) or {'loan_id': loan_id, 'error': 'Loan record not found.', 'status': 404} for loan_id in loan_ids]
+
+
+
+@bp.route('/user/loans', methods=['GET'])  # Define a route to fetch loans for the current user.
 @jwt_required()  # Require JWT authentication to access this route.
 def get_user_loans():
     current_user_id = get_jwt_identity()  # Get the current user's ID from the JWT.
 
-    # Query the database for loans associated with the current user.
-    loans = db.session.query(Loans, Books).join(Books).filter(Loans.user_id == current_user_id).all()
-
-    loaned_books = []  # Initialize a list to store loaned book data.
-    for loan, book in loans:  # Loop through each loan and associated book.
-        # Append book and loan details to the loaned_books list.
-        loaned_books.append({
-            'loan_id': loan.id,
-            'id': book.id,
-            'name': book.name,
-            'author': book.author,
-            'year_published': book.year_published,
-            'description': book.description,
-            'image': book.image,
-            'loan_date': loan.loan_date.strftime('%Y-%m-%d %H:%M:%S'),
-            'return_date': loan.return_date.strftime('%Y-%m-%d %H:%M:%S') if loan.return_date else None,
-            'late': loan.return_date < datetime.now() if loan.return_date else False  # Calculate if the book is late.
-        })
+    # Query the database for the requested fields of the current user's loans and their books.
+    # Lateness is computed by the database against the same UTC clock used when loaning.
+    fields = get_fields(USER_LOAN_FIELDS)
+    statement = (select(*USER_LOAN_FIELDS.columns(fields)).select_from(Loans).join(Books, Books.id == Loans.book_id)
+                 .where(Loans.user_id == current_user_id).order_by(Loans.id))
+    rows = db.session.execute(statement, {'now': utc_now()}).all()
+    loaned_books = [USER_LOAN_FIELDS.row_to_dict(row, fields) for row in rows]  # Build each loan's dict from its row.
 
-    return jsonify({'loans': loaned_books, 'account': Users.query.get(current_user_id).account}), 200  # Return the list of loaned books and the user's account type.
+    return jsonify({'loans': loaned_books, 'account': get_jwt().get('account') or get_account(current_user_id)}), 200  # Return the list of loaned books and the user's account type.
 
 
 
-@app.route('/admin/loans', methods=['GET'])  # Define a route to get all loaned books accessible only by admins.
+@bp.route('/admin/loans', methods=['GET'])  # Define a route to get all loaned books accessible only by admins.
 @jwt_required()  # Require JWT authentication to ensure only authenticated users can access this route.
+@admin_required  # Restrict access to admin users.
 def get_all_loaned_books_for_admins():
-    current_user_id = get_jwt_identity()  # Retrieve the current user's ID from their JWT.
-
-    # Verify if the current user is an admin.
-    user = db.session.get(Users, current_user_id)
-    if user.account.lower() != 'admin':
-        # If not an admin, deny access to the route.
-        return jsonify({'error': 'Permission denied. Only admin users can access this endpoint.'}), 403
-
-    # Query all loan records.
-    loaned_books = Loans.query.all()
-    loaned_books_data = []  # Initialize a list to store data about loaned books.
-
-    for loan in loaned_books:  # Iterate over each loan record.
-        book = db.session.get(Books, loan.book_id)  # Get the book associated with each loan.
-        if book:  # If the book exists,
-            user_who_loaned = db.session.get(Users, loan.user_id)  # Get the user who loaned the book.
-            # Compile loan and book information into a dict.
-            loan_data = {
-                'loan_id': loan.id,
-                'user_id': user_who_loaned.id,
-                'id': book.id,
-                'name': book.name,
-                'author': book.author,
-                'year_published': book.year_published,
-                'description': book.description,
-                'image': book.image,
-                'loan_date': loan.loan_date.strftime('%Y-%m-%d %H:%M:%S'),
-                'return_date': loan.return_date.strftime('%Y-%m-%d %H:%M:%S')
-            }
-            # Determine if the loan is late based on the current date and return date.
-            if loan.return_date and loan.return_date < datetime.now():
-                loan_data['late'] = True
-            else:
-                loan_data['late'] = False
-            loaned_books_data.append(loan_data)  # Add the loan data to the list.
-
-    return jsonify({'loans': loaned_books_data}), 200  # Return the list of all loaned books as JSON.
-
-
-@app.route('/customers', methods=['GET'])  # Define a route to get information about all customers/users.
+    now = utc_now()  # Single point in time used for every lateness check in this request.
+    fields = get_fields(ADMIN_LOAN_FIELDS)
+    query = admin_loans_query(fields)  # Fetch loans together with their book and user in a single joined query.
+
+    # Filter by the user who loaned the book or by the loaned book if requested.
+    user_id = request.args.get('user_id', type=int)
+    if user_id is not None:
+        query = query.filter(Loans.user_id == user_id)
+    book_id = request.args.get('book_id', type=int)
+    if book_id is not None:
+        query = query.filter(Loans.book_id == book_id)
+
+    # Filter by a range of loan dates (YYYY-MM-DD or full ISO timestamps) if requested.
+    loaned_from = request.args.get('loaned_from', type=datetime.fromisoformat)
+    loaned_to = request.args.get('loaned_to', type=datetime.fromisoformat)
+    if loaned_from is not None:
+        query = query.filter(Loans.loan_date >= loaned_from)
+    if loaned_to is not None:
+        query = query.filter(Loans.loan_date <= loaned_to)
+
+    # Filter by late status if requested.
+    late = request.args.get('late')
+    if late is not None:
+        if late.lower() in ('true', '1', 'yes'):
+            query = query.filter(loan_is_late(now))
+        else:
+            query = query.filter(~loan_is_late(now))
+
+    # Continue after the last loan of the previous page if a cursor was sent.
+    cursor = request.args.get('cursor')
+    if cursor:
+        last_id = decode_cursor(cursor)
+        if last_id is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        query = query.filter(Loans.id > last_id)
+
+    # Stream every matching loan instead of a single page if an export format was requested.
+    export_format = get_export_format()
+    if export_format:
+        return stream_export(query.order_by(Loans.id), lambda row: ADMIN_LOAN_FIELDS.row_to_dict(row, fields), export_format, 'loans', {'now': now})
+
+    # Fetch one extra row to know if there is a next page.
+    limit = get_page_size()
+    rows = db.session.execute(query.order_by(Loans.id).limit(limit + 1), {'now': now}).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].cursor_id)
+
+    loaned_books_data = [ADMIN_LOAN_FIELDS.row_to_dict(row, fields) for row in rows]  # Compile loan and book information for each row.
+    return jsonify({'loans': loaned_books_data, 'next_cursor': next_cursor}), 200  # Return the page of loaned books as JSON.
+
+
+@bp.route('/admin/loans/overdue', methods=['GET'])  # Define a route to list late loans, most overdue first, accessible only by admins.
+@jwt_required()  # Require JWT authentication to ensure only authenticated users can access this route.
+@admin_required  # Restrict access to admin users.
+def get_overdue_loans():
+    now = utc_now()
+    # Only loans whose return date has passed, read in return date order from the return_date index.
+    fields = get_fields(ADMIN_LOAN_FIELDS)
+    query = admin_loans_query(fields).filter(Loans.return_date < now)
+
+    # Continue after the last loan of the previous page, the cursor holds its return date and ID.
+    cursor = request.args.get('cursor')
+    if cursor:
+        last = decode_cursor(cursor, datetime.fromisoformat, int)
+        if last is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        last_return_date, last_id = last
+        query = query.filter(or_(
+            Loans.return_date > last_return_date,
+            and_(Loans.return_date == last_return_date, Loans.id > last_id)
+        ))
+
+    # Fetch one extra row to know if there is a next page.
+    limit = get_page_size()
+    rows = db.session.execute(query.order_by(Loans.return_date, Loans.id).limit(limit + 1), {'now': now}).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].cursor_return_date.isoformat(), rows[-1].cursor_id)
+
+    overdue_loans = []  # Initialize a list to store the late loans.
+    for row in rows:
+        loan_data = ADMIN_LOAN_FIELDS.row_to_dict(row, fields)
+        loan_data['days_overdue'] = (now - row.cursor_return_date).days  # Whole days since the book should have been returned.
+        overdue_loans.append(loan_data)
+    return jsonify({'loans': overdue_loans, 'next_cursor': next_cursor}), 200  # Return the page of late loans as JSON.
+
+
+@bp.route('/admin/loans/history', methods=['GET'])  # Define a route to list returned loans, newest returns first, accessible only by admins.
 @jwt_required()  # Require JWT authentication to ensure only authenticated users can access this route.
+@admin_required  # Restrict access to admin users.
+def get_loan_history():
+    # Select the requested fields, plus the return time and ID for the cursor.
+    fields = get_fields(HISTORY_FIELDS)
+    query = select(*HISTORY_FIELDS.columns(fields), LoanHistory.id.label('cursor_id'), LoanHistory.returned_at.label('cursor_returned_at'))
+
+    # Filter by the user who loaned the book or by the loaned book if requested.
+    user_id = request.args.get('user_id', type=int)
+    if user_id is not None:
+        query = query.filter(LoanHistory.user_id == user_id)
+    book_id = request.args.get('book_id', type=int)
+    if book_id is not None:
+        query = query.filter(LoanHistory.book_id == book_id)
+
+    # Filter by a range of return times (YYYY-MM-DD or full ISO timestamps) if requested, read from the returned_at index.
+    returned_from = request.args.get('returned_from', type=datetime.fromisoformat)
+    returned_to = request.args.get('returned_to', type=datetime.fromisoformat)
+    if returned_from is not None:
+        query = query.filter(LoanHistory.returned_at >= returned_from)
+    if returned_to is not None:
+        query = query.filter(LoanHistory.returned_at <= returned_to)
+
+    # Continue after the last return of the previous page, the cursor holds its return time and ID.
+    cursor = request.args.get('cursor')
+    if cursor:
+        last = decode_cursor(cursor, datetime.fromisoformat, int)
+        if last is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        last_returned_at, last_id = last
+        query = query.filter(or_(
+            LoanHistory.returned_at < last_returned_at,
+            and_(LoanHistory.returned_at == last_returned_at, LoanHistory.id < last_id)
+        ))
+    query = query.order_by(LoanHistory.returned_at.desc(), LoanHistory.id.desc())
+
+    # Stream the whole matching history instead of a single page if an export format was requested.
+    export_format = get_export_format()
+    if export_format:
+        return stream_export(query, lambda row: HISTORY_FIELDS.row_to_dict(row, fields), export_format, 'loan_history')
+
+    # Fetch one extra row to know if there is a next page.
+    limit = get_page_size()
+    rows = db.session.execute(query.limit(limit + 1)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].cursor_returned_at.isoformat(), rows[-1].cursor_id)
+
+    history = [HISTORY_FIELDS.row_to_dict(row, fields) for row in rows]  # Build each returned loan's dict from its row.
+    return jsonify({'loans': history, 'next_cursor': next_cursor}), 200  # Return the page of returned loans as JSON.
+
+
+# Function to build the joined Loans/Books/Users query behind the admin loan listings, selecting only the requested fields
+# The loan ID and return date are always selected for the cursors, execute it with the :now parameter for lateness.
+def admin_loans_query(fields):
+    return (select(*ADMIN_LOAN_FIELDS.columns(fields), Loans.id.label('cursor_id'), Loans.return_date.label('cursor_return_date'))
+            .select_from(Loans).join(Books, Books.id == Loans.book_id).join(Users, Users.id == Loans.user_id))
+
+
+@bp.route('/customers', methods=['GET'])  # Define a route to get information about all customers/users.
+@jwt_required()  # Require JWT authentication to ensure only authenticated users can access this route.
+@admin_required  # Restrict access to admin users.
 def get_all_customers():
-    # Verify if the current user is an admin to access the customer data.
-    current_user = db.session.get(Users, get_jwt_identity())
-    if current_user.account.lower() != 'admin':
-        return jsonify({'error': 'Permission denied. Only admin users can access this endpoint.'}), 403
-
-    customers = Users.query.all()  # Query all user records from the database.
-    customers_data = []  # Initialize a list to store user data.
-
-    for customer in customers:  # Iterate over each user record.
-        # Compile user information into a dict.
-        customer_data = {
-            'id': customer.id,
-            'username': customer.username,
-            'email': customer.email,
-            'city': customer.city,
-            'age': customer.age,
-            'account': customer.account
-        }
-        customers_data.append(customer_data)  # Add the user data to the list.
-
-    return jsonify(customers_data), 200  # Return the list of all users as JSON.
-
-
-
-
-@app.route('/customers/<int:user_id>', methods=['GET', 'DELETE'])  # Define a route to either get information about a specific user or delete them.
+    fields = get_fields(CUSTOMER_FIELDS)  # Only the requested fields are selected and encoded.
+    query = select(*CUSTOMER_FIELDS.columns(fields), Users.id.label('cursor_id'))
+
+    # Filter by city and account type if requested, read in ID order from the city and account indexes.
+    city = request.args.get('city')
+    if city:
+        query = query.filter(Users.city == city)
+    account = request.args.get('account')
+    if account:
+        query = query.filter(Users.account == account.lower())  # Accounts are stored in lower case, see signup.
+
+    # Filter by a range of ages if requested.
+    age_from = request.args.get('age_from', type=int)
+    age_to = request.args.get('age_to', type=int)
+    if age_from is not None:
+        query = query.filter(Users.age >= age_from)
+    if age_to is not None:
+        query = query.filter(Users.age <= age_to)
+
+    # Filter by the start of the email or username if requested, as a range so the email and username indexes are used.
+    prefix = request.args.get('prefix')
+    if prefix:
+        query = query.filter(or_(prefix_filter(Users.email, prefix), prefix_filter(Users.username, prefix)))
+
+    # Continue after the last user of the previous page if a cursor was sent.
+    cursor = request.args.get('cursor')
+    if cursor:
+        last_id = decode_cursor(cursor)
+        if last_id is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        query = query.filter(Users.id > last_id)
+    query = query.order_by(Users.id)
+
+    # Stream every matching user instead of a single page if an export format was requested.
+    export_format = get_export_format()
+    if export_format:
+        return stream_export(query, lambda row: CUSTOMER_FIELDS.row_to_dict(row, fields), export_format, 'customers')
+
+    # Fetch one extra row to know if there is a next page.
+    limit = get_page_size()
+    rows = db.session.execute(query.limit(limit + 1)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].cursor_id)
+
+    customers_data = [CUSTOMER_FIELDS.row_to_dict(row, fields) for row in rows]  # Compile user information into a dict for each row.
+    return jsonify({'customers': customers_data, 'next_cursor': next_cursor}), 200  # Return the page of users as JSON.
+
+# Function to build a filter for values starting with a prefix, as a range that can be read from an index unlike LIKE
+# The range ends just before the prefix with its last character incremented, so 'ab' matches 'ab' up to but excluding 'ac'.
+# The last character can't be incremented past U+10FFFF, so those are dropped first, and a prefix of only those has no end.
+def prefix_filter(column, prefix):
+    stem = prefix.rstrip(chr(sys.maxunicode))
+    if not stem:
+        return column >= prefix
+    return and_(column >= prefix, column < stem[:-1] + chr(ord(stem[-1]) + 1))
+
+
+
+
+@bp.route('/customers/<int:user_id>', methods=['GET', 'DELETE'])  # Define a route to either get information about a specific user or delete them.
 @jwt_required()  # Require JWT authentication for this route.
+@admin_required  # Restrict access to admin users.
 def get_or_delete_customer(user_id):
-    # Verify admin privileges before allowing access to user data or deletion capabilities.
-    current_user = db.session.get(Users, get_jwt_identity())
-    if current_user.account.lower() != 'admin':
-        return jsonify({'error': 'Permission denied. Only admin users can access this endpoint.'}), 403
-
-    customer = Users.query.get(user_id)  # Retrieve the specific user by their ID.
+    if request.method == 'GET':  # If the method is GET, return the requested fields of the user's information.
+        fields = get_fields(CUSTOMER_FIELDS)
+        row = db.session.execute(select(*CUSTOMER_FIELDS.columns(fields)).where(Users.id == user_id)).first()
+        if not row:
+            # If the user doesn't exist, return an error.
+            return jsonify({'error': 'Customer not found.'}), 404
+        return jsonify(CUSTOMER_FIELDS.row_to_dict(row, fields)), 200
+
+    customer = db.session.get(Users, user_id)  # Retrieve the specific user by their ID.
     if not customer:
         # If the user doesn't exist, return an error.
         return jsonify({'error': 'Customer not found.'}), 404
-
-    if request.method == 'GET':  # If the method is GET, return the user's information.
-        customer_data = {
-            'id': customer.id,
-            'username': customer.username,
-            'email': customer.email,
-            'city': customer.city,
-            'age': customer.age,
-            'account': customer.account
-        }
-        return jsonify(customer_data), 200
-    elif request.method == 'DELETE':  # If the method is DELETE, remove the user from the database.
+    if request.method == 'DELETE':  # If the method is DELETE, remove the user from the database.
+        # Uncount the user's loans from their city in the statistics in the same transaction, the totals keep the loans.
+        active_loans = db.session.scalar(select(func.count()).select_from(Loans).where(Loans.user_id == user_id))
+        returns = db.session.scalar(select(func.count()).select_from(LoanHistory).where(LoanHistory.user_id == user_id))
+        changes = {}
+        circulation.add(changes, 'city', customer.city, loans=-(active_loans + returns), active_loans=-active_loans, returns=-returns)
+        update_stats(changes)
+        circulation.remove_empty(db.session.connection(), list(changes))  # The city's last borrower.
         db.session.delete(customer)
         db.session.commit()
+        revoke_user(user_id)  # Stop honouring the deleted user's tokens right away.
         return jsonify({'message': 'Customer deleted successfully.'}), 200
 
 
+@bp.route('/admin/cache', methods=['GET'])  # Define a route to inspect the catalog response cache, accessible only by admins.
+@jwt_required()  # Require JWT authentication for this route.
+@admin_required  # Restrict access to admin users.
+def get_cache_stats():
+    stats = library().response_cache.stats()  # Read the hit, miss and eviction counters.
+    stats['catalog_version'] = catalog_versions()['books']
+    return jsonify(stats), 200
+
+
+@bp.route('/admin/stats', methods=['GET'])  # Define a route for circulation statistics, accessible only by admins.
+@jwt_required()  # Require JWT authentication for this route.
+@admin_required  # Restrict access to admin users.
+def get_circulation_stats():
+    top = max(1, min(request.args.get('top', DEFAULT_STATS_TOP, type=int), MAX_PAGE_SIZE))  # How many books, authors and cities to list.
+
+    # The totals and rankings are read from the counters kept by every loan, return and catalog change.
+    totals = db.session.get(CirculationStats, ('total', '')) or CirculationStats(books=0, copies=0, loans=0, active_loans=0, returns=0)
+
+    # Late loans are counted up to the last overdue sweep, only the loans falling due since then are read from the return_date index.
+    overdue = circulation.count_overdue(db.session.connection(), utc_now())
+
+    # Function to list the subjects of a scope with the most loans, read in order from the scope/loans index
+    def ranking(scope):
+        return db.session.execute(
+            select(CirculationStats).where(CirculationStats.scope == scope)
+            .order_by(CirculationStats.loans.desc(), CirculationStats.subject).limit(top)
+        ).scalars().all()
+
+    top_books = ranking('book')
+    names = dict(db.session.execute(select(Books.id, Books.name).where(Books.id.in_([int(row.subject) for row in top_books]))).all())
+
+    return jsonify({
+        'totals': {
+            'books': totals.books,
+            'copies': totals.copies,
+            'loans': totals.loans,
+            'active_loans': totals.active_loans,
+            'returns': totals.returns,
+            'overdue_loans': overdue,
+            'overdue_rate': round(overdue / totals.active_loans, 4) if totals.active_loans else 0,
+            'utilization': round(totals.active_loans / totals.copies, 4) if totals.copies else 0,  # Share of copies on loan.
+        },
+        'top_books': [{'book_id': int(row.subject), 'name': names.get(int(row.subject)), 'loans': row.loans,
+                       'active_loans': row.active_loans} for row in top_books],
+        'top_authors': [{'author': row.subject, 'books': row.books, 'loans': row.loans, 'active_loans': row.active_loans}
+                        for row in ranking('author')],
+        'top_cities': [{'city': row.subject, 'loans': row.loans, 'active_loans': row.active_loans} for row in ranking('city')],
+    }), 200
+
+
+
+@bp.route('/metrics', methods=['GET'])  # Define a route for Prometheus to scrape request and database metrics.
+def get_metrics():
+    return Response(library().request_metrics.render(), mimetype='text/plain; version=0.0.4')  # Prometheus text exposition format.
+
+
+# Apps made by create_app in this process, whose database connections are dropped in forked children
+apps = weakref.WeakSet()
+
+# Function to create and configure the app, settings come from the environment (see config.py) and config overrides them
+# Flask finds this factory on its own, so `flask --app app run` and the commands below work unchanged.
+def create_app(config=None):
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app) # Encode JSON responses with orjson when it is installed
+    app.config.update(load_config(), RATE_LIMITS=RATE_LIMITS)
+    if config:
+        app.config.update(config)
+        if 'SQLALCHEMY_DATABASE_URI' in config and 'SQLALCHEMY_ENGINE_OPTIONS' not in config:
+            app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+
+    # Initialize database, the app's state (request metrics, the password hashing pool, caches), JWT Manager, and CORS support
+    db.init_app(app)
+    state = app.extensions['library'] = LibraryState(app.config)
+    state.request_metrics.init_app(app)
+    with app.app_context():
+        configure_engine(db.engine)  # Set WAL mode and the other SQLite pragmas on every new connection.
+        state.request_metrics.watch_engine(db.engine)  # Count queries and database time per request.
+    if app.config['PROXY_FIX_HOPS']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_HOPS'])  # Rate limit by the client's address, not the proxy's.
+    jwt.init_app(app)
+    CORS(app, supports_credentials=True)
+    app.register_blueprint(bp)
+    apps.add(app)
+    return app
+
+# Function run in every forked child, e.g. each worker of a preforking server started from a preloaded app
+# Pooled connections were opened by the parent, so the child drops them without closing them (which would close the
+# parent's sockets and files too) and opens its own. Threads don't survive a fork, so the hashing pool and sweeper start over.
+def after_fork():
+    for app in list(apps):
+        with app.app_context():
+            db.engine.dispose(close=False)
+        state = app.extensions['library']
+        state.hashing_pool.after_fork()
+        state.overdue_sweeper.after_fork()
+
+os.register_at_fork(after_in_child=after_fork)
+
 
 #adding books for testing
 # def add_books_for_testing():
@@ -571,8 +1876,8 @@ def get_or_delete_customer(user_id):
 #             'author': 'F. Scott Fitzgerald',
 #             'year_published': 1925,
 #             'description': 'A novel by F. Scott Fitzgerald that captures the essence of the Jazz Age in America.',
-#             'status': 'available',
-#             'copyStatus': 'available',
+#             'total_copies': 2,
+#             'available_copies': 2,
 #             'loan_type': 1
 #         },
 #         {
@@ -580,8 +1885,8 @@ def get_or_delete_customer(user_id):
 #             'author': 'Harper Lee',
 #             'year_published': 1960,
 #             'description': 'Harper Lee\'s classic novel addressing racial injustice in the American South.',
-#             'status': 'available',
-#             'copyStatus': 'available',
+#             'total_copies': 2,
+#             'available_copies': 2,
 #             'loan_type': 2
 #         },
 #         {
@@ -589,8 +1894,8 @@ def get_or_delete_customer(user_id):
 #             'author': 'George Orwell',
 #             'year_published': 1949,
 #             'description': 'George Orwell\'s dystopian masterpiece exploring the dangers of totalitarianism.',
-#             'status': 'available',
-#             'copyStatus': 'available',
+#             'total_copies': 2,
+#             'available_copies': 2,
 #             'loan_type': 2
 #         },
 #         {
@@ -598,8 +1903,8 @@ def get_or_delete_customer(user_id):
 #             'author': 'J.D. Salinger',
 #             'year_published': 1951,
 #             'description': 'J.D. Salinger\'s iconic novel narrated by the unforgettable Holden Caulfield.',
-#             'status': 'available',
-#             'copyStatus': 'available',
+#             'total_copies': 2,
+#             'available_copies': 2,
 #             'loan_type': 1
 #         },
 #         {
@@ -607,8 +1912,8 @@ def get_or_delete_customer(user_id):
 #             'author': 'Jane Austen',
 #             'year_published': 1813,
 #             'description': 'Jane Austen\'s timeless tale of love and manners in early 19th-century England.',
-#             'status': 'available',
-#             'copyStatus': 'available',
+#             'total_copies': 2,
+#             'available_copies': 2,
 #             'loan_type': 3
 #         },
 #         {
@@ -616,8 +1921,8 @@ def get_or_delete_customer(user_id):
 #             'author': 'J.R.R. Tolkien',
 #             'year_published': 1937,
 #             'description': 'J.R.R. Tolkien\'s enchanting adventure of Bilbo Baggins and his quest for treasure.',
-#             'status': 'available',
-#             'copyStatus': 'available',
+#             'total_copies': 2,
+#             'available_copies': 2,
 #             'loan_type': 3
 #         },
 #         {
@@ -625,8 +1930,8 @@ def get_or_delete_customer(user_id):
 #             'author': 'J.K. Rowling',
 #             'year_published': 1997,
 #             'description': 'The first book in J.K. Rowling\'s magical series about the young wizard Harry Potter.',
-#             'status': 'available',
-#             'copyStatus': 'available',
+#             'total_copies': 2,
+#             'available_copies': 2,
 #             'loan_type': 1
 #         },
 #         {
@@ -634,8 +1939,8 @@ def get_or_delete_customer(user_id):
 #             'author': 'J.R.R. Tolkien',
 #             'year_published': 1954,
 #             'description': 'J.R.R. Tolkien\'s epic fantasy trilogy filled with elves, dwarves, and the One Ring.',
-#             'status': 'available',
-#             'copyStatus': 'available',
+#             'total_copies': 2,
+#             'available_copies': 2,
 #             'loan_type': 2
 #         },
 #         {
@@ -643,8 +1948,8 @@ def get_or_delete_customer(user_id):
 #             'author': 'Stephen King',
 #             'year_published': 1977,
 #             'description': 'Stephen King\'s chilling novel about a family isolated in a haunted hotel.',
-#             'status': 'available',
-#             'copyStatus': 'available',
+#             'total_copies': 2,
+#             'available_copies': 2,
 #             'loan_type': 3
 #         },
 #         {
@@ -652,8 +1957,8 @@ def get_or_delete_customer(user_id):
 #             'author': 'Herman Melville',
 #             'year_published': 1851,
 #             'description': 'Herman Melville\'s classic tale of Captain Ahab\'s obsessive quest for the white whale.',
-#             'status': 'available',
-#             'copyStatus': 'available',
+#             'total_copies': 2,
+#             'available_copies': 2,
 #             'loan_type': 1
 #         },
 #     ]
@@ -673,11 +1978,18 @@ def get_or_delete_customer(user_id):
 # This conditional ensures that the following block of code runs only if the script is executed directly,
 # and not when imported as a module in another script.
 if __name__ == '__main__':
+    app = create_app()
     # The `app.app_context()` provides an application context, which is necessary for certain operations like accessing the database.
     with app.app_context():
-        # `db.create_all()` creates all tables in the database based on the models defined earlier in the script.
-        # This is idempotent, meaning it only creates tables that don't already exist.
-        db.create_all()
+        # `upgrade_schema()` applies the versioned migrations from migrations.py that the database doesn't have yet.
+        # This is idempotent, and upgrades databases created by the old `db.create_all()` in place.
+        upgrade_schema(db.engine)
+        get_suggest_index()  # Build the suggestion index before the first keystroke needs it.
+    # Start the hashing processes now, so the first logins don't wait for them.
+    app.extensions['library'].hashing_pool.start()
+    # Sweep overdue loans in the background if OVERDUE_SWEEP_INTERVAL is set.
+    with app.app_context():
+        app.extensions['library'].overdue_sweeper.start(db.engine)
         # Here, the function to add books for testing is commented out.
         # add_books_for_testing()
     # `app.run()` starts the Flask application with debugging enabled and on port 8000.
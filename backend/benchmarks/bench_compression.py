@@ -0,0 +1,81 @@
+# Benchmark for response compression: bytes saved and CPU spent at each gzip level and brotli quality
+# Fetches large pages of /books, /admin/loans, /user/loans and /customers from a synthetic database, then compresses each body
+# at every level and prints one JSON line per endpoint, encoding and level, with the time to send it over a slow link.
+# Usage (from the backend folder): python benchmarks/bench_compression.py [--books 20000] [--repeat 20] [--mbps 2]
+import argparse, json, os, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PASSWORD = 'password' # Password of every generated user
+LEVELS = {'gzip': range(1, 10), 'br': range(0, 12)} # Levels tried for each encoding
+
+
+# Function to time a call, returns the fastest of repeat runs in milliseconds and the last result
+def best_time(repeat, f, *args):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best * 1000, 3), result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the size and compression time of large JSON responses at each level.')
+    parser.add_argument('--books', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--loans', type=int, default=10000)
+    parser.add_argument('--limit', type=int, default=200, help='Page size requested from each endpoint.')
+    parser.add_argument('--repeat', type=int, default=20, help='Compressions timed per level, the fastest is kept.')
+    parser.add_argument('--mbps', type=float, default=2, help='Link speed used to estimate the transfer time.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        from app import create_app, db, upgrade_schema, LOAN_DURATIONS
+        # Every simulated client comes from the same address, so rate limiting would measure the limiter rather than the app.
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmp, 'bench.db'), 'RATE_LIMIT_ENABLED': False})
+        from compression import ENCODINGS, compress, decompress
+        from datagen import generate
+        from bench_load import sign_in
+
+        with app.app_context():
+            upgrade_schema(db.engine)
+            generate(db.engine, args.books, args.users, args.loans, app.extensions['library'].hashing_pool.hash_password(PASSWORD), LOAN_DURATIONS, admins=1, seed=42)
+
+        # Fetch the bodies uncompressed, the user with the most loans is used for /user/loans.
+        client = app.test_client()
+        admin_headers = sign_in(client, 1)
+        with app.app_context():
+            busiest = db.session.execute(db.text("SELECT user_id FROM loans GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1")).scalar()
+        user_headers = sign_in(client, busiest)
+        query = {'limit': args.limit}
+        bodies = {
+            'books': client.get('/books', query_string=query).data,
+            'admin_loans': client.get('/admin/loans', query_string=query, headers=admin_headers).data,
+            'user_loans': client.get('/user/loans', query_string=query, headers=user_headers).data,
+            'customers': client.get('/customers', query_string=query, headers=admin_headers).data,
+        }
+
+        # Time cached /books pages as served, the compressed body is cached with the page after the first request.
+        served = {}
+        for encoding in ('identity',) + ENCODINGS:
+            headers = {'Accept-Encoding': encoding}
+            served[encoding] = best_time(args.repeat, lambda: client.get('/books', query_string=query, headers=headers))[0]
+        app.extensions['library'].hashing_pool.shutdown()
+        with app.app_context():
+            db.engine.dispose()
+
+    transfer_ms = lambda size: round(size * 8 / (args.mbps * 1000), 1)  # Bytes to milliseconds at mbps megabits per second.
+    for name, body in bodies.items():
+        print(json.dumps({'endpoint': name, 'encoding': 'identity', 'level': None, 'bytes': len(body), 'ratio': 1.0,
+                          'compress_ms': 0, 'decompress_ms': 0, 'transfer_ms': transfer_ms(len(body))}))
+        for encoding in ENCODINGS:
+            for level in LEVELS[encoding]:
+                compress_ms, compressed = best_time(args.repeat, compress, body, encoding, level)
+                decompress_ms, restored = best_time(args.repeat, decompress, compressed, encoding)
+                assert restored == body
+                print(json.dumps({'endpoint': name, 'encoding': encoding, 'level': level, 'bytes': len(compressed),
+                                  'ratio': round(len(body) / len(compressed), 2), 'compress_ms': compress_ms,
+                                  'decompress_ms': decompress_ms, 'transfer_ms': transfer_ms(len(compressed))}))
+    print(json.dumps({'endpoint': 'books', 'served_from_cache_ms': served}))
@@ -0,0 +1,114 @@
+# Benchmark for catalog reads running next to checkout/return writes, with SQLite defaults and with the tuned pragmas
+# Usage (from the backend folder): python benchmarks/bench_concurrency.py [--readers 8] [--writers 4] [--seconds 5]
+import argparse, json, os, random, sys, tempfile, threading, time
+from datetime import datetime, timedelta
+import sqlalchemy as sa
+from sqlalchemy.exc import OperationalError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from migrations import upgrade
+from database import engine_options, configure_engine
+
+# SQLite settings compared: what the app used to run with (pysqlite waits 5 seconds on locks by default), and the ones database.py now applies
+MODES = {
+    'default': {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL', 'SQLITE_BUSY_TIMEOUT': '5000', 'SQLITE_MMAP_SIZE': '0'},
+    'tuned': {},
+}
+
+
+# Function to fill the database with users and books to loan
+def seed(engine, users, books):
+    with engine.begin() as conn:
+        conn.execute(sa.text(
+            "INSERT INTO users (id, username, email, password, city, age, account) VALUES (:id, :name, :email, 'x', 'city', 30, 'user')"
+        ), [{'id': i, 'name': 'user%d' % i, 'email': 'user%d@example.com' % i} for i in range(1, users + 1)])
+        conn.execute(sa.text(
+            "INSERT INTO books (id, name, author, year_published, loan_type, total_copies, available_copies) "
+            "VALUES (:id, :name, :author, 2000, 1, 1000000, 1000000)"
+        ), [{'id': i, 'name': 'book%d' % i, 'author': 'author%d' % (i % 500)} for i in range(1, books + 1)])
+
+
+# Function run by a writer thread: check out a book and return an earlier loan, one transaction each, like loan_book/return_book
+def write_loop(engine, users, books, stop, stats):
+    while not stop.is_set():
+        try:
+            with engine.begin() as conn:
+                book_id = random.randint(1, books)
+                conn.execute(sa.text("UPDATE books SET available_copies = available_copies - 1 WHERE id = :id"), {'id': book_id})
+                conn.execute(sa.text(
+                    "INSERT INTO loans (user_id, book_id, loan_date, return_date) VALUES (:user_id, :book_id, :now, :due)"
+                ), {'user_id': random.randint(1, users), 'book_id': book_id, 'now': datetime.utcnow(), 'due': datetime.utcnow() + timedelta(days=10)})
+            with engine.begin() as conn:
+                loan = conn.execute(sa.text("DELETE FROM loans WHERE id = (SELECT MIN(id) FROM loans) RETURNING book_id")).first()
+                if loan:
+                    conn.execute(sa.text("UPDATE books SET available_copies = available_copies + 1 WHERE id = :id"), {'id': loan.book_id})
+            stats['writes'] += 2
+        except OperationalError:  # "database is locked"
+            stats['write_errors'] += 1
+
+
+# Function run by a reader thread: fetch catalog pages and record how long each one took
+def read_loop(engine, books, stop, stats):
+    statement = sa.text("SELECT * FROM books WHERE id > :after ORDER BY id LIMIT 50")
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                conn.execute(statement, {'after': random.randint(0, books)}).fetchall()
+            stats['latencies'].append(time.perf_counter() - start)
+        except OperationalError:  # "database is locked"
+            stats['read_errors'] += 1
+
+
+# Function to get a percentile of a sorted list of latencies in milliseconds
+def percentile(latencies, fraction):
+    if not latencies:
+        return None
+    return round(latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] * 1000, 3)
+
+
+# Function to run readers and writers together against a fresh database with the given SQLite settings
+def run(mode, env, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        url = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+        engine = sa.create_engine(url, pool_size=args.readers + args.writers, **engine_options(url, env))
+        configure_engine(engine, env)
+        upgrade(engine)
+        seed(engine, args.users, args.books)
+
+        stop = threading.Event()
+        stats = {'writes': 0, 'write_errors': 0, 'read_errors': 0, 'latencies': []}
+        threads = [threading.Thread(target=write_loop, args=(engine, args.users, args.books, stop, stats)) for _ in range(args.writers)]
+        threads += [threading.Thread(target=read_loop, args=(engine, args.books, stop, stats)) for _ in range(args.readers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+
+    latencies = sorted(stats['latencies'])
+    return {
+        'mode': mode,
+        'reads_per_sec': round(len(latencies) / args.seconds, 1),
+        'read_p50_ms': percentile(latencies, 0.50),
+        'read_p99_ms': percentile(latencies, 0.99),
+        'read_max_ms': percentile(latencies, 1.0),
+        'read_errors': stats['read_errors'],
+        'writes_per_sec': round(stats['writes'] / args.seconds, 1),
+        'write_errors': stats['write_errors'],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure read latency under concurrent writes with default and tuned SQLite settings.')
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    for mode, env in MODES.items():
+        print(json.dumps(run(mode, env, args)))
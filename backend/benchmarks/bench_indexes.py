@@ -0,0 +1,73 @@
+# Benchmark for the hot lookups before and after the lookup indexes migration, on a seeded SQLite database
+# Usage (from the backend folder): python benchmarks/bench_indexes.py [--users 200000] [--books 100000] [--loans 500000]
+import argparse, json, os, random, sys, tempfile, time
+from datetime import datetime, timedelta
+import sqlalchemy as sa
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from migrations import upgrade
+
+INDEX_MIGRATION = 3 # Version of the migration that adds the lookup indexes
+
+
+# Function to fill the database with synthetic users, books and loans
+def seed(engine, users, books, loans):
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(sa.text(
+            "INSERT INTO users (id, username, email, password, city, age, account) VALUES (:id, :name, :email, 'x', 'city', 30, 'user')"
+        ), [{'id': i, 'name': 'user%d' % i, 'email': 'user%d@example.com' % i} for i in range(1, users + 1)])
+        conn.execute(sa.text(
+            "INSERT INTO books (id, name, author, year_published, loan_type, status, \"copyStatus\") "
+            "VALUES (:id, :name, :author, 2000, 1, 'available', 'available')"
+        ), [{'id': i, 'name': 'book%d' % i, 'author': 'author%d' % (i % 5000)} for i in range(1, books + 1)])
+        conn.execute(sa.text(
+            "INSERT INTO loans (user_id, book_id, loan_date, return_date) VALUES (:user_id, :book_id, :loan_date, :return_date)"
+        ), [{
+            'user_id': random.randint(1, users),
+            'book_id': random.randint(1, books),
+            'loan_date': now - timedelta(days=random.randint(0, 30)),
+            'return_date': now + timedelta(days=random.randint(-20, 10)),
+        } for _ in range(loans)])
+
+
+# Function to time each lookup, returns the average latency in milliseconds
+def measure(engine, users, books, repeat):
+    lookups = {
+        'login_by_email': ("SELECT * FROM users WHERE email = :email", lambda: {'email': 'user%d@example.com' % random.randint(1, users)}),
+        'loan_by_user_and_book': ("SELECT * FROM loans WHERE user_id = :user_id AND book_id = :book_id",
+                                  lambda: {'user_id': random.randint(1, users), 'book_id': random.randint(1, books)}),
+        'loans_by_user': ("SELECT * FROM loans WHERE user_id = :user_id", lambda: {'user_id': random.randint(1, users)}),
+        'loans_by_book': ("SELECT * FROM loans WHERE book_id = :book_id", lambda: {'book_id': random.randint(1, books)}),
+        'overdue_page': ("SELECT * FROM loans WHERE return_date < :now ORDER BY return_date LIMIT 50", lambda: {'now': datetime.utcnow()}),
+    }
+    results = {}
+    with engine.connect() as conn:
+        for name, (sql, params) in lookups.items():
+            statement = sa.text(sql)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                conn.execute(statement, params()).fetchall()
+            results[name] = round((time.perf_counter() - start) * 1000 / repeat, 4)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure lookup latency before and after the index migration.')
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--loans', type=int, default=500000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = sa.create_engine('sqlite:///' + os.path.join(tmp, 'bench.db'))
+        upgrade(engine, target=INDEX_MIGRATION - 1)
+        seed(engine, args.users, args.books, args.loans)
+        before = measure(engine, args.users, args.books, args.repeat)
+        upgrade(engine, target=INDEX_MIGRATION)
+        after = measure(engine, args.users, args.books, args.repeat)
+        engine.dispose()
+
+    for name in before:
+        print(json.dumps({'lookup': name, 'before_ms': before[name], 'after_ms': after[name]}))
@@ -0,0 +1,173 @@
+# Load test for the app: concurrent clients send a weighted mix of requests against a synthetic database
+# Prints one JSON line per request type with p50/p95/p99 latency and throughput, then a total line, so runs can be diffed between commits.
+# Usage (from the backend folder): python benchmarks/bench_load.py [--books 100000] [--users 20000] [--loans 50000] [--clients 8] [--seconds 10]
+import argparse, json, os, random, subprocess, sys, tempfile, threading, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PASSWORD = 'password' # Password of every generated user
+DEFAULT_MIX = 'login=5,books=25,book=30,loan=10,return=10,user_loans=10,admin_loans=10' # Relative weight of each request type
+
+
+# Function to parse a mix like "books=3,book=1" into request types and weights
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        name, weight = part.split('=')
+        weights[name.strip()] = float(weight)
+    unknown = set(weights) - set(REQUESTS)
+    if unknown:
+        raise SystemExit('Unknown request types in --mix: %s' % ', '.join(sorted(unknown)))
+    return weights
+
+
+# Function to log a generated user in and get their authorization header
+def login(client, user_id):
+    response = client.post('/login', json={'email': 'user%d@example.com' % user_id, 'password': PASSWORD})
+    return response, {'Authorization': 'Bearer ' + response.get_json()['access_token']} if response.status_code == 200 else None
+
+
+# Function to log a client in before the run, waiting while the hashing pool is busy with the other clients' logins
+def sign_in(client, user_id):
+    while True:
+        response, headers = login(client, user_id)
+        if response.status_code != 503:
+            return headers
+        time.sleep(float(response.headers.get('Retry-After', 1)))
+
+
+# Each request type takes a simulated client and returns the response (None to skip), ctx holds its test client, token and the dataset sizes.
+def request_login(ctx):
+    return login(ctx['client'], ctx['rng'].randint(ctx['first_user'], ctx['last_user']))[0]
+
+def request_books(ctx):
+    if ctx['rng'].random() < 0.5:  # Half the catalog views browse the first page, the others filter by author.
+        return ctx['client'].get('/books')
+    return ctx['client'].get('/books', query_string={'author': ctx['rng'].choice(ctx['authors'])})
+
+def request_book(ctx):
+    return ctx['client'].get('/books/%d' % ctx['rng'].randint(1, ctx['books']), headers=ctx['headers'])
+
+def request_loan(ctx):
+    return ctx['client'].post('/loan/%d' % ctx['rng'].randint(1, ctx['books']), headers=ctx['headers'])
+
+def request_user_loans(ctx):
+    return ctx['client'].get('/user/loans', headers=ctx['headers'])
+
+def request_return(ctx):
+    loans = ctx['client'].get('/user/loans', headers=ctx['headers']).get_json()['loans']
+    if not loans:
+        return None
+    ctx['start'] = time.perf_counter()  # Only time the return, looking up a loan to return is not part of it.
+    return ctx['client'].post('/return/%d' % ctx['rng'].choice(loans)['loan_id'], headers=ctx['headers'])
+
+def request_admin_loans(ctx):
+    return ctx['client'].get('/admin/loans', query_string={'limit': 50}, headers=ctx['admin_headers'])
+
+REQUESTS = {
+    'login': request_login,
+    'books': request_books,
+    'book': request_book,
+    'loan': request_loan,
+    'return': request_return,
+    'user_loans': request_user_loans,
+    'admin_loans': request_admin_loans,
+}
+
+
+# Function run by each simulated client: log in, then send requests from the mix until the deadline
+def client_loop(app, ctx, weights, deadline, results, lock):
+    ctx['client'] = app.test_client()
+    ctx['headers'] = sign_in(ctx['client'], ctx['rng'].randint(ctx['first_user'] + 1, ctx['last_user']))
+    ctx['admin_headers'] = sign_in(ctx['client'], ctx['first_user'])  # The first generated user is an admin.
+    names, name_weights = list(weights), list(weights.values())
+    local = {name: {'latencies': [], 'errors': 0} for name in names}
+    while time.perf_counter() < deadline:
+        name = ctx['rng'].choices(names, name_weights)[0]
+        ctx['start'] = time.perf_counter()
+        response = REQUESTS[name](ctx)
+        elapsed = time.perf_counter() - ctx['start']
+        if response is None:
+            continue
+        local[name]['latencies'].append(elapsed)
+        if response.status_code >= 500 or response.status_code in (401, 403):  # 4xx like "no copies left" are expected answers.
+            local[name]['errors'] += 1
+    with lock:
+        for name, stats in local.items():
+            results[name]['latencies'] += stats['latencies']
+            results[name]['errors'] += stats['errors']
+
+
+# Function to get a percentile of a sorted list of latencies in milliseconds
+def percentile(latencies, fraction):
+    if not latencies:
+        return None
+    return round(latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] * 1000, 3)
+
+
+# Function to summarize the latencies of one request type
+def summarize(name, latencies, errors, seconds, run):
+    latencies = sorted(latencies)
+    return dict(run, request=name, requests=len(latencies), errors=errors, per_sec=round(len(latencies) / seconds, 1),
+                p50_ms=percentile(latencies, 0.50), p95_ms=percentile(latencies, 0.95), p99_ms=percentile(latencies, 0.99))
+
+
+# Function to get the current git commit, so results can be compared between commits
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Drive the app with a mix of requests and report latency percentiles and throughput.')
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--loans', type=int, default=50000)
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent simulated clients.')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Weights of the request types, default: ' + DEFAULT_MIX)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    weights = parse_mix(args.mix)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        from app import create_app, db, upgrade_schema, rebuild_search_index, recompute_stats, LOAN_DURATIONS
+        # Every simulated client comes from the same address, so rate limiting would measure the limiter rather than the app.
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmp, 'bench.db'), 'RATE_LIMIT_ENABLED': False})
+        from datagen import generate, FIRST_NAMES, LAST_NAMES
+
+        with app.app_context():
+            upgrade_schema(db.engine)
+            start = time.perf_counter()
+            generate(db.engine, args.books, args.users, args.loans, app.extensions['library'].hashing_pool.hash_password(PASSWORD), LOAN_DURATIONS, admins=1, seed=args.seed)
+            rebuild_search_index()
+            recompute_stats()
+            load_seconds = time.perf_counter() - start
+
+        run = {'commit': git_commit(), 'books': args.books, 'users': args.users, 'loans': args.loans, 'clients': args.clients}
+        results = {name: {'latencies': [], 'errors': 0} for name in weights}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + args.seconds
+        threads = [threading.Thread(target=client_loop, args=(app, {
+            'rng': random.Random(args.seed + i),
+            'first_user': 1,
+            'last_user': args.users,
+            'books': args.books,
+            'authors': ['%s %s' % (first, last) for first in FIRST_NAMES for last in LAST_NAMES],
+        }, weights, deadline, results, lock)) for i in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        app.extensions['library'].hashing_pool.shutdown()
+        with app.app_context():
+            db.engine.dispose()
+
+    all_latencies = []
+    for name, stats in results.items():
+        print(json.dumps(summarize(name, stats['latencies'], stats['errors'], args.seconds, run)))
+        all_latencies += stats['latencies']
+    print(json.dumps(dict(summarize('total', all_latencies, sum(stats['errors'] for stats in results.values()), args.seconds, run),
+                          load_seconds=round(load_seconds, 2))))
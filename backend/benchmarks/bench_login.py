@@ -0,0 +1,46 @@
+# Micro-benchmark for login password checks: logins/sec through the hashing pool at each bcrypt cost
+# Usage (from the backend folder): python benchmarks/bench_login.py [--rounds 4 8 10 12] [--logins 64] [--workers N]
+import argparse, json, os, sys, time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hashing import HashingPool, HashingPoolSaturated
+
+
+# Function to run a burst of concurrent logins against the pool and measure the throughput
+def run(rounds, logins, workers, clients):
+    pool = HashingPool(rounds=rounds, workers=workers, max_pending=clients)
+    pool.start()
+    stored_hash = pool.hash_password('secret')  # Also warms up the worker processes.
+
+    def login(_):
+        try:
+            return pool.check_password(stored_hash, 'secret')
+        except HashingPoolSaturated:
+            return None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as threads:
+        results = list(threads.map(login, range(logins)))
+    elapsed = time.perf_counter() - start
+    pool.shutdown()
+    rejected = results.count(None)
+    return {
+        'rounds': rounds,
+        'workers': workers,
+        'logins': logins,
+        'rejected': rejected,
+        'seconds': round(elapsed, 4),
+        'logins_per_sec': round((logins - rejected) / elapsed, 2),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure logins/sec at each bcrypt cost.')
+    parser.add_argument('--rounds', type=int, nargs='+', default=[4, 6, 8, 10, 12])
+    parser.add_argument('--logins', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--clients', type=int, default=16, help='concurrent login requests')
+    args = parser.parse_args()
+    for rounds in args.rounds:
+        print(json.dumps(run(rounds, args.logins, args.workers, args.clients)))
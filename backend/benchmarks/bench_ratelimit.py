@@ -0,0 +1,103 @@
+# Benchmark for the rate limiter's cost per request: the token bucket on its own, from several threads, and through the app
+# The app is timed serving a cached /books page with rate limiting off and on (with limits too high to ever deny),
+# anonymous and with a JWT, so the difference is what the limiter adds to every limited request.
+# Usage (from the backend folder): python benchmarks/bench_ratelimit.py [--keys 100000] [--requests 20000]
+import argparse, json, os, random, sys, tempfile, threading, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ratelimit import MemoryBuckets
+
+HIGH_LIMIT = 10 ** 9 # Requests per second allowed when timing the overhead, so no request is ever denied
+
+
+# Function to get a percentile of a sorted list of latencies in microseconds
+def percentile(latencies, fraction):
+    return round(latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] * 1e6, 2)
+
+
+# Function to take tokens for keys picked at random, returns the sorted latency of each take
+def take_many(store, keys, count, seed):
+    rng = random.Random(seed)
+    latencies = []
+    for _ in range(count):
+        key = rng.choice(keys)
+        start = time.perf_counter()
+        store.take(key, HIGH_LIMIT, 1)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+# Function to time the same GET through the test client, returns the latencies
+def time_requests(client, path, headers, count):
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        client.get(path, headers=headers)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the per-request cost of the rate limiter.')
+    parser.add_argument('--keys', type=int, default=100000, help='Distinct clients with a bucket.')
+    parser.add_argument('--requests', type=int, default=20000, help='Takes or requests timed per case.')
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+    keys = ['/books|user|user:%d' % i for i in range(args.keys)]
+
+    # The bucket store alone, one thread and then several threads sharing it.
+    store = MemoryBuckets()
+    for key in keys:
+        store.take(key, HIGH_LIMIT, 1)
+    latencies = sorted(take_many(store, keys, args.requests, 1))
+    print(json.dumps({'case': 'take', 'threads': 1, 'keys': len(store), 'p50_us': percentile(latencies, 0.5), 'p99_us': percentile(latencies, 0.99)}))
+    results = []
+    threads = [threading.Thread(target=lambda seed: results.extend(take_many(store, keys, args.requests // args.threads, seed)), args=(i,))
+               for i in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    results.sort()
+    print(json.dumps({'case': 'take', 'threads': args.threads, 'keys': len(store), 'p50_us': percentile(results, 0.5),
+                      'p99_us': percentile(results, 0.99), 'takes_per_sec': round(len(results) / elapsed)}))
+
+    # Idle buckets are dropped by the sweep once they are full again.
+    start = time.perf_counter()
+    for shard, buckets in enumerate(store.shards):
+        with store.locks[shard]:
+            store.sweep(buckets, time.monotonic() + 1)
+    print(json.dumps({'case': 'sweep', 'keys_before': args.keys, 'keys_after': len(store), 'sweep_ms': round((time.perf_counter() - start) * 1000, 2)}))
+
+    # Through the app: a cached catalog page, with rate limiting off and on.
+    with tempfile.TemporaryDirectory() as tmp:
+        from app import create_app, db, upgrade_schema, Books, Users, RATE_LIMITS
+        limits = {route: [(key, HIGH_LIMIT, 1) for key, _, _ in policy] for route, policy in RATE_LIMITS.items()}
+        config = {'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmp, 'bench.db'), 'HASHING_WORKERS': 0, 'BCRYPT_LOG_ROUNDS': 4,
+                  'RATE_LIMITS': limits}
+        app = create_app(config)
+        with app.app_context():
+            upgrade_schema(db.engine)
+            db.session.add_all([Books(name='Book %d' % i, author='Author %d' % (i % 10), year_published=2000, loan_type=1) for i in range(50)])
+            db.session.add(Users(username='bench', email='bench@example.com', password=app.extensions['library'].hashing_pool.hash_password('password'), city='c', age=30, account='user'))
+            db.session.commit()
+        client = app.test_client()
+        token = client.post('/login', json={'email': 'bench@example.com', 'password': 'password'}).get_json()['access_token']
+        signed_in = {'Authorization': 'Bearer ' + token}
+        for headers, who in ((None, 'anonymous'), (signed_in, 'user')):
+            timings = {False: [], True: []}
+            time_requests(client, '/books', headers, 200)  # Warm up the response cache.
+            for _ in range(10):  # Alternate short runs, so drift during the run hits both cases alike.
+                for enabled in (False, True):
+                    app.config['RATE_LIMIT_ENABLED'] = enabled
+                    timings[enabled] += time_requests(client, '/books', headers, args.requests // 10)
+            for latencies in timings.values():
+                latencies.sort()
+            print(json.dumps({'case': 'GET /books', 'client': who,
+                              'off_p50_us': percentile(timings[False], 0.5), 'on_p50_us': percentile(timings[True], 0.5),
+                              'overhead_p50_us': round(percentile(timings[True], 0.5) - percentile(timings[False], 0.5), 2),
+                              'off_p99_us': percentile(timings[False], 0.99), 'on_p99_us': percentile(timings[True], 0.99)}))
+        with app.app_context():
+            db.engine.dispose()
@@ -0,0 +1,134 @@
+# Benchmark for worker cold start: a fresh process importing and creating the app, against a worker forked from a preloaded one
+# Each cold worker is a new interpreter that imports app.py, calls create_app and serves its first requests, like a server
+# without preloading. Each forked worker comes from a parent that did all of that once, like gunicorn with preload_app
+# (see wsgi.py). Prints one JSON line per worker with the time to its first responses and its private and shared memory,
+# then a summary line per mode.
+# Usage (from the backend folder): python benchmarks/bench_startup.py [--books 100000] [--workers 4]
+import argparse, gc, json, os, subprocess, sys, tempfile, time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+FIRST_REQUESTS = ['/books?limit=50', '/books/suggest?prefix=the'] # Requests timed as the worker's first ones
+
+
+# Function to read a process's memory from /proc/self/smaps_rollup, in megabytes
+# Private pages belong to the worker alone, shared ones are still the parent's pages, Pss splits shared pages between their sharers.
+def memory():
+    fields = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    mb = lambda kb: round(kb / 1024, 1)
+    return {
+        'rss_mb': mb(fields['Rss']),
+        'pss_mb': mb(fields['Pss']),
+        'private_mb': mb(fields['Private_Clean'] + fields['Private_Dirty']),
+        'shared_mb': mb(fields['Shared_Clean'] + fields['Shared_Dirty']),
+    }
+
+
+# Function to send the first requests through a new test client, returns the status codes
+def first_requests(app):
+    client = app.test_client()
+    return [client.get(path).status_code for path in FIRST_REQUESTS]
+
+
+# Function run in a cold worker process: import the app, create it and serve the first requests, timing each step
+def cold_worker():
+    start = time.perf_counter()
+    import app as module
+    imported = time.perf_counter()
+    app = module.create_app()
+    created = time.perf_counter()
+    statuses = first_requests(app)
+    served = time.perf_counter()
+    print(json.dumps({'import_ms': round((imported - start) * 1000, 1), 'create_app_ms': round((created - imported) * 1000, 1),
+                      'first_requests_ms': round((served - created) * 1000, 1), 'statuses': statuses, **memory()}))
+
+
+# Function to start a cold worker, returns its timings with the time from spawning it to its first responses
+def run_cold(env):
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--cold-worker'], env=env, cwd=BACKEND,
+                            capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.splitlines()[-1])
+    result['ready_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+# Function to fork a worker from the preloaded app, returns its timings from the fork to its first responses
+# The workers stay alive until all have been measured, so their shared pages are counted as shared.
+def run_forked(app, count):
+    workers = []
+    for _ in range(count):
+        read_fd, write_fd = os.pipe()
+        start = time.perf_counter()  # CLOCK_MONOTONIC, comparable between the parent and the child.
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            statuses = first_requests(app)
+            result = {'ready_ms': round((time.perf_counter() - start) * 1000, 1), 'statuses': statuses, **memory()}
+            os.write(write_fd, json.dumps(result).encode() + b'\n')
+            os.close(write_fd)
+            time.sleep(3600)  # Killed by the parent once every worker has reported.
+            os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as pipe:
+            workers.append((pid, json.loads(pipe.readline())))
+    for pid, _ in workers:
+        os.kill(pid, 9)
+        os.waitpid(pid, 0)
+    return [result for _, result in workers]
+
+
+# Function to summarize a mode's workers
+def summarize(mode, results):
+    ready = sorted(result['ready_ms'] for result in results)
+    return {'mode': mode, 'workers': len(results), 'ready_ms_p50': ready[len(ready) // 2], 'ready_ms_max': ready[-1],
+            'private_mb_avg': round(sum(result['private_mb'] for result in results) / len(results), 1),
+            'pss_mb_avg': round(sum(result['pss_mb'] for result in results) / len(results), 1)}
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--cold-worker']:
+        cold_worker()
+        sys.exit()
+    parser = argparse.ArgumentParser(description='Measure the cold start time and memory of workers with and without a preloaded app.')
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--loans', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=4, help='Workers started in each mode.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Every worker reads its settings from the environment, as it would under a WSGI server.
+        env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(tmp, 'bench.db'), HASHING_WORKERS='0', BCRYPT_LOG_ROUNDS='4')
+        os.environ.update(env)
+        from app import create_app, db, upgrade_schema, rebuild_search_index, recompute_stats, get_suggest_index, LOAN_DURATIONS
+        from datagen import generate
+
+        # Preload like wsgi.py: the data is generated first so the suggestion index has something to hold.
+        start = time.perf_counter()
+        app = create_app()
+        with app.app_context():
+            upgrade_schema(db.engine)
+            generate(db.engine, args.books, args.users, args.loans, app.extensions['library'].hashing_pool.hash_password('password'), LOAN_DURATIONS, admins=1, seed=42)
+            rebuild_search_index()
+            recompute_stats()
+            get_suggest_index()
+            db.engine.dispose()
+        gc.collect()
+        gc.freeze()
+        print(json.dumps({'mode': 'preload', 'books': args.books, 'preload_ms': round((time.perf_counter() - start) * 1000, 1), **memory()}))
+
+        cold = [run_cold(env) for _ in range(args.workers)]
+        forked = run_forked(app, args.workers)
+
+    for mode, results in (('cold', cold), ('forked', forked)):
+        for result in results:
+            print(json.dumps({'mode': mode, **result}))
+    for mode, results in (('cold', cold), ('forked', forked)):
+        print(json.dumps(summarize(mode, results)))
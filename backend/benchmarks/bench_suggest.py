@@ -0,0 +1,79 @@
+# Benchmark for the /books/suggest prefix index: build time, memory and lookup latency over a large synthetic catalog
+# Titles are made distinct with a volume number, so the index holds one key per book, the most it can hold.
+# Usage (from the backend folder): python benchmarks/bench_suggest.py [--books 1000000] [--lookups 100000]
+import argparse, gc, json, os, random, sys, time, tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from suggest import SuggestIndex
+from datagen import FIRST_NAMES, LAST_NAMES, TITLE_WORDS
+
+
+# Function to generate (name, author) rows like the ones datagen inserts, with distinct titles
+def make_books(count, rng):
+    authors = ['%s %s' % (first, last) for first in FIRST_NAMES for last in LAST_NAMES]
+    return [('%s %s %d' % (rng.choice(TITLE_WORDS), rng.choice(TITLE_WORDS), i), rng.choice(authors)) for i in range(count)]
+
+
+# Function to get a percentile of a sorted list of latencies in microseconds
+def percentile(latencies, fraction):
+    return round(latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] * 1e6, 2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the build time, memory and lookup latency of the suggestion index.')
+    parser.add_argument('--books', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=100000)
+    parser.add_argument('--limit', type=int, default=10, help='Suggestions returned per lookup.')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    books = make_books(args.books, rng)
+
+    # Build once untraced for the time, and once under tracemalloc for the memory the index keeps.
+    index = SuggestIndex()
+    gc.collect()
+    start = time.perf_counter()
+    index.build(books)
+    build_seconds = time.perf_counter() - start
+    index = SuggestIndex()
+    gc.collect()
+    tracemalloc.start()
+    index.build(books)
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # Look up prefixes of 1 to 6 characters taken from real titles and authors, like successive keystrokes.
+    prefixes = []
+    for _ in range(args.lookups):
+        text = rng.choice(books)[rng.random() < 0.2]
+        prefixes.append(text[:rng.randint(1, 6)])
+    latencies = []
+    for prefix in prefixes:
+        start = time.perf_counter()
+        index.suggest(prefix, args.limit)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    # Incremental updates, as done by add_book, edit_book and delete_book.
+    updates = []
+    for i in range(1000):
+        name, author = 'New Title %d' % i, rng.choice(books)[1]
+        start = time.perf_counter()
+        index.add(name, author)
+        index.remove(name, author)
+        updates.append(time.perf_counter() - start)
+    updates.sort()
+
+    print(json.dumps({
+        'books': args.books,
+        'keys': len(index),
+        'build_seconds': round(build_seconds, 2),
+        'memory_mb': round(memory / 2 ** 20, 1),
+        'bytes_per_key': round(memory / len(index), 1),
+        'lookup_p50_us': percentile(latencies, 0.50),
+        'lookup_p99_us': percentile(latencies, 0.99),
+        'lookup_max_us': round(latencies[-1] * 1e6, 2),
+        'add_remove_p50_us': percentile(updates, 0.50),
+        'add_remove_p99_us': percentile(updates, 0.99),
+    }))
@@ -0,0 +1,99 @@
+# In-process LRU cache for serialized JSON responses
+import hashlib, threading, time
+from collections import OrderedDict
+
+
+# A cached response body with its strong ETag and an optional expiry time (seconds since the epoch)
+# encoded holds the body compressed with each encoding it was sent with, so it is only compressed once.
+# size is the bytes of the body and its compressed copies, counted against the cache's byte limit.
+class CachedResponse:
+    __slots__ = ('key', 'body', 'etag', 'expires_at', 'encoded', 'size')
+
+    def __init__(self, key, body, etag, expires_at=None):
+        self.key = key
+        self.body = body
+        self.etag = etag
+        self.expires_at = expires_at
+        self.encoded = {}
+        self.size = len(body)
+
+
+# Cache bounded by entry count and by total bytes that evicts the least recently used entries, safe to share between
+# request threads. Responses larger than max_bytes on their own are returned without being cached.
+class ResponseCache:
+    def __init__(self, max_entries=1024, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Function to get a cached response, returns None if the key is missing or its entry has expired
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires_at is not None and entry.expires_at <= time.time():
+                del self.entries[key]  # Drop the expired entry so it gets rebuilt.
+                self.bytes -= entry.size
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)  # Mark the entry as the most recently used.
+            self.hits += 1
+            return entry
+
+    # Function to cache a response body under a key, evicting the least recently used entries when full
+    def set(self, key, body, expires_at=None):
+        entry = CachedResponse(key, body, hashlib.sha256(body).hexdigest(), expires_at)
+        if entry.size > self.max_bytes:
+            return entry
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old.size
+            self.entries[key] = entry
+            self.bytes += entry.size
+            self.evict()
+        return entry
+
+    # Function to keep a compressed copy of a cached body, counting its bytes against the limit
+    # An entry evicted since it was read keeps the copy for the current response only.
+    def add_encoding(self, entry, encoding, body):
+        with self.lock:
+            entry.encoded[encoding] = body
+            if self.entries.get(entry.key) is entry:
+                entry.size += len(body)
+                self.bytes += len(body)
+                self.evict()
+
+    # Function to evict the least recently used entries until the cache is within both limits, the lock must be held
+    def evict(self):
+        while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+            _, entry = self.entries.popitem(last=False)
+            self.bytes -= entry.size
+            self.evictions += 1
+
+    # Function to drop every cached response
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    # Function to report the cache counters for tuning
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,131 @@
+# Circulation counters behind /admin/stats, one row per (scope, subject) in the circulation_stats table
+# Scopes are 'total' (subject ''), 'book' (book ID), 'author' and 'city'. Counters are updated in the same transaction
+# as the change they count, so reading them costs the same however many loans there have been.
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+
+COLUMNS = ('books', 'copies', 'loans', 'active_loans', 'returns') # Counters kept for every scope and subject
+circulation_stats = sa.table('circulation_stats', sa.column('scope'), sa.column('subject'), *(sa.column(name) for name in COLUMNS))
+# Overdue loans are counted up to counted_through, the loans falling due after it are added when the overdue sweep advances it.
+circulation_overdue = sa.table('circulation_overdue', sa.column('id'), sa.column('loans'), sa.column('counted_through', sa.DateTime))
+loans = sa.table('loans', sa.column('return_date', sa.DateTime))
+
+
+# Function to add counter deltas for a subject to a dict of pending changes
+# A None subject (a deleted book, a user without a city) isn't counted.
+def add(changes, scope, subject, **deltas):
+    if subject is None:
+        return
+    counters = changes.setdefault((scope, str(subject)), dict.fromkeys(COLUMNS, 0))
+    for name, delta in deltas.items():
+        counters[name] += delta
+
+
+# Function to apply pending changes on a connection, adding the deltas to existing rows and creating missing ones
+def apply(conn, changes):
+    if not changes:
+        return
+    rows = [dict(counters, scope=scope, subject=subject) for (scope, subject), counters in changes.items()]
+    dialect = conn.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        statement = (sqlite.insert if dialect == 'sqlite' else postgresql.insert)(circulation_stats)
+        statement = statement.on_conflict_do_update(
+            index_elements=['scope', 'subject'],
+            set_={name: circulation_stats.c[name] + statement.excluded[name] for name in COLUMNS}
+        )
+        conn.execute(statement, rows)
+    else:
+        # Other databases: update the row, and insert it if it doesn't exist yet.
+        for row in rows:
+            updated = conn.execute(
+                sa.update(circulation_stats)
+                .where(circulation_stats.c.scope == row['scope'], circulation_stats.c.subject == row['subject'])
+                .values({name: circulation_stats.c[name] + row[name] for name in COLUMNS})
+            )
+            if updated.rowcount == 0:
+                conn.execute(sa.insert(circulation_stats), row)
+    remove_empty(conn, [key for key, counters in changes.items() if counters['books'] < 0])
+
+
+# Function to delete the rows of subjects left with nothing to count, like an author whose last book was deleted
+def remove_empty(conn, keys):
+    for scope, subject in keys:
+        conn.execute(sa.delete(circulation_stats).where(
+            circulation_stats.c.scope == scope, circulation_stats.c.subject == subject,
+            *(circulation_stats.c[name] == 0 for name in COLUMNS)
+        ))
+
+
+# Function to rebuild every counter from the books, loans, users and loan history tables, repairing any drift
+# Loans are counted from active loans plus the loan history still kept, so pruned history is no longer counted.
+def recompute(conn):
+    changes = {}
+    add(changes, 'total', '')  # The total row exists even for an empty library.
+    for author, books, copies in conn.execute(sa.text(
+        "SELECT author, COUNT(*), COALESCE(SUM(total_copies), 0) FROM books GROUP BY author"
+    )):
+        add(changes, 'total', '', books=books, copies=copies)
+        add(changes, 'author', author, books=books)
+
+    # Active loans per book and borrower city, whose book or user may have been deleted since.
+    for book_id, author, city, count in conn.execute(sa.text(
+        "SELECT loans.book_id, books.author, users.city, COUNT(*) FROM loans "
+        "LEFT JOIN books ON books.id = loans.book_id LEFT JOIN users ON users.id = loans.user_id "
+        "GROUP BY loans.book_id, books.author, users.city"
+    )):
+        for scope, subject in (('total', ''), ('book', book_id if author is not None else None), ('author', author), ('city', city)):
+            add(changes, scope, subject, loans=count, active_loans=count)
+
+    # Returned loans, whose book or user may have been deleted since.
+    for book_id, author, city, count in conn.execute(sa.text(
+        "SELECT loan_history.book_id, books.author, users.city, COUNT(*) FROM loan_history "
+        "LEFT JOIN books ON books.id = loan_history.book_id LEFT JOIN users ON users.id = loan_history.user_id "
+        "GROUP BY loan_history.book_id, books.author, users.city"
+    )):
+        add(changes, 'total', '', loans=count, returns=count)
+        add(changes, 'book', book_id if author is not None else None, loans=count, returns=count)
+        add(changes, 'author', author, loans=count, returns=count)
+        add(changes, 'city', city, loans=count, returns=count)
+
+    conn.execute(sa.delete(circulation_stats))
+    apply(conn, changes)
+
+
+# Function to count the loans overdue at now: the counter, plus the loans that fell due since it was last advanced
+# The second part is read from the return_date index and only covers the time since the last sweep.
+def count_overdue(conn, now):
+    row = conn.execute(sa.select(circulation_overdue.c.loans, circulation_overdue.c.counted_through)).first()
+    if row is None:
+        return conn.execute(sa.select(sa.func.count()).select_from(loans).where(loans.c.return_date < now)).scalar()
+    return row.loans + conn.execute(sa.select(sa.func.count()).select_from(loans).where(
+        loans.c.return_date >= row.counted_through, loans.c.return_date < now
+    )).scalar()
+
+
+# Function to add the loans that fell due between counted_through and now to the overdue counter, moving it to now
+def advance_overdue(conn, now):
+    fell_due = sa.select(sa.func.count()).select_from(loans).where(
+        loans.c.return_date >= circulation_overdue.c.counted_through, loans.c.return_date < now
+    ).scalar_subquery()
+    conn.execute(sa.update(circulation_overdue).where(circulation_overdue.c.counted_through < now)
+                 .values(loans=circulation_overdue.c.loans + fell_due, counted_through=now))
+
+
+# Function to uncount returned loans from the overdue counter in the caller's transaction, due_dates are their return dates
+# A loan is only in the counter if it fell due before counted_through, which each update checks on the row it changes.
+def uncount_overdue(conn, due_dates, now):
+    overdue = [{'due_date': due_date} for due_date in due_dates if due_date is not None and due_date < now]
+    if overdue:
+        conn.execute(
+            sa.update(circulation_overdue).where(circulation_overdue.c.counted_through > sa.bindparam('due_date', type_=sa.DateTime))
+            .values(loans=circulation_overdue.c.loans - 1),
+            overdue
+        )
+
+
+# Function to recount the loans overdue at now from the loans table, repairing any drift of the overdue counter
+def recount_overdue(conn, now):
+    conn.execute(sa.delete(circulation_overdue))
+    conn.execute(sa.insert(circulation_overdue), {'id': 1, 'counted_through': now, 'loans': conn.execute(
+        sa.select(sa.func.count()).select_from(loans).where(loans.c.return_date < now)
+    ).scalar()})
@@ -0,0 +1,24 @@
+# Response compression for clients that accept it, with gzip, or brotli when the brotli package is installed
+import gzip
+
+try:
+    import brotli # Optional, smaller bodies than gzip for the same CPU time
+except ImportError:
+    brotli = None
+
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',) # Supported encodings, preferred first when the client accepts several
+COMPRESSIBLE_TYPES = {'application/json', 'application/x-ndjson', 'text/csv', 'text/html', 'text/plain'} # Types worth compressing
+
+
+# Function to compress a body with an encoding at a level (gzip 1-9, brotli quality 0-11)
+def compress(body, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(body, quality=level)
+    return gzip.compress(body, compresslevel=level, mtime=0)  # No timestamp, so the same body always compresses the same.
+
+
+# Function to undo compress, used to check round trips
+def decompress(body, encoding):
+    if encoding == 'br':
+        return brotli.decompress(body)
+    return gzip.decompress(body)
@@ -0,0 +1,52 @@
+# Application settings read from the environment, passed to create_app in app.py, which lets a config dict override them
+import os
+from database import database_url, engine_options
+from reminders import SWEEP_BATCH_SIZE
+
+
+# Function to read the settings from the environment, with the defaults used in development
+def load_config(env=os.environ):
+    hashing_workers = int(env.get('HASHING_WORKERS', os.cpu_count() or 1))
+    url = database_url(env)
+    return {
+        'SECRET_KEY': env.get('SECRET_KEY', 'secret-secret-key'), # Secret key for encoding session cookies
+        'JWT_SECRET_KEY': env.get('JWT_SECRET_KEY', 'secret-secret-key'),
+        'UPLOAD_FOLDER': env.get('UPLOAD_FOLDER', 'uploads'), # Cover images, relative to the backend folder
+
+        # Database configuration, DATABASE_URL selects the backend (SQLite by default, PostgreSQL works unchanged)
+        # SQLite connections are tuned with SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT and SQLITE_MMAP_SIZE,
+        # server connection pools with DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT and DB_POOL_RECYCLE (see database.py).
+        'SQLALCHEMY_DATABASE_URI': url,
+        'SQLALCHEMY_ENGINE_OPTIONS': engine_options(url, env),
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+
+        # Maximum number of cached catalog responses, and their total bytes with compressed copies, before the least recently used are evicted
+        'RESPONSE_CACHE_SIZE': int(env.get('RESPONSE_CACHE_SIZE', 1024)),
+        'RESPONSE_CACHE_BYTES': int(env.get('RESPONSE_CACHE_BYTES', 32 * 1024 * 1024)),
+
+        # Response compression, negotiated with Accept-Encoding (brotli needs the brotli package), smaller bodies are sent uncompressed
+        'COMPRESSION_MIN_SIZE': int(env.get('COMPRESSION_MIN_SIZE', 1024)),
+        'COMPRESSION_LEVELS': {
+            'gzip': int(env.get('GZIP_LEVEL', 6)), # 1 (fastest) to 9 (smallest)
+            'br': int(env.get('BROTLI_QUALITY', 4)), # 0 (fastest) to 11 (smallest)
+        },
+
+        # Password hashing, bcrypt runs on a pool of worker processes
+        'BCRYPT_LOG_ROUNDS': int(env.get('BCRYPT_LOG_ROUNDS', 12)), # bcrypt work factor, existing hashes are upgraded on login when it changes
+        'HASHING_WORKERS': hashing_workers, # Number of hashing processes, 0 hashes on the request thread
+        'HASHING_MAX_PENDING': int(env.get('HASHING_MAX_PENDING', 4 * max(hashing_workers, 1))), # Hashing calls allowed to queue before clients get 503
+
+        # Request metrics, queries slower than SLOW_QUERY_MS are logged with their query plan (unset disables the log)
+        'SLOW_QUERY_MS': float(env['SLOW_QUERY_MS']) if env.get('SLOW_QUERY_MS') else None,
+
+        # Overdue sweep writing reminders to the reminders table, OVERDUE_SWEEP_INTERVAL seconds between sweeps in a background
+        # thread when the app is run directly (unset or 0 disables it, use the sweep-overdue command from cron instead)
+        'OVERDUE_SWEEP_INTERVAL': float(env.get('OVERDUE_SWEEP_INTERVAL') or 0),
+        'OVERDUE_SWEEP_BATCH_SIZE': int(env.get('OVERDUE_SWEEP_BATCH_SIZE', SWEEP_BATCH_SIZE)), # Overdue loans reminded per transaction
+
+        # Rate limiting with the policies in RATE_LIMITS (see app.py), RATE_LIMIT_ENABLED=0 turns it off
+        # Buckets are kept in each worker's memory unless RATE_LIMIT_STORAGE_URL points at a shared store (redis://host:6379/0).
+        'RATE_LIMIT_ENABLED': env.get('RATE_LIMIT_ENABLED', '1') != '0',
+        'RATE_LIMIT_STORAGE_URL': env.get('RATE_LIMIT_STORAGE_URL', ''),
+        'PROXY_FIX_HOPS': int(env.get('PROXY_FIX_HOPS', 0)), # Reverse proxies in front of the app, whose X-Forwarded-For gives the client IP
+    }
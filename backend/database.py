@@ -0,0 +1,56 @@
+# Database engine configuration read from the environment
+# DATABASE_URL picks the backend (SQLite by default), SQLITE_* tune SQLite connections and DB_POOL_* size server pools.
+import os
+from sqlalchemy import event
+
+DEFAULT_DATABASE_URL = 'sqlite:///library.db'
+
+
+# Function to read the database URL, accepting the postgres:// scheme used by many hosting providers
+def database_url(env=os.environ):
+    url = env.get('DATABASE_URL', DEFAULT_DATABASE_URL)
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+# Function to build the SQLAlchemy engine options for the database URL
+def engine_options(url, env=os.environ):
+    if url.startswith('sqlite'):
+        # SQLite waits on locks through busy_timeout (set per connection below), connections can move between threads.
+        return {'connect_args': {'check_same_thread': False}}
+    return {
+        'pool_size': int(env.get('DB_POOL_SIZE', 10)),  # Connections kept open per process.
+        'max_overflow': int(env.get('DB_MAX_OVERFLOW', 20)),  # Extra connections opened under bursts.
+        'pool_timeout': int(env.get('DB_POOL_TIMEOUT', 30)),  # Seconds to wait for a free connection.
+        'pool_recycle': int(env.get('DB_POOL_RECYCLE', 1800)),  # Seconds before a connection is replaced.
+        'pool_pre_ping': True,  # Check connections before use so restarts of the server don't surface as errors.
+    }
+
+
+# Function to read the SQLite pragmas applied to every new connection
+def sqlite_pragmas(env=os.environ):
+    return {
+        # WAL lets readers keep going while a writer commits.
+        'journal_mode': env.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        # NORMAL only syncs at checkpoints in WAL mode, which is safe against corruption.
+        'synchronous': env.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        # Milliseconds a connection waits for a lock before failing with "database is locked".
+        'busy_timeout': int(env.get('SQLITE_BUSY_TIMEOUT', 5000)),
+        # Bytes of the database file read through memory mapping.
+        'mmap_size': int(env.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    }
+
+
+# Function to apply the SQLite pragmas to every connection the engine opens, does nothing for other backends
+def configure_engine(engine, env=os.environ):
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas(env)
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
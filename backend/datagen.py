@@ -0,0 +1,97 @@
+# Synthetic users, books and loans for load testing, generated from a seed so every run produces the same data
+# Rows are bulk-inserted in batches with one executemany per batch, skipping the ORM.
+import itertools, random
+from datetime import datetime, timedelta
+import sqlalchemy as sa
+
+BATCH_SIZE = 50000 # Rows inserted per statement
+MAX_COPIES = 5 # Generated books have between 1 and this many copies
+
+FIRST_NAMES = ['Ada', 'Alan', 'Agatha', 'Bram', 'Charlotte', 'Chinua', 'Doris', 'Emily', 'Franz', 'Gabriel', 'Haruki', 'Isabel',
+               'James', 'Jane', 'Leo', 'Mary', 'Naguib', 'Orhan', 'Primo', 'Ray', 'Sylvia', 'Toni', 'Ursula', 'Virginia', 'Zadie']
+LAST_NAMES = ['Achebe', 'Allende', 'Atwood', 'Austen', 'Borges', 'Bronte', 'Calvino', 'Christie', 'Eco', 'Ferrante', 'Hesse', 'Ishiguro',
+              'Kafka', 'Le Guin', 'Lessing', 'Mahfouz', 'Marquez', 'Morrison', 'Murakami', 'Orwell', 'Pamuk', 'Plath', 'Smith', 'Tolstoy', 'Woolf']
+TITLE_WORDS = ['Atlas', 'Autumn', 'Blue', 'City', 'Dark', 'Dream', 'Empire', 'Fire', 'Garden', 'Glass', 'House', 'Island', 'Journey',
+               'Kingdom', 'Last', 'Light', 'Long', 'Memory', 'Night', 'Ocean', 'River', 'Road', 'Secret', 'Shadow', 'Silent', 'Song',
+               'Stone', 'Storm', 'Summer', 'Time', 'Tower', 'Water', 'Wild', 'Winter', 'Wolf', 'World']
+CITIES = ['Amman', 'Berlin', 'Cairo', 'Haifa', 'Istanbul', 'Jerusalem', 'Lisbon', 'London', 'Madrid', 'Nazareth', 'New York', 'Paris',
+          'Rome', 'Tel Aviv', 'Tokyo']
+
+
+# Function to insert rows in batches, rows is an iterable of tuples in the order of columns
+# Goes straight to the driver's executemany, the ORM and SQL compilation cost more than the inserts themselves.
+def insert_batches(conn, table, columns, rows):
+    placeholder = '?' if conn.dialect.paramstyle == 'qmark' else '%s'
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (table, ', '.join(columns), ', '.join([placeholder] * len(columns)))
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, BATCH_SIZE))
+        if not batch:
+            break
+        conn.exec_driver_sql(sql, batch)
+
+
+# Function to generate and insert the data, returns the number of rows added to each table
+# Users get emails user<id>@example.com and all share password_hash, the first admins of them are admins.
+# Loans are all open (returned loans are deleted), so every book's available copies are its total minus its loans.
+def generate(engine, books, users, loans, password_hash, loan_durations, admins=1, seed=42):
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        first_user = (conn.execute(sa.text("SELECT MAX(id) FROM users")).scalar() or 0) + 1
+        first_book = (conn.execute(sa.text("SELECT MAX(id) FROM books")).scalar() or 0) + 1
+        bind_datetime = sa.DateTime().dialect_impl(conn.dialect).bind_processor(conn.dialect) or (lambda value: value)  # Store dates as the models do.
+
+        # Pick copies and loan types up front, so loans can be assigned to books that still have a copy.
+        total_copies = rng.choices(range(1, MAX_COPIES + 1), k=books)
+        loan_types = rng.choices(sorted(loan_durations), k=books)
+        on_loan = [0] * books
+        loan_rows = []
+        pairs = set() # A user can only loan a book once at a time.
+        loans = min(loans, sum(min(copies, users) for copies in total_copies))  # Cap at what the copies and users allow.
+        while len(loan_rows) < loans:
+            book = int(rng.random() * books)
+            user = first_user + int(rng.random() * users)
+            if on_loan[book] == total_copies[book] or (user, book) in pairs:
+                continue
+            on_loan[book] += 1
+            pairs.add((user, book))
+            days = loan_durations[loan_types[book]]
+            loan_date = now - timedelta(seconds=int(rng.random() * (days + 15) * 86400))  # Some loans are overdue.
+            loan_rows.append((user, first_book + book, bind_datetime(loan_date), bind_datetime(loan_date + timedelta(days=days))))
+
+        user_ids = range(first_user, first_user + users)
+        insert_batches(conn, 'users', ('id', 'username', 'email', 'password', 'city', 'age', 'account'), zip(
+            user_ids,
+            ('user%d' % i for i in user_ids),
+            ('user%d@example.com' % i for i in user_ids),
+            itertools.repeat(password_hash),
+            rng.choices(CITIES, k=users),
+            rng.choices(range(16, 81), k=users),
+            itertools.chain(itertools.repeat('admin', min(admins, users)), itertools.repeat('user')),
+        ))
+
+        # Titles have one to three words, authors are drawn from every first and last name pair.
+        authors = ['%s %s' % (first, last) for first in FIRST_NAMES for last in LAST_NAMES]
+        titles = (' '.join(words[:length]) for length, *words in zip(
+            rng.choices((1, 2, 3), k=books), rng.choices(TITLE_WORDS, k=books), rng.choices(TITLE_WORDS, k=books), rng.choices(TITLE_WORDS, k=books)))
+        descriptions = ('A story of %s and %s.' % (first.lower(), second.lower()) for first, second in zip(rng.choices(TITLE_WORDS, k=books), rng.choices(TITLE_WORDS, k=books)))
+        insert_batches(conn, 'books', ('id', 'name', 'author', 'year_published', 'description', 'loan_type', 'total_copies', 'available_copies'), zip(
+            range(first_book, first_book + books),
+            titles,
+            rng.choices(authors, k=books),
+            rng.choices(range(1900, now.year + 1), k=books),
+            descriptions,
+            loan_types,
+            total_copies,
+            (copies - taken for copies, taken in zip(total_copies, on_loan)),
+        ))
+
+        # On PostgreSQL, explicit IDs don't advance the SERIAL sequences, which would hand the app's next users and books
+        # IDs taken by the generated rows. Move the sequences past them (SQLite assigns MAX(id) + 1 by itself).
+        if conn.dialect.name == 'postgresql':
+            for table in ('users', 'books'):
+                conn.execute(sa.text("SELECT setval(pg_get_serial_sequence('%s', 'id'), (SELECT MAX(id) FROM %s))" % (table, table)))
+
+        insert_batches(conn, 'loans', ('user_id', 'book_id', 'loan_date', 'return_date'), loan_rows)
+    return {'users': users, 'books': books, 'loans': len(loan_rows)}
@@ -0,0 +1,10 @@
+# Gunicorn settings for wsgi.py: gunicorn -c gunicorn.conf.py wsgi:app (from the backend folder)
+# Worker count, threads and address come from the environment, the app's own settings from config.py.
+import os
+
+bind = os.environ.get('BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2 * (os.cpu_count() or 1) + 1))
+threads = int(os.environ.get('THREADS', 4)) # Request threads per worker
+preload_app = True # Load the app once in the master and fork the workers from it, see wsgi.py
+max_requests = int(os.environ.get('MAX_REQUESTS', 0)) # Requests before a worker is replaced, 0 never replaces them
+max_requests_jitter = max_requests // 10
@@ -0,0 +1,93 @@
+# Password hashing on a bounded pool of worker processes, so bcrypt doesn't block request threads
+import multiprocessing, threading
+from concurrent.futures import ProcessPoolExecutor, wait
+import bcrypt
+
+
+# Raised when every worker is busy and the pending queue is full, the caller should ask the client to retry
+class HashingPoolSaturated(Exception):
+    pass
+
+
+# Function run in a worker process to hash a password with the given cost
+def _hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+# Function run in a worker process to report that it is up, used to start every worker before the first hash
+def _ready():
+    return True
+
+
+# Function run in a worker process to check a password against a stored hash
+def _check_password(pw_hash, password):
+    return bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8'))
+
+
+# Function to read the cost a bcrypt hash was created with, hashes look like $2b$12$...
+def hash_rounds(pw_hash):
+    try:
+        return int(pw_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+# Pool of worker processes for bcrypt, with at most max_pending calls queued or running at once
+class HashingPool:
+    def __init__(self, rounds=12, workers=2, max_pending=8):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.executor = None
+        self.executor_lock = threading.Lock()
+
+    # Function to forget the parent's worker processes in a forked child, which starts its own on first use
+    # The executor's threads and pipes belong to the parent, so the child must not use or shut them down.
+    def after_fork(self):
+        self.executor = None
+        self.executor_lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+
+    # Function to start the worker processes, called on first use or early so the first logins don't wait for them
+    # The workers are forked by a single-threaded fork server process, not from this one, because the caller may be a
+    # request thread and forking a process with other threads running can copy a lock one of them holds. Like with spawn,
+    # scripts that hash must keep their own code under `if __name__ == '__main__':`. The executor only creates its
+    # processes as calls are submitted, so one call per worker is run to have them all up when this returns.
+    def start(self):
+        with self.executor_lock:
+            if self.executor is None and self.workers > 0:
+                executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('forkserver'))
+                wait([executor.submit(_ready) for _ in range(self.workers)])
+                self.executor = executor
+
+    # Function to stop the worker processes
+    def shutdown(self):
+        with self.executor_lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+    # Function to run a hashing call in the pool, raises HashingPoolSaturated instead of queueing without bound
+    def _run(self, func, *args):
+        if self.workers <= 0:  # No workers configured, hash on the calling thread.
+            return func(*args)
+        if not self.slots.acquire(blocking=False):
+            raise HashingPoolSaturated()
+        try:
+            self.start()
+            return self.executor.submit(func, *args).result()
+        finally:
+            self.slots.release()
+
+    # Function to hash a password with the configured cost
+    def hash_password(self, password):
+        return self._run(_hash_password, password, self.rounds)
+
+    # Function to check a password against a stored hash
+    def check_password(self, pw_hash, password):
+        return self._run(_check_password, pw_hash, password)
+
+    # Function to check if a stored hash was created with a different cost than the configured one
+    def needs_rehash(self, pw_hash):
+        return hash_rounds(pw_hash) != self.rounds
@@ -0,0 +1,59 @@
+# Content-addressed store for uploaded cover images: files are named after the SHA-256 of their content
+import hashlib, os, re, tempfile
+
+CHUNK_SIZE = 64 * 1024 # Bytes read from the upload at a time
+CONTENT_ADDRESSED = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{64}(_thumb)?\.[a-z]+$') # Relative paths of files named after their hash
+
+
+# Function to stream an upload to disk under its content hash, returns (relative path, True if the file is new)
+# Files go in a sub-folder named after the first two hash characters, so no folder gets too large.
+def store_image(file_storage, folder, extension):
+    os.makedirs(folder, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            for chunk in iter(lambda: file_storage.stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                temp_file.write(chunk)
+        name = digest.hexdigest()
+        relative_path = '%s/%s.%s' % (name[:2], name, extension)
+        path = os.path.join(folder, relative_path)
+        if os.path.exists(path):  # Same content was uploaded before, keep the existing file.
+            os.remove(temp_path)
+            return relative_path, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+        return relative_path, True
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+# Function to get the relative path of the thumbnail for a stored image
+def thumbnail_path(relative_path):
+    return relative_path.rsplit('.', 1)[0] + '_thumb.jpg'
+
+
+# Function to create a JPEG thumbnail that fits in size, returns its relative path or None if it can't be made
+def make_thumbnail(folder, relative_path, size, quality=80):
+    thumb = thumbnail_path(relative_path)
+    if os.path.exists(os.path.join(folder, thumb)):  # Thumbnails are made once per image.
+        return thumb
+    try:
+        from PIL import Image  # Pillow is only needed to generate thumbnails, so it is imported on the first upload.
+    except ImportError:
+        return None
+    try:
+        with Image.open(os.path.join(folder, relative_path)) as image:
+            image.thumbnail(size)
+            image.convert('RGB').save(os.path.join(folder, thumb), 'JPEG', quality=quality, optimize=True)
+    except (OSError, ValueError):  # Not an image Pillow can read.
+        return None
+    return thumb
+
+
+# Function to check if a relative path names a content-addressed file, whose content never changes
+def is_content_addressed(relative_path):
+    return bool(CONTENT_ADDRESSED.match(relative_path))
@@ -0,0 +1,161 @@
+# Per-request metrics for the Prometheus /metrics endpoint: latency, status counts, in-flight requests and database time
+import logging, threading, time
+from collections import defaultdict
+from flask import g, has_app_context, request
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) # Seconds
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100) # Queries issued by one request
+
+slow_query_log = logging.getLogger('lms.slow_queries')
+
+
+# Cumulative histogram with fixed buckets, as Prometheus expects
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    # Function to record one observed value
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+# Function to format Prometheus labels, escaping the characters the text format reserves
+def format_labels(labels):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                    for name, value in labels)
+
+
+# Collects request and database metrics for a Flask app, safe to share between request threads
+class RequestMetrics:
+    def __init__(self, slow_query_seconds=None):
+        self.slow_query_seconds = slow_query_seconds # Queries slower than this are logged with their plan, None disables the log
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = defaultdict(int) # (route, method, status) -> count
+        self.latency = {} # (route, method) -> Histogram of request seconds
+        self.db_queries = {} # (route, method) -> Histogram of queries per request
+        self.db_time = {} # (route, method) -> Histogram of database seconds per request
+        self.slow_queries = 0
+
+    # Function to hook the metrics into the app's request cycle
+    def init_app(self, app):
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.teardown_request(self.end_request)
+
+    # Function to count the queries an engine runs and their time against the current request
+    def watch_engine(self, engine):
+        event.listen(engine, 'before_cursor_execute', self.before_query)
+        event.listen(engine, 'after_cursor_execute', self.after_query)
+        event.listen(engine, 'handle_error', self.failed_query)
+
+    # Function run before each request to start its timer and counters
+    def start_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_db_time = 0.0
+        with self.lock:
+            self.in_flight += 1
+
+    # Function run after each request to record its latency, status and database use
+    def finish_request(self, response):
+        if 'metrics_start' not in g:  # A before_request hook answered before ours ran.
+            return response
+        elapsed = time.perf_counter() - g.metrics_start
+        route = request.url_rule.rule if request.url_rule else 'unmatched'  # Unmatched paths share one label so 404 scans can't add series.
+        key = (route, request.method)
+        with self.lock:
+            self.requests[(route, request.method, response.status_code)] += 1
+            self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(elapsed)
+            self.db_queries.setdefault(key, Histogram(QUERY_COUNT_BUCKETS)).observe(g.metrics_queries)
+            self.db_time.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(g.metrics_db_time)
+        # Let the browser's network panel show where the time of a request went.
+        response.headers['Server-Timing'] = 'app;dur=%.1f, db;dur=%.1f;desc="%d queries"' % (
+            elapsed * 1000, g.metrics_db_time * 1000, g.metrics_queries)
+        return response
+
+    # Function run when a request ends, even after an error, to update the in-flight count
+    def end_request(self, exc):
+        if g.pop('metrics_start', None) is not None:
+            with self.lock:
+                self.in_flight -= 1
+
+    # Function run before each query to note its cursor and start time, queries can nest on one connection
+    def before_query(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append((cursor, time.perf_counter()))
+
+    # Function run after each query to add it to the request's counters and log it if slow
+    def after_query(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['metrics_query_start'].pop()[1]
+        if has_app_context() and 'metrics_queries' in g:  # Queries run outside a request (startup, CLI commands) aren't counted.
+            g.metrics_queries += 1
+            g.metrics_db_time += elapsed
+        if self.slow_query_seconds is not None and elapsed >= self.slow_query_seconds:
+            with self.lock:
+                self.slow_queries += 1
+            slow_query_log.warning('Slow query (%.1f ms): %s\nPlan:\n%s', elapsed * 1000, statement,
+                                   self.explain(conn, statement, parameters, executemany))
+
+    # Function run when a statement fails, after_cursor_execute doesn't fire then, so its start time is dropped here
+    # Errors raised before the statement was sent (no matching cursor on top) leave the outer queries' start times alone.
+    def failed_query(self, context):
+        if context.connection is None or context.execution_context is None:
+            return
+        starts = context.connection.info.get('metrics_query_start')
+        if starts and starts[-1][0] is context.execution_context.cursor:
+            starts.pop()
+
+    # Function to get the query plan of a statement on the connection that ran it
+    def explain(self, conn, statement, parameters, executemany):
+        if executemany:  # Plans are the same for every parameter set, explain the first one.
+            parameters = parameters[0] if parameters else ()
+        prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+        try:
+            cursor = conn.connection.dbapi_connection.cursor()  # A raw cursor, so the plan query isn't timed itself.
+            try:
+                cursor.execute(prefix + statement, parameters)
+                return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+            finally:
+                cursor.close()
+        except Exception as e:  # Some statements (PRAGMA, DDL) can't be explained.
+            return 'unavailable (%s)' % e
+
+    # Function to render every metric in the Prometheus text exposition format
+    def render(self):
+        lines = []
+        with self.lock:
+            lines += ['# HELP lms_http_requests_in_flight Requests currently being handled.',
+                      '# TYPE lms_http_requests_in_flight gauge',
+                      'lms_http_requests_in_flight %d' % self.in_flight]
+            lines += ['# HELP lms_http_requests_total Requests handled by route, method and status.',
+                      '# TYPE lms_http_requests_total counter']
+            for (route, method, status), count in sorted(self.requests.items()):
+                lines.append('lms_http_requests_total{%s} %d' % (format_labels((('route', route), ('method', method), ('status', status))), count))
+            self.render_histograms(lines, 'lms_http_request_duration_seconds', 'Request latency in seconds.', self.latency)
+            self.render_histograms(lines, 'lms_db_queries_per_request', 'Database queries issued per request.', self.db_queries)
+            self.render_histograms(lines, 'lms_db_duration_seconds', 'Database time per request in seconds.', self.db_time)
+            lines += ['# HELP lms_db_slow_queries_total Queries slower than the slow query threshold.',
+                      '# TYPE lms_db_slow_queries_total counter',
+                      'lms_db_slow_queries_total %d' % self.slow_queries]
+        return '\n'.join(lines) + '\n'
+
+    # Function to append the lines of a set of histograms labelled by route and method
+    def render_histograms(self, lines, name, help_text, histograms):
+        lines += ['# HELP %s %s' % (name, help_text), '# TYPE %s histogram' % name]
+        for (route, method), histogram in sorted(histograms.items()):
+            labels = (('route', route), ('method', method))
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append('%s_bucket{%s} %d' % (name, format_labels(labels + (('le', bound),)), count))
+            lines.append('%s_bucket{%s} %d' % (name, format_labels(labels + (('le', '+Inf'),)), histogram.count))
+            lines.append('%s_sum{%s} %.6f' % (name, format_labels(labels), histogram.sum))
+            lines.append('%s_count{%s} %d' % (name, format_labels(labels), histogram.count))
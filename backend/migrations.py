@@ -0,0 +1,262 @@
+# Versioned schema migrations, applied in order and recorded in the schema_version table
+# Each migration gets an open connection inside a transaction and must only build on the migrations before it.
+import sqlalchemy as sa
+from datetime import datetime
+from circulation import recompute as recompute_circulation, recount_overdue
+
+MIGRATIONS = [] # Registered migrations as (version, description, function), kept sorted by version
+
+
+# Decorator to register a migration function under a version number
+def migration(version, description):
+    def register(f):
+        MIGRATIONS.append((version, description, f))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return f
+    return register
+
+
+# Function to read the schema version of a database, 0 for a database that was never migrated
+def current_version(conn):
+    if not sa.inspect(conn).has_table('schema_version'):
+        return 0
+    return conn.execute(sa.text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+
+# Function to apply every pending migration up to target (all of them by default), returns the applied versions
+def upgrade(engine, target=None):
+    applied = []
+    with engine.begin() as conn:
+        conn.execute(sa.text(
+            "CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL PRIMARY KEY, description VARCHAR(200) NOT NULL)"
+        ))
+        version = current_version(conn)
+    for number, description, f in MIGRATIONS:
+        if number <= version or (target is not None and number > target):
+            continue
+        with engine.begin() as conn:  # Each migration commits on its own so a failure keeps the earlier ones.
+            f(conn)
+            conn.execute(
+                sa.text("INSERT INTO schema_version (version, description) VALUES (:version, :description)"),
+                {'version': number, 'description': description}
+            )
+        applied.append(number)
+    return applied
+
+
+@migration(1, 'Create users, books and loans tables')
+def create_tables(conn):
+    # Tables as they were first created by db.create_all(), existing databases already have them.
+    metadata = sa.MetaData()
+    sa.Table(
+        'users', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('username', sa.String(50), nullable=False),
+        sa.Column('email', sa.String(100), nullable=False),
+        sa.Column('password', sa.String(100), nullable=False),
+        sa.Column('city', sa.String(50), nullable=False),
+        sa.Column('age', sa.Integer, nullable=False),
+        sa.Column('account', sa.String(10), nullable=False),
+    )
+    sa.Table(
+        'books', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('name', sa.String(50), nullable=False),
+        sa.Column('author', sa.String(50), nullable=False),
+        sa.Column('year_published', sa.Integer, nullable=False),
+        sa.Column('description', sa.String(500)),
+        sa.Column('image', sa.String(255)),
+        sa.Column('loan_type', sa.Integer, nullable=False),
+        sa.Column('status', sa.String(20), nullable=False),
+        sa.Column('copyStatus', sa.String(20), nullable=False),
+    )
+    sa.Table(
+        'loans', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('user_id', sa.Integer, sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('book_id', sa.Integer, sa.ForeignKey('books.id'), nullable=False),
+        sa.Column('loan_date', sa.DateTime, nullable=False),
+        sa.Column('return_date', sa.DateTime, nullable=True),
+    )
+    metadata.create_all(conn, checkfirst=True)
+
+
+@migration(2, 'Create the books_fts full-text search index')
+def create_search_index(conn):
+    if conn.dialect.name != 'sqlite':  # FTS5 is specific to SQLite.
+        return
+    conn.execute(sa.text("CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(name, author, description)"))
+    conn.execute(sa.text("DELETE FROM books_fts"))
+    conn.execute(sa.text(
+        "INSERT INTO books_fts (rowid, name, author, description) "
+        "SELECT id, name, author, COALESCE(description, '') FROM books"
+    ))
+
+
+@migration(3, 'Add indexes for login, loan and overdue lookups')
+def add_lookup_indexes(conn):
+    # A unique index can't be built over duplicate emails, report them instead of failing halfway.
+    duplicates = conn.execute(sa.text(
+        "SELECT email FROM users GROUP BY email HAVING COUNT(*) > 1"
+    )).scalars().all()
+    if duplicates:
+        raise RuntimeError('Cannot add unique index on users.email, duplicate emails: %s' % ', '.join(duplicates))
+    conn.execute(sa.text("CREATE UNIQUE INDEX IF NOT EXISTS ix_users_email ON users (email)"))
+    conn.execute(sa.text("CREATE INDEX IF NOT EXISTS ix_books_author ON books (author)"))
+    conn.execute(sa.text("CREATE INDEX IF NOT EXISTS ix_loans_user_id_book_id ON loans (user_id, book_id)"))
+    conn.execute(sa.text("CREATE INDEX IF NOT EXISTS ix_loans_book_id ON loans (book_id)"))
+    conn.execute(sa.text("CREATE INDEX IF NOT EXISTS ix_loans_return_date ON loans (return_date)"))
+
+
+@migration(4, 'Replace books status/copyStatus with copy counts')
+def add_copy_counts(conn):
+    # Every book used to have an original and one copy, so existing books get two copies.
+    conn.execute(sa.text("ALTER TABLE books ADD COLUMN total_copies INTEGER NOT NULL DEFAULT 2"))
+    conn.execute(sa.text("ALTER TABLE books ADD COLUMN available_copies INTEGER NOT NULL DEFAULT 2"))
+    conn.execute(sa.text(
+        "UPDATE books SET available_copies = "
+        "(CASE WHEN status = 'available' THEN 1 ELSE 0 END) + (CASE WHEN \"copyStatus\" = 'available' THEN 1 ELSE 0 END)"
+    ))
+    conn.execute(sa.text("ALTER TABLE books DROP COLUMN status"))
+    conn.execute(sa.text("ALTER TABLE books DROP COLUMN \"copyStatus\""))
+
+
+@migration(5, 'Add books.thumbnail for cover thumbnails')
+def add_thumbnail(conn):
+    conn.execute(sa.text("ALTER TABLE books ADD COLUMN thumbnail VARCHAR(255)"))
+
+
+@migration(6, 'Add the loan_history table for returned loans')
+def add_loan_history(conn):
+    metadata = sa.MetaData()
+    sa.Table(
+        'loan_history', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('loan_id', sa.Integer, nullable=False),
+        sa.Column('user_id', sa.Integer, nullable=False),
+        sa.Column('book_id', sa.Integer, nullable=False),
+        sa.Column('loan_date', sa.DateTime, nullable=False),
+        sa.Column('due_date', sa.DateTime, nullable=True),
+        sa.Column('returned_at', sa.DateTime, nullable=False),
+        sa.Index('ix_loan_history_returned_at', 'returned_at'),
+        sa.Index('ix_loan_history_user_id_returned_at', 'user_id', 'returned_at'),
+    )
+    metadata.create_all(conn, checkfirst=True)
+
+
+@migration(7, 'Add the circulation_stats counters for /admin/stats')
+def add_circulation_stats(conn):
+    metadata = sa.MetaData()
+    sa.Table(
+        'circulation_stats', metadata,
+        sa.Column('scope', sa.String(10), primary_key=True),
+        sa.Column('subject', sa.String(100), primary_key=True),
+        sa.Column('books', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('copies', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('loans', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('active_loans', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('returns', sa.Integer, nullable=False, server_default='0'),
+        sa.Index('ix_circulation_stats_scope_loans', 'scope', 'loans'),
+    )
+    metadata.create_all(conn, checkfirst=True)
+    recompute_circulation(conn)  # Start the counters from the existing books and loans.
+
+
+@migration(8, 'Add the reminders outbox for overdue loans')
+def add_reminders(conn):
+    metadata = sa.MetaData()
+    sa.Table(
+        'reminders', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('loan_id', sa.Integer, nullable=False),
+        sa.Column('user_id', sa.Integer, nullable=False),
+        sa.Column('book_id', sa.Integer, nullable=False),
+        sa.Column('due_date', sa.DateTime, nullable=False),
+        sa.Column('created_at', sa.DateTime, nullable=False),
+        sa.Column('sent_at', sa.DateTime, nullable=True),
+        sa.Index('ux_reminders_loan_id_due_date', 'loan_id', 'due_date', unique=True),
+        sa.Index('ix_reminders_due_date', 'due_date'),
+        sa.Index('ix_reminders_sent_at', 'sent_at'),
+    )
+    metadata.create_all(conn, checkfirst=True)
+
+
+@migration(9, 'Add indexes for the filtered /customers directory')
+def add_customer_indexes(conn):
+    # City and account filters are read in ID order for the cursor, so the ID is part of their indexes.
+    conn.execute(sa.text("CREATE INDEX IF NOT EXISTS ix_users_city_id ON users (city, id)"))
+    conn.execute(sa.text("CREATE INDEX IF NOT EXISTS ix_users_account_id ON users (account, id)"))
+    conn.execute(sa.text("CREATE INDEX IF NOT EXISTS ix_users_age ON users (age)"))
+    conn.execute(sa.text("CREATE INDEX IF NOT EXISTS ix_users_username ON users (username)"))
+
+
+@migration(10, 'Add catalog_versions shared by every server process')
+def add_catalog_versions(conn):
+    # 'books' changes with any change to books or copies, 'titles' only when titles or authors change.
+    metadata = sa.MetaData()
+    catalog_versions = sa.Table(
+        'catalog_versions', metadata,
+        sa.Column('name', sa.String(20), primary_key=True),
+        sa.Column('version', sa.Integer, nullable=False, server_default='0'),
+    )
+    metadata.create_all(conn, checkfirst=True)
+    existing = set(conn.execute(sa.select(catalog_versions.c.name)).scalars())
+    rows = [{'name': name, 'version': 0} for name in ('books', 'titles') if name not in existing]
+    if rows:
+        conn.execute(catalog_versions.insert(), rows)
+
+
+@migration(11, 'Add the circulation_overdue counter for /admin/stats')
+def add_circulation_overdue(conn):
+    metadata = sa.MetaData()
+    sa.Table(
+        'circulation_overdue', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('loans', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('counted_through', sa.DateTime, nullable=False),
+    )
+    metadata.create_all(conn, checkfirst=True)
+    recount_overdue(conn, datetime.utcnow())  # Start the counter from the existing loans.
+
+
+@migration(12, 'Store user accounts in lower case')
+def lower_user_accounts(conn):
+    # Roles were always compared in lower case, now the /customers account filter can compare the stored value directly.
+    conn.execute(sa.text("UPDATE users SET account = LOWER(account) WHERE account <> LOWER(account)"))
+
+
+@migration(13, 'Stop SQLite from reusing the IDs of returned loans')
+def add_loans_autoincrement(conn):
+    # Without AUTOINCREMENT SQLite gives a new loan MAX(id) + 1, the ID of the newest loan once it was returned, so
+    # loan_history and reminders rows could point at two loans. PostgreSQL sequences never hand out an ID twice.
+    if conn.dialect.name != 'sqlite':
+        return
+    metadata = sa.MetaData()
+    sa.Table(
+        'loans_new', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('user_id', sa.Integer, sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('book_id', sa.Integer, sa.ForeignKey('books.id'), nullable=False),
+        sa.Column('loan_date', sa.DateTime, nullable=False),
+        sa.Column('return_date', sa.DateTime, nullable=True),
+        sqlite_autoincrement=True,
+    )
+    sa.Table('users', metadata, sa.Column('id', sa.Integer, primary_key=True))
+    sa.Table('books', metadata, sa.Column('id', sa.Integer, primary_key=True))
+    metadata.tables['loans_new'].create(conn)
+    conn.execute(sa.text(
+        "INSERT INTO loans_new (id, user_id, book_id, loan_date, return_date) "
+        "SELECT id, user_id, book_id, loan_date, return_date FROM loans"
+    ))
+    conn.execute(sa.text("DROP TABLE loans"))
+    conn.execute(sa.text("ALTER TABLE loans_new RENAME TO loans"))
+    conn.execute(sa.text("CREATE INDEX ix_loans_user_id_book_id ON loans (user_id, book_id)"))
+    conn.execute(sa.text("CREATE INDEX ix_loans_book_id ON loans (book_id)"))
+    conn.execute(sa.text("CREATE INDEX ix_loans_return_date ON loans (return_date)"))
+    # Continue after every ID already handed out, including loans that were returned or deleted since.
+    last_id = conn.execute(sa.text(
+        "SELECT MAX(id) FROM (SELECT MAX(id) AS id FROM loans UNION ALL SELECT MAX(loan_id) FROM loan_history "
+        "UNION ALL SELECT MAX(loan_id) FROM reminders)"
+    )).scalar() or 0
+    conn.execute(sa.text("DELETE FROM sqlite_sequence WHERE name = 'loans'"))
+    conn.execute(sa.text("INSERT INTO sqlite_sequence (name, seq) VALUES ('loans', :seq)"), {'seq': last_id})
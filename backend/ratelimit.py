@@ -0,0 +1,100 @@
+# Token buckets for rate limiting requests, kept in process memory or in Redis when several workers must share them
+# A bucket holds up to `requests` tokens and refills at requests/period tokens per second, each request takes one token,
+# so a client can send a burst of `requests` at once and then `requests` per `period` seconds on average.
+import logging, threading, time
+
+SHARDS = 16 # Independent dicts and locks the in-memory buckets are spread over, so request threads rarely wait on each other
+SWEEP_INTERVAL = 60 # Seconds between two sweeps of a shard for idle buckets
+
+ratelimit_log = logging.getLogger('lms.ratelimit')
+
+# Lua script taking a token from a bucket stored in a Redis hash, atomic across workers. Uses the Redis clock, so the
+# workers' clocks don't have to agree. Returns the seconds to wait as a string (Lua numbers are truncated to integers).
+REDIS_TAKE_SCRIPT = '''
+local capacity, period = tonumber(ARGV[1]), tonumber(ARGV[2])
+local rate = capacity / period
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = capacity
+if state[1] then
+    tokens = math.min(capacity, tonumber(state[1]) + math.max(0, now - tonumber(state[2])) * rate)
+end
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+return tostring(retry_after)
+'''
+
+
+# Buckets in process memory, safe to share between request threads. Each worker process has its own.
+# A bucket is dropped once it would be full again, as a missing bucket is the same as a full one.
+class MemoryBuckets:
+    def __init__(self, shards=SHARDS, sweep_interval=SWEEP_INTERVAL):
+        self.shards = [{} for _ in range(shards)] # Key -> (tokens, updated, full_at) in time.monotonic() seconds
+        self.locks = [threading.Lock() for _ in range(shards)]
+        self.next_sweep = [0.0] * shards
+        self.sweep_interval = sweep_interval
+
+    # Function to take a token from a key's bucket, returns 0 if the request may go ahead or the seconds until it may
+    def take(self, key, requests, period, now=None):
+        now = time.monotonic() if now is None else now
+        shard = hash(key) % len(self.shards)
+        buckets, rate = self.shards[shard], requests / period
+        with self.locks[shard]:
+            if now >= self.next_sweep[shard]:
+                self.sweep(buckets, now)
+                self.next_sweep[shard] = now + self.sweep_interval
+            bucket = buckets.get(key)
+            tokens = requests if bucket is None else min(requests, bucket[0] + (now - bucket[1]) * rate)
+            if tokens < 1:
+                return (1 - tokens) / rate  # Denied requests take nothing, the bucket keeps refilling from where it was.
+            tokens -= 1
+            buckets[key] = (tokens, now, now + (requests - tokens) / rate)
+        return 0
+
+    # Function to drop the buckets of a shard that are full again, runs under the shard's lock
+    def sweep(self, buckets, now):
+        idle = [key for key, bucket in buckets.items() if bucket[2] <= now]
+        for key in idle:
+            del buckets[key]
+
+    # Function to get the number of buckets held
+    def __len__(self):
+        return sum(len(buckets) for buckets in self.shards)
+
+
+# Buckets in Redis, shared by every worker and server using the same Redis. Idle buckets expire on their own.
+# If Redis can't be reached requests are let through, so a Redis outage doesn't take the app down with it.
+class RedisBuckets:
+    def __init__(self, client, prefix='lms:ratelimit:'):
+        import redis # Only needed for this store
+        self.errors = redis.RedisError
+        self.script = client.register_script(REDIS_TAKE_SCRIPT)
+        self.prefix = prefix
+
+    # Function to take a token from a key's bucket, returns 0 if the request may go ahead or the seconds until it may
+    def take(self, key, requests, period):
+        try:
+            return float(self.script(keys=[self.prefix + key], args=[requests, period]))
+        except self.errors:
+            ratelimit_log.warning('Rate limit store unavailable, letting the request through', exc_info=True)
+            return 0
+
+
+# Function to create the bucket store for a RATE_LIMIT_STORAGE_URL, process memory when it is empty or memory://
+def create_store(url=None):
+    if not url or url.startswith('memory://'):
+        return MemoryBuckets()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RATE_LIMIT_STORAGE_URL %s needs the redis package (pip install redis)' % url.split('://')[0])
+        return RedisBuckets(redis.Redis.from_url(url))
+    raise ValueError('Unsupported RATE_LIMIT_STORAGE_URL: %s' % url)
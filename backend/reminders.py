@@ -0,0 +1,116 @@
+# Overdue sweep: finds loans past their return date in chunks and writes one reminder per loan to the reminders outbox table
+# Nothing here sends mail, whatever delivers reminders reads the rows where sent_at is NULL and sets it once they are sent.
+# Each chunk is read through the return_date index and written in its own short transaction, so checkouts are never stalled,
+# and the sweep carries on from the newest reminder, so running it again (or after a crash) doesn't start over.
+import logging, threading, time
+from datetime import datetime
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+import circulation
+
+SWEEP_BATCH_SIZE = 1000 # Overdue loans read and reminded per transaction
+
+sweep_log = logging.getLogger('lms.overdue_sweep')
+
+loans = sa.table('loans', sa.column('id'), sa.column('user_id'), sa.column('book_id'), sa.column('return_date', sa.DateTime))
+reminders = sa.table('reminders', sa.column('loan_id'), sa.column('user_id'), sa.column('book_id'),
+                     sa.column('due_date', sa.DateTime), sa.column('created_at', sa.DateTime))
+
+
+# Function to get the due date and loan ID of the newest reminder, the point the last sweep got to
+def checkpoint(conn):
+    return conn.execute(
+        sa.select(reminders.c.due_date, reminders.c.loan_id)
+        .order_by(reminders.c.due_date.desc(), reminders.c.loan_id.desc()).limit(1)
+    ).first()
+
+
+# Function to write reminders for a chunk of overdue loans, loans already reminded for the same due date are skipped
+# Returns the number of reminders written.
+def write_reminders(conn, rows, now):
+    existing = set(conn.execute(
+        sa.select(reminders.c.loan_id, reminders.c.due_date).where(reminders.c.loan_id.in_([row.id for row in rows]))
+    ).tuples())
+    new = [{'loan_id': row.id, 'user_id': row.user_id, 'book_id': row.book_id, 'due_date': row.return_date, 'created_at': now}
+           for row in rows if (row.id, row.return_date) not in existing]
+    if not new:
+        return 0
+    dialect = conn.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        # A sweep running at the same time in another process may have written some of them since, the unique index keeps one.
+        statement = (sqlite.insert if dialect == 'sqlite' else postgresql.insert)(reminders)
+        conn.execute(statement.on_conflict_do_nothing(index_elements=['loan_id', 'due_date']), new)
+    else:
+        conn.execute(sa.insert(reminders), new)
+    return len(new)
+
+
+# Function to sweep the loans overdue at now, one chunk per transaction, returns the number of loans scanned and reminders written
+# pause is a number of seconds to sleep between chunks, to leave the database to live traffic during large sweeps.
+# full rescans every overdue loan instead of carrying on from the newest reminder, for loans imported with past due dates.
+def sweep(engine, now, batch_size=SWEEP_BATCH_SIZE, pause=0, full=False):
+    started = time.perf_counter()
+    scanned = written = 0
+    last = None
+    if not full:
+        with engine.connect() as conn:
+            last = checkpoint(conn)
+    while True:
+        with engine.begin() as conn:
+            query = sa.select(loans.c.id, loans.c.user_id, loans.c.book_id, loans.c.return_date).where(loans.c.return_date < now)
+            if last is not None:
+                due_date, loan_id = last
+                query = query.where(sa.or_(
+                    loans.c.return_date > due_date,
+                    sa.and_(loans.c.return_date == due_date, loans.c.id > loan_id)
+                ))
+            rows = conn.execute(query.order_by(loans.c.return_date, loans.c.id).limit(batch_size)).all()
+            if rows:
+                written += write_reminders(conn, rows, now)
+        scanned += len(rows)
+        if len(rows) < batch_size:
+            break
+        last = (rows[-1].return_date, rows[-1].id)
+        if pause:
+            time.sleep(pause)
+    with engine.begin() as conn:
+        circulation.advance_overdue(conn, now)  # Count the loans that fell due since the last sweep in the /admin/stats counter.
+    sweep_log.info('Swept %d overdue loans, wrote %d reminders in %.2fs', scanned, written, time.perf_counter() - started)
+    return {'scanned': scanned, 'reminders': written}
+
+
+# Background thread running the sweep every interval seconds, for deployments without cron
+class OverdueSweeper:
+    def __init__(self, interval, batch_size=SWEEP_BATCH_SIZE, pause=0):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.stopped = threading.Event()
+        self.thread = None
+
+    # Function to start sweeping in a daemon thread, does nothing when no interval is configured or it already runs
+    def start(self, engine):
+        if not self.interval or self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, args=(engine,), name='overdue-sweeper', daemon=True)
+        self.thread.start()
+
+    # Function to stop the thread after the chunk it is working on
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    # Function to forget the parent's thread in a forked child, threads don't survive a fork
+    def after_fork(self):
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def run(self, engine):
+        while not self.stopped.wait(self.interval):
+            try:
+                sweep(engine, datetime.utcnow(), self.batch_size, self.pause)
+            except Exception:
+                sweep_log.exception('Overdue sweep failed, retrying in %ss', self.interval)
@@ -0,0 +1,73 @@
+# Shared serialization layer: response fields are mapped to SQL column expressions, so list endpoints only select
+# and encode the fields a client asks for with ?fields=, and rows go straight from SQL tuples to JSON.
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson # Optional, much faster than the json module for large list responses
+except ImportError:
+    orjson = None
+
+
+# Function to format a datetime the way the API returns dates, like 2024-05-01 13:45:00
+def format_datetime(value):
+    return value.isoformat(' ', 'seconds') if value is not None else None
+
+
+# A response field: its name, the SQL expression it is read from, and an optional conversion of the database value
+class Field:
+    __slots__ = ('name', 'column', 'convert')
+
+    def __init__(self, name, column, convert=None):
+        self.name = name
+        self.column = column
+        self.convert = convert
+
+
+# Set of fields a resource can be returned with, all of them unless the client picks some
+class Serializer:
+    def __init__(self, *fields):
+        self.fields = {field.name: field for field in fields}
+        self.all_fields = tuple(self.fields)
+
+    # Function to parse a comma-separated ?fields= value, returns every field when it is empty
+    def parse_fields(self, value):
+        if not value:
+            return self.all_fields
+        names = tuple(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))  # Drop duplicates, keep order.
+        unknown = [name for name in names if name not in self.fields]
+        if unknown or not names:
+            raise ValueError('Unknown fields: %s. Available fields: %s.' % (', '.join(unknown) or value, ', '.join(self.all_fields)))
+        return names
+
+    # Function to get the labelled column expressions to select for the fields, in the same order
+    def columns(self, fields):
+        return [self.fields[name].column.label(name) for name in fields]
+
+    # Function to turn a row selected with columns(fields) into a dict, extra columns selected after them are ignored
+    def row_to_dict(self, row, fields):
+        data = {}
+        for name, value in zip(fields, row):
+            convert = self.fields[name].convert
+            data[name] = convert(value) if convert is not None else value
+        return data
+
+
+# JSON provider that encodes with orjson when it is installed, falling back to Flask's encoder for other types
+class FastJSONProvider(DefaultJSONProvider):
+    sort_keys = False # Keep fields in the order they were selected
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode()
+
+    # Function to encode to UTF-8 bytes, which is what responses and the cache store
+    def dumps_bytes(self, obj):
+        if orjson is None:
+            return super().dumps(obj).encode()
+        # Dates go through Flask's default so they keep the same format as before.
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj) + b'\n', mimetype=self.mimetype)
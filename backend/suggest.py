@@ -0,0 +1,101 @@
+# In-memory prefix index behind /books/suggest, over the normalized titles and authors of the catalog
+# Every distinct title and author is one string in a sorted list, so the suggestions for a prefix are a binary search
+# and a short scan away, without searching the books table on each keystroke.
+# Entries are packed as "<normalized>\0<kind>\0<label>" with the book counts in a parallel array, one object per entry.
+import bisect, threading, unicodedata
+from array import array
+
+KINDS = {'t': 'title', 'a': 'author'} # Entry kind letter of each kind of suggestion
+
+
+# Function to normalize text for matching: accents removed, case folded and whitespace collapsed
+def normalize(text):
+    if not text.isascii():
+        text = ''.join(ch for ch in unicodedata.normalize('NFKD', text) if not unicodedata.combining(ch))
+    return ' '.join(text.replace('\0', '').casefold().split())
+
+
+# Function to get the start of the entry of a title or author, the kind comes after a NUL so "dune" sorts before "dune messiah"
+def entry_head(text, kind):
+    return normalize(text) + '\0' + kind + '\0'
+
+
+# Sorted prefix index of titles and authors with the number of books having each, safe to share between request threads
+class SuggestIndex:
+    def __init__(self):
+        self.entries = [] # Sorted entries
+        self.counts = array('I') # Number of books with the title or author of the entry at the same position
+        self.built = False
+        self.lock = threading.Lock()
+
+    # Function to replace the index with the titles and authors of (name, author) rows
+    def build(self, books):
+        found = {} # Entry head to [label as first written, count]
+        for name, author in books:
+            for text, kind in ((name, 't'), (author, 'a')):
+                head = entry_head(text, kind)
+                item = found.get(head)
+                if item is None:
+                    found[head] = [text, 1]
+                else:
+                    item[1] += 1
+        heads = sorted(found)
+        entries = [head + found[head][0] for head in heads]
+        counts = array('I', (found[head][1] for head in heads))
+        with self.lock:
+            self.entries, self.counts, self.built = entries, counts, True
+
+    # Function to find the position of a title or author, returns (position, True) if it is in the index,
+    # or the position it would be inserted at and False
+    def find(self, head):
+        i = bisect.bisect_left(self.entries, head)
+        return i, i < len(self.entries) and self.entries[i].startswith(head)
+
+    # Function to count a new book's title and author, an index that isn't built yet will read it when it is
+    # A new title or author is inserted into the sorted list, which moves every entry after it (O(n) per change).
+    def add(self, name, author):
+        with self.lock:
+            if not self.built:
+                return
+            for text, kind in ((name, 't'), (author, 'a')):
+                head = entry_head(text, kind)
+                i, present = self.find(head)
+                if present:
+                    self.counts[i] += 1
+                else:
+                    self.entries.insert(i, head + text)
+                    self.counts.insert(i, 1)
+
+    # Function to uncount a deleted book's title and author, dropping them once no book has them
+    def remove(self, name, author):
+        with self.lock:
+            if not self.built:
+                return
+            for text, kind in ((name, 't'), (author, 'a')):
+                i, present = self.find(entry_head(text, kind))
+                if not present:
+                    continue
+                if self.counts[i] > 1:
+                    self.counts[i] -= 1
+                    continue
+                del self.entries[i]
+                del self.counts[i]
+
+    # Function to get up to limit titles and authors starting with a prefix, in alphabetical order
+    def suggest(self, prefix, limit):
+        prefix = normalize(prefix)
+        suggestions = []
+        if not prefix:
+            return suggestions
+        with self.lock:
+            entries = self.entries
+            i = bisect.bisect_left(entries, prefix)
+            while i < len(entries) and len(suggestions) < limit and entries[i].startswith(prefix):
+                _, kind, label = entries[i].split('\0', 2)
+                suggestions.append({'type': KINDS[kind], 'value': label, 'books': self.counts[i]})
+                i += 1
+        return suggestions
+
+    # Function to get the number of titles and authors in the index
+    def __len__(self):
+        return len(self.entries)
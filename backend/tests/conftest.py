@@ -0,0 +1,4 @@
+# Test setup: the app's modules are imported from the backend folder, like `python app.py` runs them
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
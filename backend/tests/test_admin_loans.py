@@ -0,0 +1,67 @@
+# Regression test for /admin/loans reading each page with a fixed number of queries, however many loans it holds
+# Run from the backend folder: python -m pytest tests
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import event
+from app import create_app, db, upgrade_schema, Books, Loans, Users
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'test.db'), 'HASHING_WORKERS': 0,
+                      'BCRYPT_LOG_ROUNDS': 4, 'RATE_LIMIT_ENABLED': False})
+    with app.app_context():
+        upgrade_schema(db.engine)
+        db.session.add(Users(username='admin', email='admin@example.com', city='Haifa', age=30, account='admin',
+                             password=app.extensions['library'].hashing_pool.hash_password('password')))
+        db.session.commit()
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+
+# Function to add loans, each of another user and book so a query per loan would show in the count
+def add_loans(app, count):
+    with app.app_context():
+        start = Loans.query.count()
+        now = datetime.utcnow()
+        for i in range(start, start + count):
+            user = Users(username='user%d' % i, email='user%d@example.com' % i, password='-', city='City %d' % i, age=20, account='user')
+            book = Books(name='Book %d' % i, author='Author %d' % i, year_published=2000, description='', loan_type=1)
+            db.session.add_all([user, book])
+            db.session.flush()
+            # Every other loan is late, so the lateness check is exercised as well.
+            db.session.add(Loans(user_id=user.id, book_id=book.id, loan_date=now, return_date=now + timedelta(days=1 if i % 2 else -1)))
+        db.session.commit()
+
+
+# Function to request a page of /admin/loans, returns the response and the number of SQL statements it ran
+def count_queries(app, client, headers):
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        response = client.get('/admin/loans', headers=headers)
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    return response, len(statements)
+
+
+def test_admin_loans_query_count_does_not_grow_with_loans(app):
+    client = app.test_client()
+    token = client.post('/login', json={'email': 'admin@example.com', 'password': 'password'}).get_json()['access_token']
+    headers = {'Authorization': 'Bearer ' + token}
+
+    add_loans(app, 1)
+    client.get('/admin/loans', headers=headers)  # Warm up the per-process caches, like the admin's role.
+    response, one_loan = count_queries(app, client, headers)
+    assert response.status_code == 200
+    assert len(response.get_json()['loans']) == 1
+
+    add_loans(app, 24)
+    response, many_loans = count_queries(app, client, headers)
+    assert response.status_code == 200
+    assert len(response.get_json()['loans']) == 25
+    assert many_loans == one_loan
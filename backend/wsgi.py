@@ -0,0 +1,16 @@
+# WSGI entry point for production servers: gunicorn -c gunicorn.conf.py wsgi:app (from the backend folder)
+# With preload_app the master process runs this once, then forks the workers, so each worker starts in milliseconds and
+# shares the imported code, the app and the suggestion index with the master copy-on-write instead of building its own.
+# Database connections and the hashing pool are reset in every worker by app.after_fork.
+import gc
+from app import create_app, db, upgrade_schema, get_suggest_index
+
+app = create_app()
+with app.app_context():
+    upgrade_schema(db.engine)  # Apply pending migrations once, before there are workers to race each other.
+    get_suggest_index()  # Build the suggestion index in the master, the workers share it.
+    db.engine.dispose()  # Close the connections opened above, the workers open their own.
+
+# Move everything loaded so far out of the garbage collector's reach, so collections in the workers
+# don't write to those objects' pages and make the workers copy memory they could have shared.
+gc.freeze()
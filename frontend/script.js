@@ -2,6 +2,7 @@
 const MY_Server = "http://127.0.0.1:8000";
 let currentBookId = null; // Initialize a variable to hold the current book ID, used later in book-related operations
 let booksList = [] // Initialize an empty array to store the list of books fetched from the server
+let nextPageCursor = null // Cursor of the next page of books or loans, null when every page is loaded
 
 // Function to submit the login form
 function submitLoginForm(event) {
@@ -140,7 +141,7 @@ function createBookCard(book, isManagePage, isLoanedBook, userWhoLoaned) {
     // Constructs the inner HTML of the card using template literals and conditional rendering.
     card.innerHTML = `
         <div class="card shadow-sm">
-            <img src="${book.image ? `../backend/${book.image}` : placeholderImage}" alt="${book.name}" class="bd-placeholder-img card-img-top" width="100%" height="300">
+            <img src="${book.thumbnail || book.image ? `${MY_Server}/${book.thumbnail || book.image}` : placeholderImage}" alt="${book.name}" class="bd-placeholder-img card-img-top" width="100%" height="300" loading="lazy">
             <div class="card-body">
                 <h4 class="card-title">${book.name}</h4>
                 <h6>${book.author}</h6>
@@ -356,6 +357,26 @@ function filterBooks(query) {
 
 
 
+// Searches the catalog on the server by name, author and description, and renders the best matches.
+function searchBooks(query) {
+    // An empty search shows the books that are already loaded.
+    if (!query.trim()) {
+        renderBooks(booksList);
+        showLoadMore(nextPageCursor, '');
+        return;
+    }
+    axios.get(`${MY_Server}/books/search`, { params: { q: query }, withCredentials: true })
+        .then(response => {
+            renderBooks(response.data.books);
+            showLoadMore(null, ''); // Search results come in one list, so there is nothing more to load.
+        })
+        .catch(error => {
+            console.error('Error searching books:', error);
+        });
+}
+
+
+
 // This function is used to fetch and display details of a specific book in a modal.
 function viewBookDetails(bookId) {
     const token = localStorage.getItem('access_token'); // Retrieves the JWT token from local storage for authentication.
@@ -398,8 +419,8 @@ function viewBookDetails(bookId) {
                         break;
                 }
                 document.getElementById('loanBookLoanType').textContent = loanDuration;
-                document.getElementById('loanBookStatus').textContent = `Orginal: ${book.status}`;
-                document.getElementById('loanBookcopyStatus').textContent = `Copy: ${book.copyStatus}`;
+                document.getElementById('loanBookStatus').textContent = `Status: ${book.status}`;
+                document.getElementById('loanBookcopyStatus').textContent = `Copies available: ${book.available_copies} of ${book.total_copies}`;
 
                 // Displays the modal with the book details.
                 const loanBookModal = new bootstrap.Modal(document.getElementById('loanBookModal'));
@@ -500,10 +521,11 @@ function fetchUserLoanedBooks() {
 
 
 
-// Function to fetch all loaned books for admins
-function fetchAllLoanedBooks(token) {
+// Function to fetch one page of all loaned books for admins, the first page or the page after the cursor
+function fetchAllLoanedBooks(token, cursor) {
     // Initiates a GET request to the server endpoint that provides information on all books loaned across the system. This endpoint is typically accessible only to administrators.
     axios.get(`${MY_Server}/admin/loans`, {
+        params: cursor ? { cursor: cursor } : {}, // Requests the page after the given cursor, or the first page.
         headers: {
             Authorization: `Bearer ${token}`, // Includes the JWT token in the Authorization header to authenticate the request. This token is passed as a parameter to the function.
         },
@@ -511,13 +533,15 @@ function fetchAllLoanedBooks(token) {
         .then(response => {
             const loanedBooks = response.data.loans; // Extracts the array of loaned books from the response data. Each item in the array contains details about a loaned book.
             // console.log(loanedBooks); 
-            booksList = loanedBooks // Assigns the retrieved array of loaned books to a global variable `booksList` for further use within the application.
-            renderLoanedBooks(loanedBooks); // Calls a function `renderLoanedBooks` with the array of loaned books as an argument, which will display these books on the webpage.
+            booksList = cursor ? booksList.concat(loanedBooks) : loanedBooks // Adds the page of loaned books to the global variable `booksList` for further use within the application.
+            renderLoanedBooks(booksList); // Calls a function `renderLoanedBooks` with the loaned books loaded so far, which will display these books on the webpage.
+            nextPageCursor = response.data.next_cursor;
+            showLoadMore(nextPageCursor, ''); // Offers the next page only when there is one.
         })
         .catch(error => {
             // If the request fails (e.g., due to a network error or if the server responds with an error status), this block of code will execute.
-            console.error('Error fetching all loaned books:', error.response.data); // Logs a detailed error message to the console, including information provided by the server's response.
-
+            console.error('Error fetching all loaned books:', error.response && error.response.data); // Logs a detailed error message to the console, including information provided by the server's response.
+            showLoadMore(cursor, pageErrorMessage(error, 'loaned books')); // Tells the admin, and lets them retry the same page.
         });
 
 }
@@ -620,6 +644,51 @@ function applyBookFilter(filterValue) {
 }
 
 
+// Fetches one page of books, the first page or the page after the cursor. Further pages load from the "Load more" button.
+function fetchBooksPage(cursor) {
+    const params = cursor ? { cursor: cursor } : {};
+    axios.get(`${MY_Server}/books`, { params: params, withCredentials: true })
+        .then(response => {
+            if (response.data && response.data.books) {
+                // Append the page to the global booksList and render books.
+                booksList = cursor ? booksList.concat(response.data.books) : response.data.books;
+                renderBooks(booksList);
+                nextPageCursor = response.data.next_cursor;
+                showLoadMore(nextPageCursor, ''); // Offer the next page only when there is one.
+            } else {
+                console.error('Invalid or missing data in server response:', response.data);
+            }
+        })
+        .catch(error => {
+            console.error('Error fetching books:', error);
+            showLoadMore(cursor, pageErrorMessage(error, 'books')); // Tell the user, and let them retry the same page.
+        });
+}
+
+
+// Shows the "Load more" button when there is a next page, and the error of the last page request if it failed.
+function showLoadMore(cursor, error) {
+    const button = document.getElementById('loadMoreBooksButton');
+    const message = document.getElementById('loadMoreBooksError');
+    if (button) {
+        button.classList.toggle('d-none', !cursor && !error);
+    }
+    if (message) {
+        message.textContent = error;
+    }
+}
+
+
+// Builds the message shown when a page of books or loans fails to load.
+function pageErrorMessage(error, what) {
+    if (error.response && error.response.status === 429) {
+        const wait = error.response.headers['retry-after'];
+        return `Too many requests, please wait ${wait || 'a few'} seconds and try again.`;
+    }
+    return `Could not load more ${what}, please try again.`;
+}
+
+
 // Wait for the DOM to fully load before running the script.
 document.addEventListener('DOMContentLoaded', function () {
     // Retrieve the token from local storage to manage user session.
@@ -647,26 +716,19 @@ document.addEventListener('DOMContentLoaded', function () {
 
         // Exclude the customers page from fetching books.
         if (!window.location.pathname.includes('/customers.html')) {
-            axios.get(`${MY_Server}/books`, { withCredentials: true })
-                .then(response => {
-                    if (response.data && response.data.books) {
-                        // Populate the global booksList and render books.
-                        booksList = response.data.books;
-                        renderBooks(booksList);
-                    } else {
-                        console.error('Invalid or missing data in server response:', response.data);
-                    }
-                })
-                .catch(error => {
-                    console.error('Error fetching books:', error);
-                });
+            fetchBooksPage(null);
         }
 
         // Search functionality: filter displayed books based on the search query.
         document.getElementById('searchInput').addEventListener('input', function () {
             const searchQuery = this.value.toLowerCase();
-            const filteredBooks = filterBooks(searchQuery);
-            renderBooks(filteredBooks);
+            // Catalog pages search on the server, other pages filter what is already loaded.
+            if (!window.location.pathname.includes('/customers.html')) {
+                searchBooks(searchQuery);
+            } else {
+                const filteredBooks = filterBooks(searchQuery);
+                renderBooks(filteredBooks);
+            }
         });
     }
 
@@ -675,6 +737,18 @@ document.addEventListener('DOMContentLoaded', function () {
         fetchUserLoanedBooks();
     }
 
+    // Load the next page of books, or of loans for admins on the loaned_books page, when asked.
+    const loadMoreBooksButton = document.getElementById('loadMoreBooksButton');
+    if (loadMoreBooksButton) {
+        loadMoreBooksButton.addEventListener('click', function () {
+            if (window.location.pathname.includes('/loaned_books.html')) {
+                fetchAllLoanedBooks(token, nextPageCursor);
+            } else {
+                fetchBooksPage(nextPageCursor);
+            }
+        });
+    }
+
     // Filters for books based on the dropdown selection (e.g., all, available, taken).
     document.querySelectorAll('.dropdown-menu a').forEach(item => {
         item.addEventListener('click', function (e) {